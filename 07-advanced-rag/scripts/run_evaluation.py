@@ -49,7 +49,8 @@ def main():
     logger.info("  EMBEDDINGS_MODEL: %s", config.EMBEDDINGS_MODEL)
     logger.info("  LLM_MODEL: %s", config.LLM_MODEL)
     logger.info("  EVALUATION_MAX_CONCURRENT: %s", config.EVALUATION_MAX_CONCURRENT)
-    logger.info("  EVALUATION_DELAY_BETWEEN_REQUESTS: %s", config.EVALUATION_DELAY_BETWEEN_REQUESTS)
+    logger.info("  EVALUATION_REQUESTS_PER_MINUTE: %s", config.EVALUATION_REQUESTS_PER_MINUTE)
+    logger.info("  EVALUATION_TOKENS_PER_MINUTE: %s", config.EVALUATION_TOKENS_PER_MINUTE)
 
     try:
         # Запускаем evaluation
@@ -449,7 +449,8 @@ async def handle_text_message(message: types.Message) -> None:
                 return
         
         retriever = create_retriever_for_mode(semantic_retriever, documents_for_bm25)
-        rag_chain = build_rag_chain(retriever)
+        # Кэш поиска привязан к текущему хранилищу: после /index он сбрасывается
+        rag_chain = build_rag_chain(retriever, cache_namespace=manager.vector_store)
     except ValueError as exc:
         # Ошибка создания retriever (например, отсутствуют документы для hybrid режима)
         logger.error("Ошибка создания retriever для режима %s: %s", config.RAG_MODE, exc)
@@ -109,12 +109,18 @@ if "groq.com" in OPENAI_BASE_URL:
         LLM_MODEL = "openai/gpt-oss-20b"
 # Провайдер LLM: openai (OpenAI-совместимый API) или gigachat (GigaChat от Сбера)
 LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai").lower()
+# Максимум одновременных синхронных вызовов GigaChat (выделенный пул потоков)
+LLM_MAX_CONCURRENT = max(1, _get_int_env("LLM_MAX_CONCURRENT", 8))
 SYSTEM_ROLE = os.getenv("SYSTEM_ROLE", "банковский ассистент")
 CONTEXT_TURNS = _get_int_env("CONTEXT_TURNS", 8)
 # RETRIEVER_K оставлен для обратной совместимости, но рекомендуется использовать SEMANTIC_K/HYBRID_K/RERANKER_K
 RETRIEVER_K = _get_int_env("RETRIEVER_K", 4)
 DATA_PATH = os.getenv("DATA_PATH", "@data")
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# Формат логов: text (человекочитаемый) или json (одна JSON запись на строку, для сборщиков логов)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+if LOG_FORMAT not in ("text", "json"):
+    raise ValueError(f"Недопустимое значение LOG_FORMAT: {LOG_FORMAT}. Допустимые значения: text, json")
 SHOW_SOURCES = _get_bool_env("SHOW_SOURCES", False)
 
 # LangSmith настройки (опционально, для трейсинга и evaluation)
@@ -132,7 +138,8 @@ RAGAS_OPENAI_BASE_URL = os.getenv("RAGAS_OPENAI_BASE_URL") or OPENAI_BASE_URL
 RAGAS_OPENAI_API_KEY = os.getenv("RAGAS_OPENAI_API_KEY") or OPENAI_API_KEY
 # По умолчанию используем huggingface для RAGAS (лучшая совместимость)
 RAGAS_EMBEDDINGS_PROVIDER = os.getenv("RAGAS_EMBEDDINGS_PROVIDER", "huggingface")
-# Провайдер эмбеддингов для основной системы (openai/huggingface/ollama)
+# Провайдер эмбеддингов для основной системы (openai/huggingface/ollama/onnx)
+# onnx - локальная HuggingFace модель на ONNX Runtime (требует optimum[onnxruntime])
 # По умолчанию используется ollama для совместимости с текущей реализацией
 EMBEDDINGS_PROVIDER = os.getenv("EMBEDDINGS_PROVIDER", "ollama")
 
@@ -145,11 +152,56 @@ else:
     # Дефолтные модели в зависимости от провайдера
     if EMBEDDINGS_PROVIDER == "ollama":
         EMBEDDINGS_MODEL = "nomic-embed-text"
-    elif EMBEDDINGS_PROVIDER == "huggingface":
+    elif EMBEDDINGS_PROVIDER in ("huggingface", "onnx"):
         EMBEDDINGS_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
     else:  # openai
         EMBEDDINGS_MODEL = "accounts/fireworks/models/nomic-embed-text-v1"
 
+# Директория для дисковых кэшей (эмбеддинги, ответы LLM)
+CACHE_DIR = os.getenv("CACHE_DIR", "~/.cache/sber-agents")
+# Кэшировать эмбеддинги документов при индексации (повторная индексация того же корпуса не пересчитывает их)
+EMBEDDINGS_CACHE = _get_bool_env("EMBEDDINGS_CACHE", True)
+# Сохранять индекс на диск (эмбеддинги в np.memmap) и загружать его при старте без повторной индексации
+PERSIST_INDEX = _get_bool_env("PERSIST_INDEX", True)
+INDEX_DIR = os.getenv("INDEX_DIR") or os.path.join(CACHE_DIR, "index")
+# Кэшировать ответы LLMClient по содержимому запроса
+# (по умолчанию выключено: при temperature=1.0 ответы перестанут варьироваться)
+LLM_RESPONSE_CACHE = _get_bool_env("LLM_RESPONSE_CACHE", False)
+# Сколько последних результатов поиска (по переписанному запросу) держать в памяти бота; 0 - не кэшировать
+RETRIEVAL_CACHE_SIZE = max(0, _get_int_env("RETRIEVAL_CACHE_SIZE", 256))
+
+# Размер батча при вычислении эмбеддингов для индексации
+# OpenAI-совместимые API принимают до 2048 текстов за запрос, локальная модель эффективнее на больших батчах
+EMBED_BATCH_SIZE = max(1, _get_int_env("EMBED_BATCH_SIZE", 128 if EMBEDDINGS_PROVIDER == "huggingface" else 64))
+# Настройки провайдера onnx: INT8 динамическое квантование весов и пулинг токенов
+# (mean - модели sentence-transformers, cls - модели семейства bge)
+ONNX_QUANTIZE = _get_bool_env("ONNX_QUANTIZE", True)
+ONNX_POOLING = os.getenv("ONNX_POOLING", "mean").lower()
+if ONNX_POOLING not in ("mean", "cls"):
+    raise ValueError(f"Недопустимое значение ONNX_POOLING: {ONNX_POOLING}. Допустимые значения: mean, cls")
+# Максимум параллельных запросов к API эмбеддингов при индексации
+# Фактический уровень подстраивается: после rate limit снижается вдвое, после серии успехов растёт
+INDEXING_MAX_CONCURRENT = max(1, _get_int_env("INDEXING_MAX_CONCURRENT", 8))
+
+# Бэкенд векторного хранилища (memory/faiss)
+# memory - точный поиск перебором по скалярному произведению нормализованных векторов (подходит для небольших корпусов)
+# faiss - приближённый поиск по HNSW индексу FAISS (требует пакет faiss-cpu или faiss-gpu)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "memory").lower()
+if VECTOR_BACKEND not in ("memory", "faiss"):
+    raise ValueError(
+        f"Недопустимое значение VECTOR_BACKEND: {VECTOR_BACKEND}. "
+        "Допустимые значения: memory, faiss"
+    )
+# Количество связей на узел в HNSW графе FAISS (больше = точнее, но больше памяти)
+FAISS_HNSW_M = _get_int_env("FAISS_HNSW_M", 32)
+# Квантование векторов в индексе FAISS (none/fp16/int8): меньше памяти и быстрее поиск ценой небольшой потери точности
+FAISS_QUANTIZATION = os.getenv("FAISS_QUANTIZATION", "none").lower()
+if FAISS_QUANTIZATION not in ("none", "fp16", "int8"):
+    raise ValueError(
+        f"Недопустимое значение FAISS_QUANTIZATION: {FAISS_QUANTIZATION}. "
+        "Допустимые значения: none, fp16, int8"
+    )
+
 # RAGAS модель эмбеддингов (зависит от RAGAS_EMBEDDINGS_PROVIDER)
 # Если не указана явно, выбирается автоматически в зависимости от RAGAS_EMBEDDINGS_PROVIDER
 # Если RAGAS_EMBEDDINGS_PROVIDER совпадает с EMBEDDINGS_PROVIDER, используется EMBEDDINGS_MODEL
@@ -176,8 +228,14 @@ else:
 HUGGINGFACE_DEVICE = os.getenv("HUGGINGFACE_DEVICE", "cpu")
 # Папка для кэширования HuggingFace моделей (None = использовать дефолтный кэш)
 HUGGINGFACE_CACHE_FOLDER = os.getenv("HUGGINGFACE_CACHE_FOLDER") or None
-# Нормализация эмбеддингов для HuggingFace (true/false)
+# Нормализация эмбеддингов HuggingFace для RAGAS (true/false); векторы индекса нормализуются всегда
 HUGGINGFACE_NORMALIZE_EMBEDDINGS = _get_bool_env("HUGGINGFACE_NORMALIZE_EMBEDDINGS", True)
+# Размер батча при вычислении эмбеддингов RAGAS локальной HuggingFace моделью
+RAGAS_EMBEDDINGS_BATCH_SIZE = _get_int_env("RAGAS_EMBEDDINGS_BATCH_SIZE", 64)
+# Максимальная длина последовательности для эмбеддингов RAGAS (тексты evaluation короткие)
+RAGAS_EMBEDDINGS_MAX_SEQ_LENGTH = _get_int_env("RAGAS_EMBEDDINGS_MAX_SEQ_LENGTH", 256)
+# Вычислять эмбеддинги RAGAS в FP16 (используется только на GPU: HUGGINGFACE_DEVICE=cuda)
+RAGAS_EMBEDDINGS_FP16 = _get_bool_env("RAGAS_EMBEDDINGS_FP16", True)
 
 # Настройки для evaluation (параллельная обработка)
 # Количество одновременных запросов при evaluation (больше = быстрее, но больше нагрузка на API)
@@ -199,12 +257,41 @@ if "groq.com" in OPENAI_BASE_URL:
             "EVALUATION_DELAY_BETWEEN_REQUESTS увеличен до 3.0 секунд."
         )
         EVALUATION_DELAY_BETWEEN_REQUESTS = 3.0
+# Лимиты token bucket при evaluation (уточняются по заголовкам x-ratelimit-* от провайдера)
+# По умолчанию количество запросов в минуту выводится из EVALUATION_DELAY_BETWEEN_REQUESTS
+_default_requests_per_minute = (
+    60.0 / EVALUATION_DELAY_BETWEEN_REQUESTS if EVALUATION_DELAY_BETWEEN_REQUESTS > 0 else 60.0
+)
+EVALUATION_REQUESTS_PER_MINUTE = float(os.getenv("EVALUATION_REQUESTS_PER_MINUTE", str(_default_requests_per_minute)))
+# Количество токенов в минуту (0 = без ограничения по токенам)
+EVALUATION_TOKENS_PER_MINUTE = _get_int_env(
+    "EVALUATION_TOKENS_PER_MINUTE", 6000 if "groq.com" in OPENAI_BASE_URL else 0
+)
 # Максимальное количество примеров для обработки (0 = без ограничений, для тестирования можно ограничить)
 EVALUATION_MAX_EXAMPLES = int(os.getenv("EVALUATION_MAX_EXAMPLES", "0"))
+# Кэшировать найденные retriever'ом документы между прогонами evaluation (true/false)
+# Полезно, когда меняется только LLM или набор метрик; после переиндексации кэш нужно очистить
+EVALUATION_CACHE_RETRIEVAL = _get_bool_env("EVALUATION_CACHE_RETRIEVAL", False)
+# Сохранять ответы RAG в JSONL checkpoint и продолжать с него после сбоя (true/false)
+# Checkpoint привязан к датасету и конфигурации RAG; повторный прогон переиспользует готовые ответы
+EVALUATION_CHECKPOINT = _get_bool_env("EVALUATION_CHECKPOINT", False)
+# Кэшировать эмбеддинги RAGAS метрик на диске (true/false)
+EVALUATION_CACHE_EMBEDDINGS = _get_bool_env("EVALUATION_CACHE_EMBEDDINGS", True)
+# Директория для кэшей evaluation
+EVALUATION_CACHE_DIR = os.getenv("EVALUATION_CACHE_DIR", CACHE_DIR)
 # Оптимизация RAGAS: использовать только основные метрики для ускорения (true/false)
 # Если True, вычисляются только faithfulness, answer_relevancy, answer_similarity (быстрее)
 # Если False, вычисляются все 6 метрик (медленнее, но полнее)
 EVALUATION_FAST_MODE = _get_bool_env("EVALUATION_FAST_MODE", False)
+# Количество шардов датасета, на которых RAGAS метрики считаются параллельно (1 = без шардирования)
+# Каждый шард использует собственный RunConfig, поэтому нагрузка на API растёт пропорционально
+EVALUATION_METRIC_SHARDS = max(1, _get_int_env("EVALUATION_METRIC_SHARDS", 1))
+if "groq.com" in RAGAS_OPENAI_BASE_URL and EVALUATION_METRIC_SHARDS > 1:
+    logger.warning(
+        "Groq имеет строгие rate limits (TPM=6000). EVALUATION_METRIC_SHARDS понижен с %s до 1.",
+        EVALUATION_METRIC_SHARDS,
+    )
+    EVALUATION_METRIC_SHARDS = 1
 
 # Advanced RAG настройки (опционально, для hybrid retrieval и reranking)
 # Режим работы RAG pipeline (semantic/hybrid/hybrid+reranker)
@@ -227,6 +314,9 @@ BM25_K = _get_int_env("BM25_K", RETRIEVER_K if RETRIEVER_K == 4 else 4)
 # Финальное количество документов после объединения semantic и BM25 в hybrid режиме
 HYBRID_K = _get_int_env("HYBRID_K", RETRIEVER_K if RETRIEVER_K == 4 else 4)
 
+# Сглаживающая константа Reciprocal Rank Fusion в hybrid режиме: score = Σ 1 / (HYBRID_RRF_K + rank)
+HYBRID_RRF_K = _get_int_env("HYBRID_RRF_K", 60)
+
 # Финальное количество документов после reranking в hybrid+reranker режиме
 RERANKER_K = _get_int_env("RERANKER_K", RETRIEVER_K if RETRIEVER_K == 4 else 4)
 
@@ -245,3 +335,7 @@ if CROSSENCODER_PROVIDER not in ("huggingface",):
         f"Недопустимое значение CROSSENCODER_PROVIDER: {CROSSENCODER_PROVIDER}. "
         "Поддерживается только: huggingface"
     )
+# Размер батча пар (запрос, документ) при reranking
+CROSSENCODER_BATCH_SIZE = _get_int_env("CROSSENCODER_BATCH_SIZE", 32)
+# Cross-Encoder в FP16 (используется только на GPU: HUGGINGFACE_DEVICE=cuda)
+CROSSENCODER_FP16 = _get_bool_env("CROSSENCODER_FP16", True)
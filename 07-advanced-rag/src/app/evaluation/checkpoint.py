@@ -0,0 +1,72 @@
+"""JSONL checkpoint результатов RAG для возобновления evaluation после сбоя."""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+from pathlib import Path
+
+from langchain_core.retrievers import BaseRetriever
+
+from src.app import config
+from src.app.evaluation.retriever_cache import retriever_config_hash
+
+logger = logging.getLogger(__name__)
+
+
+def default_checkpoint_path(dataset_name: str, retriever: BaseRetriever | None) -> Path:
+    """Возвращает путь checkpoint'а для датасета и текущей конфигурации RAG.
+
+    Ответы зависят и от retrieval, и от LLM, поэтому прогоны с разными настройками
+    пишут в разные файлы и не смешиваются.
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    for part in (
+        retriever_config_hash(retriever),
+        config.LLM_PROVIDER,
+        config.LLM_MODEL,
+        config.OPENAI_BASE_URL,
+        config.SYSTEM_ROLE,
+    ):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    safe_name = "".join(ch if ch.isalnum() or ch in "-_" else "_" for ch in dataset_name)
+    cache_dir = Path(config.EVALUATION_CACHE_DIR).expanduser()
+    return cache_dir / f".ragas_ckpt_{safe_name}_{digest.hexdigest()}.jsonl"
+
+
+class RagCheckpoint:
+    """Построчный журнал (idx, question, answer, contexts) успешно обработанных примеров."""
+
+    def __init__(self, path: Path):
+        self._path = Path(path)
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = asyncio.Lock()
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def load(self) -> dict[int, dict]:
+        """Читает сохранённые результаты. Повреждённые строки (например, оборванные при сбое) пропускаются."""
+        if not self._path.exists():
+            return {}
+
+        done: dict[int, dict] = {}
+        with self._path.open(encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                    done[int(record["idx"])] = record
+                except (ValueError, KeyError, TypeError):
+                    continue
+        logger.info("Загружен checkpoint %s: %s сохранённых примеров", self._path, len(done))
+        return done
+
+    async def append(self, idx: int, question: str, answer: str, contexts: list[str]) -> None:
+        record = {"idx": idx, "question": question, "answer": answer, "contexts": contexts}
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        async with self._lock:
+            with self._path.open("a", encoding="utf-8", buffering=1) as file:
+                file.write(line)
@@ -3,13 +3,21 @@ from __future__ import annotations
 
 import asyncio
 import logging
+import math
 import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable
 
+import numpy as np
 from datasets import Dataset
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
 from langchain_core.retrievers import BaseRetriever
 from ragas import evaluate, RunConfig
+from ragas.dataset_schema import EvaluationDataset, EvaluationResult
 from ragas.metrics import (
     AnswerCorrectness,
     AnswerRelevancy,
@@ -19,15 +27,73 @@ from ragas.metrics import (
     Faithfulness,
 )
 
+try:
+    from openai import APIConnectionError, RateLimitError
+except ImportError:
+    APIConnectionError = RateLimitError = None
+
 from src.app import config
+from src.app.evaluation.checkpoint import RagCheckpoint, default_checkpoint_path
+from src.app.evaluation.lazy import Lazy
+from src.app.evaluation.rate_limiter import RateLimiter
+from src.app.evaluation.retriever_cache import CachedRetriever, RetrieverCache, retriever_config_hash
+from src.app.indexing.embeddings_cache import CachedEmbeddings
 from src.app.indexing.vector_store import get_vector_store_manager
 from src.app.rag.chain import build_rag_chain
 
 logger = logging.getLogger(__name__)
 
+# Оценка длины ответа LLM в токенах для token bucket (совпадает с max_tokens в LLMClient)
+_ESTIMATED_COMPLETION_TOKENS = 1000
+
+# Признаки rate limit в тексте ошибки (для провайдеров, которые не используют RateLimitError)
+_RATE_LIMIT_MARKERS = ("rate limit", "429", "too many requests")
+# Временные ошибки, которые раньше повторял OpenAI SDK (клиент evaluation создаётся с max_retries=0):
+# обрыв соединения и таймаут (APIConnectionError, APITimeoutError), 408, 409 и 5xx
+_TRANSIENT_STATUS_CODES = frozenset({408, 409})
+# Пауза перед повтором после временной ошибки: 0.5, 1, 2... секунд (как в OpenAI SDK), не больше 8
+_TRANSIENT_RETRY_BASE_DELAY = 0.5
+_TRANSIENT_RETRY_MAX_DELAY = 8.0
+
+# Таймаут запросов к LangSmith API в миллисекундах
+_LANGSMITH_TIMEOUT_MS = 30_000
+# Сколько секунд метаданные датасета LangSmith считаются актуальными
+_DATASET_INFO_TTL_SECONDS = 300.0
+
+# Кэши LangSmith между вызовами evaluation в одном процессе:
+# имя датасета -> (время запроса, метаданные) и имя датасета -> (версия, примеры)
+_dataset_info_cache: dict[str, tuple[float, Any]] = {}
+_examples_cache: dict[str, tuple[tuple, list[Any]]] = {}
+
 
 def _get_ragas_embeddings():
-    """Возвращает эмбеддинги для RAGAS в зависимости от провайдера."""
+    """Возвращает эмбеддинги для RAGAS, обёрнутые в персистентный кэш (если включён)."""
+    embeddings = _build_ragas_embeddings()
+    if not config.EVALUATION_CACHE_EMBEDDINGS:
+        return embeddings
+    # Вопросы, ответы и эталоны повторяются между прогонами - не пересчитываем их эмбеддинги
+    model_name = f"{config.RAGAS_EMBEDDINGS_PROVIDER.lower()}:{config.RAGAS_EMBEDDING_MODEL}"
+    return CachedEmbeddings(embeddings, model_name=model_name, cache_dir=config.EVALUATION_CACHE_DIR)
+
+
+def _hf_model_kwargs() -> dict:
+    """Параметры загрузки SentenceTransformer для эмбеддингов RAGAS.
+
+    FP16 включается только на GPU: на CPU половинная точность не ускоряет инференс.
+    """
+    if config.RAGAS_EMBEDDINGS_FP16 and config.HUGGINGFACE_DEVICE.startswith("cuda"):
+        return {"model_kwargs": {"torch_dtype": "float16"}}
+    return {}
+
+
+def _limit_max_seq_length(model) -> None:
+    """Ограничивает длину последовательности SentenceTransformer, чтобы не считать паддинг."""
+    if model is not None and config.RAGAS_EMBEDDINGS_MAX_SEQ_LENGTH > 0:
+        model.max_seq_length = config.RAGAS_EMBEDDINGS_MAX_SEQ_LENGTH
+
+
+def _build_ragas_embeddings():
+    """Создаёт эмбеддинги для RAGAS в зависимости от провайдера."""
     provider = config.RAGAS_EMBEDDINGS_PROVIDER.lower()
 
     if provider == "openai":
@@ -104,7 +170,12 @@ def _get_ragas_embeddings():
             try:
                 base_ragas_embeddings = RAGASHuggingFaceEmbeddings(
                     model=model_path,
+                    device=config.HUGGINGFACE_DEVICE,
+                    normalize_embeddings=config.HUGGINGFACE_NORMALIZE_EMBEDDINGS,
+                    batch_size=config.RAGAS_EMBEDDINGS_BATCH_SIZE,
+                    **_hf_model_kwargs(),
                 )
+                _limit_max_seq_length(getattr(base_ragas_embeddings, "model_instance", None))
                 # RAGAS HuggingFaceEmbeddings использует embed_text/embed_texts,
                 # но RAGAS метрики ожидают embed_query/embed_documents
                 # Создаем обертку для совместимости
@@ -161,8 +232,11 @@ def _get_ragas_embeddings():
             from langchain_huggingface import HuggingFaceEmbeddings
             from langchain_core.embeddings import Embeddings
 
-            model_kwargs = {"device": config.HUGGINGFACE_DEVICE}
-            encode_kwargs = {"normalize_embeddings": config.HUGGINGFACE_NORMALIZE_EMBEDDINGS}
+            model_kwargs = {"device": config.HUGGINGFACE_DEVICE, **_hf_model_kwargs()}
+            encode_kwargs = {
+                "normalize_embeddings": config.HUGGINGFACE_NORMALIZE_EMBEDDINGS,
+                "batch_size": config.RAGAS_EMBEDDINGS_BATCH_SIZE,
+            }
 
             kwargs = {
                 "model_name": config.RAGAS_EMBEDDING_MODEL,
@@ -174,6 +248,7 @@ def _get_ragas_embeddings():
                 kwargs["cache_folder"] = config.HUGGINGFACE_CACHE_FOLDER
 
             base_embeddings = HuggingFaceEmbeddings(**kwargs)
+            _limit_max_seq_length(getattr(base_embeddings, "_client", None))
             
             # Создаем обертку для совместимости с RAGAS (добавляем embed_query)
             class RAGASCompatibleEmbeddings(Embeddings):
@@ -230,25 +305,60 @@ def _get_ragas_llm():
         )
 
 
-def _load_dataset_from_langsmith(dataset_name: str) -> Dataset | None:
-    """Загружает датасет из LangSmith с обработкой ошибок подключения."""
+@lru_cache(maxsize=1)
+def _get_langsmith_client():
+    """Возвращает общий клиент LangSmith (HTTP сессия переиспользуется между вызовами)."""
+    from langsmith import Client
+
+    # Ограничиваем таймаут: повторные попытки при сбоях подключения делаются вызывающим кодом
+    return Client(api_key=config.LANGSMITH_API_KEY, timeout_ms=_LANGSMITH_TIMEOUT_MS)
+
+
+def _read_dataset_info(dataset_name: str):
+    """Возвращает метаданные датасета LangSmith, повторный запрос - не чаще раза в _DATASET_INFO_TTL_SECONDS."""
+    import time
+
+    cached = _dataset_info_cache.get(dataset_name)
+    if cached is not None and time.monotonic() - cached[0] < _DATASET_INFO_TTL_SECONDS:
+        return cached[1]
+    dataset_info = _get_langsmith_client().read_dataset(dataset_name=dataset_name)
+    _dataset_info_cache[dataset_name] = (time.monotonic(), dataset_info)
+    return dataset_info
+
+
+def _dataset_version(dataset_info) -> tuple | None:
+    """Версия датасета для кэша примеров (None - метаданные не позволяют её определить)."""
+    modified_at = getattr(dataset_info, "modified_at", None)
+    if modified_at is None:
+        return None
+    return (modified_at, getattr(dataset_info, "example_count", None))
+
+
+def _load_dataset_from_langsmith(dataset_name: str, examples_out: list[Any] | None = None) -> Dataset | None:
+    """Загружает датасет из LangSmith с обработкой ошибок подключения.
+
+    Args:
+        dataset_name: Название датасета в LangSmith
+        examples_out: Список, в который складываются загруженные примеры LangSmith
+            (позволяет переиспользовать их без повторного запроса list_examples)
+    """
     if not config.LANGSMITH_API_KEY:
         logger.warning("LANGSMITH_API_KEY не установлен. Невозможно загрузить датасет из LangSmith.")
         return None
 
     try:
-        from langsmith import Client
         import time
 
-        client = Client(api_key=config.LANGSMITH_API_KEY)
+        client = _get_langsmith_client()
 
         # Проверяем существование датасета с повторными попытками
         max_retries = 3
         retry_delay = 2.0
+        dataset_info = None
         
         for attempt in range(max_retries):
             try:
-                dataset_info = client.read_dataset(dataset_name=dataset_name)
+                dataset_info = _read_dataset_info(dataset_name)
                 logger.info("Найден датасет '%s' в LangSmith", dataset_name)
                 break
             except Exception as exc:
@@ -273,11 +383,40 @@ def _load_dataset_from_langsmith(dataset_name: str) -> Dataset | None:
                     logger.error("Датасет '%s' не найден в LangSmith: %s", dataset_name, exc)
                     return None
 
+        # Примеры не менялись с прошлой загрузки (та же версия датасета) - list_examples не вызываем
+        version = _dataset_version(dataset_info)
+        cached_examples = _examples_cache.get(dataset_name)
+        if version is not None and cached_examples is not None and cached_examples[0] == version:
+            logger.info("Примеры датасета '%s' взяты из кэша (датасет не изменялся)", dataset_name)
+            example_source = cached_examples[1]
+        else:
+            example_source = None
+
         # Загружаем примеры из датасета с повторными попытками
+        # Страницы list_examples обрабатываются по мере получения, сразу в формат для RAGAS
         retry_delay = 2.0
         for attempt in range(max_retries):
+            data = {
+                "question": [],
+                "ground_truths": [],
+                "reference": [],  # Требуется для AnswerCorrectness
+            }
+            examples = []
             try:
-                examples = list(client.list_examples(dataset_name=dataset_name))
+                source = example_source
+                if source is None:
+                    source = client.list_examples(dataset_name=dataset_name)
+                for example in source:
+                    inputs = example.inputs or {}
+                    outputs = example.outputs or {}
+                    data["question"].append(inputs.get("question", ""))
+                    # ground_truths - это эталонные ответы из датасета (список для ContextRecall)
+                    ground_truth = outputs.get("answer", "")
+                    ground_truth_list = [ground_truth] if ground_truth else [""]
+                    data["ground_truths"].append(ground_truth_list)
+                    # reference - эталонный ответ для AnswerCorrectness (строка, первый из ground_truths)
+                    data["reference"].append(ground_truth_list[0])
+                    examples.append(example)
                 break
             except Exception as exc:
                 error_str = str(exc).lower()
@@ -301,27 +440,14 @@ def _load_dataset_from_langsmith(dataset_name: str) -> Dataset | None:
                     logger.error("Не удалось загрузить примеры из датасета '%s': %s", dataset_name, exc)
                     return None
 
-        if not examples:
+        if not data["question"]:
             logger.warning("Датасет '%s' пуст", dataset_name)
             return None
 
-        # Преобразуем в формат для RAGAS
-        data = {
-            "question": [],
-            "ground_truths": [],
-            "reference": [],  # Требуется для AnswerCorrectness
-        }
-
-        for example in examples:
-            inputs = example.inputs or {}
-            outputs = example.outputs or {}
-            data["question"].append(inputs.get("question", ""))
-            # ground_truths - это эталонные ответы из датасета (список для ContextRecall)
-            ground_truth = outputs.get("answer", "")
-            ground_truth_list = [ground_truth] if ground_truth else [""]
-            data["ground_truths"].append(ground_truth_list)
-            # reference - эталонный ответ для AnswerCorrectness (строка, первый из ground_truths)
-            data["reference"].append(ground_truth_list[0] if ground_truth_list else "")
+        if version is not None:
+            _examples_cache[dataset_name] = (version, examples)
+        if examples_out is not None:
+            examples_out.extend(examples)
 
         dataset = Dataset.from_dict(data)
         logger.info("Загружено %s примеров из датасета '%s'", len(dataset), dataset_name)
@@ -335,80 +461,167 @@ def _load_dataset_from_langsmith(dataset_name: str) -> Dataset | None:
         return None
 
 
+class _RateLimitHeadersCallback(BaseCallbackHandler):
+    """Передаёт заголовки ответов LLM (x-ratelimit-*, retry-after) в rate limiter."""
+
+    def __init__(self, limiter: RateLimiter):
+        self._limiter = limiter
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                headers = getattr(message, "response_metadata", {}).get("headers") if message else None
+                if headers:
+                    self._limiter.update_from_headers(headers)
+
+
+def _is_rate_limit(exc: Exception) -> bool:
+    """Проверяет, является ли исключение ошибкой rate limit (429)."""
+    if RateLimitError is not None and isinstance(exc, RateLimitError):
+        return True
+    if getattr(exc, "status_code", None) == 429:
+        return True
+    message = str(exc).lower()
+    return any(marker in message for marker in _RATE_LIMIT_MARKERS)
+
+
+def _is_transient(exc: Exception) -> bool:
+    """Проверяет, является ли исключение временной ошибкой провайдера (соединение, таймаут, 5xx)."""
+    if APIConnectionError is not None and isinstance(exc, APIConnectionError):
+        return True
+    status_code = getattr(exc, "status_code", None)
+    return isinstance(status_code, int) and (status_code >= 500 or status_code in _TRANSIENT_STATUS_CODES)
+
+
+def _transient_retry_delay(attempt: int) -> float:
+    """Экспоненциальная пауза со случайным разбросом (jitter), чтобы воркеры не повторяли запросы разом."""
+    delay = min(_TRANSIENT_RETRY_BASE_DELAY * 2**attempt, _TRANSIENT_RETRY_MAX_DELAY)
+    return delay * (1 - 0.25 * random.random())
+
+
+def _get_retry_after(exc: Exception) -> float | None:
+    """Извлекает retry-after из ответа провайдера, приложенного к исключению."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
 async def _process_single_example(
     rag_chain: Any,
     example: dict,
     idx: int,
     total: int,
-    semaphore: asyncio.Semaphore,
-    delay: float = 0.5,
-    max_retries: int = 3,  # Уменьшено до 3, так как OpenAI клиент уже делает свои retry
+    limiter: RateLimiter,
+    max_retries: int = 3,  # Повторы после 429 и временных ошибок здесь: клиент evaluation создаётся с max_retries=0
+    checkpoint: RagCheckpoint | None = None,
 ) -> tuple[str, list[str]]:
     """Обрабатывает один пример датасета через RAG pipeline с retry логикой."""
-    async with semaphore:
-        question = example["question"]
-        logger.info("Обработка примера %s/%s: %s", idx, total, question[:50] + "...")
+    question = example["question"]
+    logger.info("Обработка примера %s/%s: %s", idx, total, question[:50] + "...")
 
-        # Retry логика для обработки rate limit ошибок
-        for attempt in range(max_retries):
-            try:
-                # Запускаем RAG в отдельном потоке, чтобы не блокировать event loop
-                result = await asyncio.to_thread(
-                    rag_chain.invoke,
-                    {"input": question, "chat_history": []}
-                )
-                answer = result.get("answer", "")
-                documents = result.get("context", [])
+    estimated_tokens = len(question) // 4 + _ESTIMATED_COMPLETION_TOKENS
+    callbacks = [_RateLimitHeadersCallback(limiter)]
 
-                # Извлекаем контексты из документов
-                contexts = [doc.page_content for doc in documents] if documents else [""]
+    # Retry логика для обработки rate limit ошибок
+    for attempt in range(max_retries):
+        await limiter.acquire(estimated_tokens)
+        try:
+            # LCEL цепочка поддерживает нативный async: HTTP вызовы идут через event loop без пула потоков
+            result = await rag_chain.ainvoke(
+                {"input": question, "chat_history": []},
+                {"callbacks": callbacks},
+            )
+            answer = result.get("answer", "")
+            documents = result.get("context", [])
 
-                # Задержка после каждого успешного запроса для избежания rate limits
-                if delay > 0:
-                    await asyncio.sleep(delay)
+            # Извлекаем контексты из документов
+            contexts = [doc.page_content for doc in documents] if documents else [""]
 
-                return answer, contexts
-            except Exception as exc:
-                # Проверяем, является ли это rate limit ошибкой
-                is_rate_limit = False
-                try:
-                    from openai import RateLimitError
-                    is_rate_limit = isinstance(exc, RateLimitError) or (
-                        hasattr(exc, "status_code") and exc.status_code == 429
-                    ) or "rate limit" in str(exc).lower() or "429" in str(exc)
-                except ImportError:
-                    # Если не можем импортировать, проверяем по строке
-                    is_rate_limit = "rate limit" in str(exc).lower() or "429" in str(exc)
-
-                if is_rate_limit and attempt < max_retries - 1:
-                    # Экспоненциальная задержка с базовой задержкой 60 секунд для OpenRouter
-                    # OpenAI клиент уже делает свои retry (до 3 попыток), поэтому здесь нужна более длительная задержка
-                    # 60, 120, 240 секунд для более надежной обработки rate limits
-                    retry_delay = 60.0 * (2 ** attempt)
-                    logger.warning(
-                        "Rate limit при обработке примера %s/%s (попытка %s/%s). "
-                        "OpenAI клиент уже сделал свои retry. Ожидание %s секунд перед следующей попыткой...",
-                        idx,
-                        total,
-                        attempt + 1,
-                        max_retries,
-                        retry_delay,
-                    )
-                    await asyncio.sleep(retry_delay)
-                    continue
-                else:
-                    # Если это не rate limit или закончились попытки
-                    logger.warning("Ошибка при обработке примера %s/%s: %s", idx, total, exc)
-                    return "", [""]
+            if checkpoint is not None:
+                await checkpoint.append(idx, question, answer, contexts)
 
-        # Если все попытки исчерпаны
-        logger.warning("Не удалось обработать пример %s/%s после %s попыток", idx, total, max_retries)
-        return "", [""]
+            return answer, contexts
+        except Exception as exc:
+            if _is_rate_limit(exc) and attempt < max_retries - 1:
+                # Пауза берётся из retry-after провайдера (или экспоненциальная, если заголовка нет)
+                # и применяется ко всем запросам через общий бакет
+                retry_delay = limiter.penalize(_get_retry_after(exc))
+                logger.warning(
+                    "Rate limit при обработке примера %s/%s (попытка %s/%s). "
+                    "Повторная попытка через %.1f секунд...",
+                    idx,
+                    total,
+                    attempt + 1,
+                    max_retries,
+                    retry_delay,
+                )
+                continue
+            elif _is_transient(exc) and attempt < max_retries - 1:
+                # Сбой соединения или сервера не означает исчерпанную квоту: общий бакет не блокируем,
+                # повторяем только этот пример после паузы
+                retry_delay = _transient_retry_delay(attempt)
+                logger.warning(
+                    "Временная ошибка при обработке примера %s/%s (попытка %s/%s): %s. "
+                    "Повторная попытка через %.1f секунд...",
+                    idx,
+                    total,
+                    attempt + 1,
+                    max_retries,
+                    exc,
+                    retry_delay,
+                )
+                await asyncio.sleep(retry_delay)
+                continue
+            else:
+                # Если это не rate limit или закончились попытки
+                logger.warning("Ошибка при обработке примера %s/%s: %s", idx, total, exc)
+                return "", [""]
 
+    # Если все попытки исчерпаны
+    logger.warning("Не удалось обработать пример %s/%s после %s попыток", idx, total, max_retries)
+    return "", [""]
 
-def _run_rag_on_dataset(dataset: Dataset, retriever: BaseRetriever) -> Dataset:
-    """Запускает RAG pipeline на всех примерах датасета с параллельной обработкой."""
-    rag_chain = build_rag_chain(retriever)
+
+def _run_rag_on_dataset(
+    dataset: Dataset,
+    retriever: BaseRetriever | None,
+    dataset_name: str | None = None,
+    checkpoint_path: Path | None = None,
+) -> Dataset:
+    """Запускает RAG pipeline на всех примерах датасета с параллельной обработкой.
+
+    Args:
+        dataset: Датасет с вопросами
+        retriever: Retriever для RAG (если None, используется из vector_store_manager)
+        dataset_name: Название датасета (используется для кэша retrieval и checkpoint'а)
+        checkpoint_path: Путь JSONL checkpoint'а (если None и EVALUATION_CHECKPOINT=true,
+            используется путь по умолчанию для датасета и конфигурации)
+    """
+    if checkpoint_path is None and config.EVALUATION_CHECKPOINT and dataset_name:
+        checkpoint_path = default_checkpoint_path(dataset_name, retriever)
+    checkpoint = RagCheckpoint(checkpoint_path) if checkpoint_path else None
+
+    cached_retriever = None
+
+    def _build_chain():
+        # Retriever и цепочка создаются только при первом примере, которого нет в checkpoint'е:
+        # при полностью сохранённых ответах модель эмбеддингов и хранилище не загружаются
+        nonlocal cached_retriever
+        rag_retriever = retriever or get_vector_store_manager().get_retriever()
+        if config.EVALUATION_CACHE_RETRIEVAL and dataset_name:
+            # При повторных прогонах документы берутся из кэша, LLM вызывается как обычно
+            cache = RetrieverCache(dataset_name, retriever_config_hash(rag_retriever))
+            rag_retriever = cached_retriever = CachedRetriever(rag_retriever, cache)
+        # Заголовки x-ratelimit-* и 429 без внутренних retry SDK нужны token bucket'у
+        return build_rag_chain(rag_retriever, rate_limit_headers=True)
+
+    rag_chain = Lazy(_build_chain)
 
     # Ограничиваем количество примеров, если задано в конфиге (для тестирования)
     total_examples = len(dataset)
@@ -424,62 +637,137 @@ def _run_rag_on_dataset(dataset: Dataset, retriever: BaseRetriever) -> Dataset:
 
     logger.info("Запуск RAG на %s примерах датасета", total_examples)
 
-    # Параллельная обработка с ограничением concurrency
-    # Параметры настраиваются через переменные окружения
-    max_concurrent = config.EVALUATION_MAX_CONCURRENT
-    delay_between_requests = config.EVALUATION_DELAY_BETWEEN_REQUESTS
-    
+    # Параллельная обработка, темп которой задаёт token bucket
+    # Лимиты настраиваются через переменные окружения и уточняются по заголовкам провайдера
+    requests_per_minute = config.EVALUATION_REQUESTS_PER_MINUTE
+    tokens_per_minute = config.EVALUATION_TOKENS_PER_MINUTE
+    max_concurrent = max(1, config.EVALUATION_MAX_CONCURRENT)
+
     logger.info(
-        "Параметры параллельной обработки: max_concurrent=%s, delay=%s сек",
+        "Параметры параллельной обработки: max_concurrent=%s, requests_per_minute=%s, tokens_per_minute=%s",
         max_concurrent,
-        delay_between_requests
+        requests_per_minute,
+        tokens_per_minute or "без ограничения",
     )
 
     async def process_all():
-        semaphore = asyncio.Semaphore(max_concurrent)
-        tasks = []
+        limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        answers = [""] * total_examples
+        contexts_list = [[""] for _ in range(total_examples)]
 
+        # Примеры, уже обработанные в прошлом (прерванном) прогоне, берём из checkpoint'а
+        done = checkpoint.load() if checkpoint else {}
+        pending = []
         for idx, example in enumerate(dataset, 1):
-            task = _process_single_example(
-                rag_chain,
-                example,
-                idx,
+            saved = done.get(idx)
+            if saved is not None and saved.get("question") == example["question"]:
+                answers[idx - 1] = saved["answer"]
+                contexts_list[idx - 1] = saved["contexts"]
+            else:
+                pending.append((idx, example))
+
+        if done:
+            logger.info(
+                "Восстановлено из checkpoint: %s/%s примеров, осталось обработать: %s",
+                total_examples - len(pending),
                 total_examples,
-                semaphore,
-                delay_between_requests,
+                len(pending),
             )
-            tasks.append(task)
 
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+        # Одинаковые вопросы обрабатываем один раз и раздаём результат всем их индексам
+        unique: dict[str, list[int]] = {}
+        first_examples = []
+        for idx, example in pending:
+            indices = unique.setdefault(example["question"], [])
+            if not indices:
+                first_examples.append((idx, example))
+            indices.append(idx)
 
-        answers = []
-        contexts_list = []
+        if pending and len(unique) < len(pending):
+            logger.info(
+                "Дедупликация вопросов: %s уникальных из %s (%.0f%%)",
+                len(unique),
+                len(pending),
+                100 * len(unique) / len(pending),
+            )
 
-        for result in results:
-            if isinstance(result, Exception):
-                logger.warning("Ошибка при обработке примера: %s", result)
-                answers.append("")
-                contexts_list.append([""])
-            else:
-                answer, contexts = result
-                answers.append(answer)
-                contexts_list.append(contexts)
+        # Пул воркеров: одновременно в работе не больше max_concurrent примеров,
+        # корутины для остальных создаются по мере освобождения воркеров
+        queue: asyncio.Queue = asyncio.Queue()
+        for item in first_examples:
+            queue.put_nowait(item)
+
+        # Цепочка строится один раз до запуска воркеров (и только если есть что обрабатывать):
+        # ошибка сборки retriever'а или LLM прерывает evaluation, а не превращается в пустые ответы
+        chain = rag_chain() if first_examples else None
+
+        async def worker():
+            while True:
+                try:
+                    first_idx, example = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    answer, contexts = await _process_single_example(
+                        chain,
+                        example,
+                        first_idx,
+                        total_examples,
+                        limiter,
+                        checkpoint=checkpoint,
+                    )
+                except Exception as exc:
+                    logger.warning("Ошибка при обработке примера: %s", exc)
+                    continue
+                for idx in unique[example["question"]]:
+                    answers[idx - 1], contexts_list[idx - 1] = answer, contexts
+                    if checkpoint is not None and idx != first_idx:
+                        await checkpoint.append(idx, example["question"], answer, contexts)
+
+        workers = [asyncio.create_task(worker()) for _ in range(min(max_concurrent, len(first_examples)))]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            # При прерывании (KeyboardInterrupt/отмена) останавливаем оставшихся воркеров;
+            # готовые ответы уже сохранены в checkpoint
+            for task in workers:
+                task.cancel()
 
         return answers, contexts_list
 
     # Запускаем асинхронную обработку
     answers, contexts_list = asyncio.run(process_all())
 
+    if not rag_chain.built:
+        logger.info("Все ответы восстановлены из checkpoint, retriever и RAG цепочка не создавались")
+
+    if cached_retriever is not None:
+        logger.info(
+            "Кэш retrieval: попаданий=%s, промахов=%s",
+            cached_retriever.hits,
+            cached_retriever.misses,
+        )
+
     # Обновляем датасет с результатами RAG
     # RAGAS ожидает answer и contexts в датасете
-    dataset = dataset.add_column("answer", answers)
-    dataset = dataset.add_column("contexts", contexts_list)
+    # Собираем новый датасет за один проход вместо двух копирований таблицы через add_column
+    data = dataset.to_dict()
+    data["answer"] = answers
+    data["contexts"] = contexts_list
+    dataset = Dataset.from_dict(data)
 
     # Диагностическое логирование: проверяем валидность данных после RAG
-    empty_answers = sum(1 for a in answers if not a or not a.strip())
-    empty_contexts = sum(1 for ctx_list in contexts_list if not ctx_list or all(not c or not c.strip() for c in ctx_list))
-    avg_answer_length = sum(len(a) for a in answers) / len(answers) if answers else 0
-    avg_contexts_count = sum(len(ctx_list) for ctx_list in contexts_list) / len(contexts_list) if contexts_list else 0
+    # Вся статистика собирается за один проход по результатам
+    empty_answers = empty_contexts = answer_length_sum = contexts_count_sum = 0
+    for answer, ctx_list in zip(answers, contexts_list):
+        answer_length_sum += len(answer)
+        contexts_count_sum += len(ctx_list)
+        if not answer.strip():
+            empty_answers += 1
+        if not any(c and c.strip() for c in ctx_list):
+            empty_contexts += 1
+    avg_answer_length = answer_length_sum / len(answers) if answers else 0
+    avg_contexts_count = contexts_count_sum / len(contexts_list) if contexts_list else 0
     
     logger.info(
         "RAG выполнен на всех примерах датасета. Статистика: "
@@ -534,6 +822,253 @@ def _run_rag_on_dataset(dataset: Dataset, retriever: BaseRetriever) -> Dataset:
     return dataset
 
 
+# Метрики RAGAS; в быстром режиме (EVALUATION_FAST_MODE) вычисляются только основные
+_ALL_METRIC_NAMES = (
+    "faithfulness",
+    "answer_relevancy",
+    "answer_correctness",
+    "answer_similarity",
+    "context_recall",
+    "context_precision",
+)
+_FAST_METRIC_NAMES = ("faithfulness", "answer_relevancy", "answer_similarity")
+
+
+def _metric_names() -> tuple[str, ...]:
+    """Возвращает названия вычисляемых метрик с учётом EVALUATION_FAST_MODE."""
+    return _FAST_METRIC_NAMES if config.EVALUATION_FAST_MODE else _ALL_METRIC_NAMES
+
+
+@lru_cache(maxsize=1)
+def _build_ragas_llm_and_embeddings(cache_key: tuple) -> tuple[Any, Any]:
+    """Создаёт LLM и эмбеддинги для RAGAS. cache_key - настройки, от которых они зависят."""
+    return _get_ragas_llm(), _get_ragas_embeddings()
+
+
+def _get_ragas_llm_and_embeddings():
+    """Возвращает LLM и эмбеддинги для RAGAS метрик.
+
+    Экземпляры переиспользуются между вызовами evaluation в одном процессе,
+    пока не изменятся настройки RAGAS (локальная модель эмбеддингов загружается один раз).
+    """
+    cache_key = (
+        config.RAGAS_EMBEDDINGS_PROVIDER,
+        config.RAGAS_EMBEDDING_MODEL,
+        config.LLM_PROVIDER,
+        config.RAGAS_LLM_MODEL or config.LLM_MODEL,
+        config.RAGAS_OPENAI_BASE_URL,
+    )
+    return _build_ragas_llm_and_embeddings(cache_key)
+
+
+def reset_ragas_singletons() -> None:
+    """Сбрасывает закэшированные LLM и эмбеддинги RAGAS (например, в тестах)."""
+    _build_ragas_llm_and_embeddings.cache_clear()
+
+
+def _build_metrics(llm, embeddings) -> list:
+    """Создаёт RAGAS метрики.
+
+    В RAGAS метрики - это классы, которые нужно инстанцировать с параметрами.
+    Некоторые метрики требуют только llm, другие - embeddings, третьи - оба.
+    В быстром режиме используем только основные метрики для ускорения.
+    """
+    if config.EVALUATION_FAST_MODE:
+        logger.info("Используется быстрый режим evaluation (только основные метрики)")
+        return [
+            Faithfulness(llm=llm),
+            AnswerRelevancy(llm=llm, embeddings=embeddings),
+            AnswerSimilarity(embeddings=embeddings),
+        ]
+    return [
+        Faithfulness(llm=llm),
+        AnswerRelevancy(llm=llm, embeddings=embeddings),
+        AnswerCorrectness(llm=llm, embeddings=embeddings),
+        AnswerSimilarity(embeddings=embeddings),
+        ContextRecall(llm=llm),
+        ContextPrecision(llm=llm),
+    ]
+
+
+_NUMBER_TYPES = (int, float, np.number)
+
+
+def _finite_mean(values: np.ndarray) -> float:
+    """Среднее по конечным значениям: nan и inf отбрасываются одной векторной проверкой np.isfinite."""
+    finite = np.isfinite(values)
+    if not finite.any():
+        return 0.0
+    return float(values[finite].mean())
+
+
+def _extract_metric_value(metric_result) -> float:
+    """Извлекает числовое значение из результата метрики.
+
+    RAGAS может возвращать метрики как списки (по значению на пример) или скалярные значения.
+    """
+    if metric_result is None:
+        return 0.0
+    if isinstance(metric_result, (list, tuple)):
+        # Если список, берем среднее значение по конечным числам: None превращается в nan
+        # при преобразовании в float64 и отбрасывается вместе с nan и inf
+        try:
+            values = np.asarray(metric_result, dtype=np.float64)
+        except (TypeError, ValueError):
+            # В списке есть нечисловые значения (например, строки) - оставляем только числа
+            values = np.fromiter(
+                (v for v in metric_result if isinstance(v, _NUMBER_TYPES)),
+                dtype=np.float64,
+            )
+        if values.size and logger.isEnabledFor(logging.DEBUG) and not np.isfinite(values).any():
+            logger.debug("Все значения метрики невалидны (nan/inf/None): %s из %s", values.size, len(metric_result))
+        return _finite_mean(values.ravel())
+    elif isinstance(metric_result, _NUMBER_TYPES):
+        value = float(metric_result)
+        return value if math.isfinite(value) else 0.0
+    elif isinstance(metric_result, str):
+        try:
+            return float(metric_result)
+        except ValueError:
+            logger.warning("Не удалось преобразовать метрику в число: %s", metric_result)
+            return 0.0
+    else:
+        logger.warning("Неожиданный тип результата метрики: %s (тип: %s)", metric_result, type(metric_result))
+        return 0.0
+
+
+def _finite_mean_of_numbers(metric_result) -> float:
+    """Среднее по списку чисел одним векторизованным проходом (nan и inf отбрасываются)."""
+    try:
+        values = np.asarray(metric_result, dtype=np.float64)
+    except (TypeError, ValueError):
+        # В списке оказались не только числа - используем общий путь
+        return _extract_metric_value(metric_result)
+    return _finite_mean(values.ravel())
+
+
+def _finite_scalar(metric_result) -> float:
+    value = float(metric_result)
+    return value if math.isfinite(value) else 0.0
+
+
+_metric_extractors: dict[tuple[type, type | None], Callable[[Any], float]] = {}
+
+
+def _compile_metric_extractor(sample) -> Callable[[Any], float]:
+    """Возвращает функцию извлечения значения, специализированную под форму sample.
+
+    Форма результата каждой метрики RAGAS фиксирована (список чисел по примерам
+    или скаляр), поэтому разбор типов выполняется один раз на сигнатуру
+    (тип значения, тип первого элемента), а не для каждого элемента.
+    """
+    is_sequence = isinstance(sample, (list, tuple))
+    signature = (type(sample), type(sample[0]) if is_sequence and sample else None)
+    extractor = _metric_extractors.get(signature)
+    if extractor is None:
+        if is_sequence and sample and isinstance(sample[0], _NUMBER_TYPES):
+            extractor = _finite_mean_of_numbers
+        elif isinstance(sample, _NUMBER_TYPES):
+            extractor = _finite_scalar
+        else:
+            extractor = _extract_metric_value
+        _metric_extractors[signature] = extractor
+    return extractor
+
+
+def _metric_accessor(result) -> Callable[[str], Any]:
+    """Выбирает способ чтения метрик из результата RAGAS.
+
+    Форма результата одинакова для всех метрик, поэтому проверки атрибутов
+    выполняются один раз, а не для каждой метрики. Обычно RAGAS возвращает
+    EvaluationResult со списком словарей result.scores (по одному на пример).
+    """
+    scores = getattr(result, "scores", None)
+
+    if isinstance(scores, list) and scores:
+        # Разворачиваем строки в колонки за один проход, дальше каждая метрика - поиск в словаре
+        columns: dict[str, list] = {}
+        for row in scores:
+            if isinstance(row, dict):
+                for metric_name, value in row.items():
+                    if value is not None:
+                        columns.setdefault(metric_name, []).append(value)
+
+        def from_columns(metric_name: str):
+            # Список значений по примерам обрабатывается в _compile_metric_extractor
+            return columns.get(metric_name) or getattr(result, metric_name, None)
+
+        return from_columns
+
+    if scores is not None and hasattr(scores, "get"):
+        return scores.get
+
+    if hasattr(result, "__getitem__"):
+        def by_key(metric_name: str):
+            try:
+                return result[metric_name]
+            except (KeyError, TypeError):
+                return getattr(result, metric_name, None)
+
+        return by_key
+
+    return lambda metric_name: getattr(result, metric_name, None)
+
+
+def _extract_metrics(result) -> dict[str, float]:
+    """Извлекает средние значения вычисленных метрик из результата RAGAS."""
+    accessor = _metric_accessor(result)
+    metrics_dict = {}
+    for metric_name in _metric_names():
+        raw_value = accessor(metric_name)
+        if raw_value is None:
+            logger.warning("Метрика %s не найдена в result", metric_name)
+        metrics_dict[metric_name] = _compile_metric_extractor(raw_value)(raw_value)
+    return metrics_dict
+
+
+def _evaluate_metrics(
+    dataset: Dataset,
+    metrics: list,
+    run_config: RunConfig | None = None,
+    experiment_name: str | None = None,
+) -> EvaluationResult:
+    """Вычисляет RAGAS метрики, при EVALUATION_METRIC_SHARDS > 1 - параллельно по шардам.
+
+    Каждый шард оценивается отдельным вызовом evaluate() в своём потоке, поэтому
+    retry и backoff одного шарда не блокируют остальные. Результаты объединяются
+    в один EvaluationResult с сохранением исходного порядка примеров.
+    """
+    kwargs: dict[str, Any] = {"metrics": metrics}
+    if run_config is not None:
+        kwargs["run_config"] = run_config
+
+    num_shards = min(config.EVALUATION_METRIC_SHARDS, len(dataset))
+    if num_shards <= 1:
+        return evaluate(dataset=dataset, experiment_name=experiment_name, **kwargs)
+
+    # contiguous=True сохраняет порядок примеров при конкатенации результатов
+    shards = [dataset.shard(num_shards=num_shards, index=i, contiguous=True) for i in range(num_shards)]
+    logger.info("RAGAS метрики вычисляются параллельно на %s шардах: %s", num_shards, [len(s) for s in shards])
+
+    def _evaluate_shard(i: int) -> EvaluationResult:
+        shard_experiment = f"{experiment_name}-shard{i}" if experiment_name else None
+        return evaluate(dataset=shards[i], experiment_name=shard_experiment, **kwargs)
+
+    with ThreadPoolExecutor(max_workers=num_shards) as executor:
+        results = list(executor.map(_evaluate_shard, range(num_shards)))
+
+    first = results[0]
+    # Трейсы и run_id остаются от первого шарда: трейсы каждого шарда
+    # доступны в LangSmith под собственным experiment_name
+    return EvaluationResult(
+        scores=[score for result in results for score in result.scores],
+        dataset=EvaluationDataset(samples=[sample for result in results for sample in result.dataset.samples]),
+        binary_columns=first.binary_columns,
+        ragas_traces=first.ragas_traces,
+        run_id=first.run_id,
+    )
+
+
 def evaluate_rag_pipeline(
     dataset_name: str,
     retriever: BaseRetriever | None = None,
@@ -558,38 +1093,13 @@ def evaluate_rag_pipeline(
     # Сохраняем количество примеров для возврата
     examples_count = len(dataset)
 
-    # Получаем retriever
-    if retriever is None:
-        manager = get_vector_store_manager()
-        retriever = manager.get_retriever()
-
     # Запускаем RAG на всех примерах
-    dataset_with_rag = _run_rag_on_dataset(dataset, retriever)
+    # Retriever по умолчанию создаётся внутри только при необходимости
+    dataset_with_rag = _run_rag_on_dataset(dataset, retriever, dataset_name)
 
     # Настраиваем RAGAS метрики
-    embeddings = _get_ragas_embeddings()
-    llm = _get_ragas_llm()
-
-    # Вычисляем метрики
-    # В RAGAS метрики - это классы, которые нужно инстанцировать с параметрами
-    # Некоторые метрики требуют только llm, другие - embeddings, третьи - оба
-    # В быстром режиме используем только основные метрики для ускорения
-    if config.EVALUATION_FAST_MODE:
-        logger.info("Используется быстрый режим evaluation (только основные метрики)")
-        metrics = [
-            Faithfulness(llm=llm),
-            AnswerRelevancy(llm=llm, embeddings=embeddings),
-            AnswerSimilarity(embeddings=embeddings),
-        ]
-    else:
-        metrics = [
-            Faithfulness(llm=llm),
-            AnswerRelevancy(llm=llm, embeddings=embeddings),
-            AnswerCorrectness(llm=llm, embeddings=embeddings),
-            AnswerSimilarity(embeddings=embeddings),
-            ContextRecall(llm=llm),
-            ContextPrecision(llm=llm),
-        ]
+    llm, embeddings = _get_ragas_llm_and_embeddings()
+    metrics = _build_metrics(llm, embeddings)
 
     # Проверяем валидность данных перед вычислением метрик
     non_empty_answers = sum(1 for a in dataset_with_rag["answer"] if a and a.strip())
@@ -605,14 +1115,7 @@ def evaluate_rag_pipeline(
         logger.error("⚠️ Все ответы пустые! RAGAS не сможет вычислить метрики. "
                     "Проверьте работу RAG pipeline и LLM API.")
         # Возвращаем нулевые метрики вместо пустого словаря
-        return {
-            "faithfulness": 0.0,
-            "answer_relevancy": 0.0,
-            "answer_correctness": 0.0,
-            "answer_similarity": 0.0,
-            "context_recall": 0.0,
-            "context_precision": 0.0,
-        }
+        return dict.fromkeys(_ALL_METRIC_NAMES, 0.0)
     
     logger.info("Инициализация RAGAS компонентов...")
     logger.info("RAGAS LLM модель: %s (провайдер: %s, base_url: %s)", 
@@ -649,11 +1152,11 @@ def evaluate_rag_pipeline(
         try:
             run_config = RunConfig(max_workers=1)
             logger.info("Используется RunConfig(max_workers=1) для ограничения параллельности")
-            result = evaluate(dataset=dataset_with_rag, metrics=metrics, run_config=run_config)
+            result = _evaluate_metrics(dataset_with_rag, metrics, run_config=run_config)
         except TypeError:
             # Если RunConfig не поддерживает параметры, запускаем без него
             logger.warning("RunConfig не поддерживает указанные параметры, запускаем без него")
-            result = evaluate(dataset=dataset_with_rag, metrics=metrics)
+            result = _evaluate_metrics(dataset_with_rag, metrics)
     except Exception as e:
         logger.error("❌ Ошибка при вычислении RAGAS метрик: %s", e)
         logger.error("Тип ошибки: %s", type(e).__name__)
@@ -662,147 +1165,52 @@ def evaluate_rag_pipeline(
         # Возвращаем частичные результаты, если возможно
         raise
 
-    # Диагностика: проверяем структуру результата RAGAS
-    logger.info("=== Диагностика результата RAGAS ===")
-    logger.info("Тип result: %s", type(result).__name__)
-    logger.info("Атрибуты result: %s", [attr for attr in dir(result) if not attr.startswith('_')][:20])
-    
-    # Проверяем result.scores
-    if hasattr(result, 'scores'):
-        logger.info("result.scores существует, тип: %s", type(result.scores).__name__)
-        if isinstance(result.scores, list) and len(result.scores) > 0:
-            logger.info("result.scores - список из %s элементов", len(result.scores))
-            logger.info("Первый элемент scores: %s", result.scores[0] if result.scores else "пусто")
-            
-            # Подсчитываем количество nan для каждой метрики
-            import math
-            import numpy as np
-            metric_attrs = ['faithfulness', 'answer_relevancy', 'answer_correctness', 
-                           'answer_similarity', 'context_recall', 'context_precision']
-            for metric_name in metric_attrs:
-                nan_count = 0
-                valid_count = 0
-                for score_dict in result.scores:
-                    if isinstance(score_dict, dict) and metric_name in score_dict:
-                        val = score_dict[metric_name]
-                        if val is not None:
-                            try:
-                                val_float = float(val)
-                                if math.isnan(val_float) or (isinstance(val, (float, np.number)) and np.isnan(val)):
-                                    nan_count += 1
-                                else:
-                                    valid_count += 1
-                            except (ValueError, TypeError):
-                                nan_count += 1
-                if nan_count > 0 or valid_count > 0:
-                    logger.info("  Метрика %s: %s валидных значений, %s nan значений", 
-                               metric_name, valid_count, nan_count)
-        elif hasattr(result.scores, 'keys'):
-            logger.info("result.scores - словарь с ключами: %s", list(result.scores.keys())[:10])
-    
-    # Проверяем прямые атрибуты метрик
-    metric_attrs = ['faithfulness', 'answer_relevancy', 'answer_correctness', 
-                     'answer_similarity', 'context_recall', 'context_precision']
-    for attr in metric_attrs:
-        if hasattr(result, attr):
-            value = getattr(result, attr)
-            logger.info("result.%s = %s (тип: %s)", attr, value, type(value).__name__)
-        else:
-            logger.info("result.%s - атрибут отсутствует", attr)
-
-    # Извлекаем средние значения метрик
-    # RAGAS может возвращать метрики как списки или скалярные значения
-    def _extract_metric_value(metric_result):
-        """Извлекает числовое значение из результата метрики."""
-        import math
-        import numpy as np
-        
-        if metric_result is None:
-            return 0.0
-        if isinstance(metric_result, (list, tuple)):
-            # Если список, берем среднее значение
-            if len(metric_result) == 0:
-                return 0.0
-            # Фильтруем None, nan, inf значения и строки
-            valid_values = [
-                v for v in metric_result 
-                if v is not None 
-                and isinstance(v, (int, float, np.number))
-                and not math.isnan(float(v))
-                and not math.isinf(float(v))
-            ]
-            if len(valid_values) == 0:
-                # Логируем, если все значения невалидны
-                nan_count = sum(1 for v in metric_result if isinstance(v, (int, float, np.number)) and math.isnan(float(v)))
-                if nan_count > 0:
-                    logger.debug("Все значения метрики невалидны (nan/inf/None): %s nan из %s", nan_count, len(metric_result))
-                return 0.0
-            return float(sum(float(v) for v in valid_values) / len(valid_values))
-        elif isinstance(metric_result, (int, float, np.number)):
-            value = float(metric_result)
-            if math.isnan(value) or math.isinf(value):
-                return 0.0
-            return value
-        elif isinstance(metric_result, str):
-            try:
-                return float(metric_result)
-            except ValueError:
-                logger.warning("Не удалось преобразовать метрику в число: %s", metric_result)
-                return 0.0
-        else:
-            logger.warning("Неожиданный тип результата метрики: %s (тип: %s)", metric_result, type(metric_result))
-            return 0.0
+    # Диагностика структуры результата RAGAS: подсчёт nan проходит по всем примерам
+    # и материализует списки атрибутов, поэтому выполняется только в DEBUG
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("=== Диагностика результата RAGAS ===")
+        logger.debug("Тип result: %s", type(result).__name__)
+        logger.debug("Атрибуты result: %s", [attr for attr in dir(result) if not attr.startswith('_')][:20])
 
-    # RAGAS возвращает EvaluationResult объект
-    # Метрики могут быть в атрибутах result или в result.scores (список словарей)
-    def _get_metric_from_result(result, metric_name: str):
-        """Извлекает метрику из результата RAGAS, проверяя разные источники."""
-        # Сначала пробуем прямой атрибут
-        if hasattr(result, metric_name):
-            value = getattr(result, metric_name)
-            if value is not None:
-                logger.debug("Метрика %s найдена в атрибуте result.%s: %s", metric_name, metric_name, value)
-                return value
-        
-        # Затем пробуем result.scores (может быть список словарей или словарь)
+        # Проверяем result.scores
         if hasattr(result, 'scores'):
+            logger.debug("result.scores существует, тип: %s", type(result.scores).__name__)
             if isinstance(result.scores, list) and len(result.scores) > 0:
-                # Если scores - список словарей, извлекаем значения для всех примеров
-                values = []
-                for score_dict in result.scores:
-                    if isinstance(score_dict, dict) and metric_name in score_dict:
-                        val = score_dict[metric_name]
-                        if val is not None:
-                            values.append(val)
-                if values:
-                    logger.debug("Метрика %s найдена в result.scores (список): %s значений", metric_name, len(values))
-                    return values  # Возвращаем список для обработки в _extract_metric_value
-            elif hasattr(result.scores, 'get'):
-                # Если scores - словарь
-                value = result.scores.get(metric_name)
-                if value is not None:
-                    logger.debug("Метрика %s найдена в result.scores (словарь): %s", metric_name, value)
-                    return value
-        
-        logger.warning("Метрика %s не найдена в result", metric_name)
-        return None
-    
-    # В быстром режиме вычисляем только основные метрики
-    if config.EVALUATION_FAST_MODE:
-        metrics_dict = {
-            "faithfulness": _extract_metric_value(_get_metric_from_result(result, "faithfulness")),
-            "answer_relevancy": _extract_metric_value(_get_metric_from_result(result, "answer_relevancy")),
-            "answer_similarity": _extract_metric_value(_get_metric_from_result(result, "answer_similarity")),
-        }
-    else:
-        metrics_dict = {
-            "faithfulness": _extract_metric_value(_get_metric_from_result(result, "faithfulness")),
-            "answer_relevancy": _extract_metric_value(_get_metric_from_result(result, "answer_relevancy")),
-            "answer_correctness": _extract_metric_value(_get_metric_from_result(result, "answer_correctness")),
-            "answer_similarity": _extract_metric_value(_get_metric_from_result(result, "answer_similarity")),
-            "context_recall": _extract_metric_value(_get_metric_from_result(result, "context_recall")),
-            "context_precision": _extract_metric_value(_get_metric_from_result(result, "context_precision")),
-        }
+                logger.debug("result.scores - список из %s элементов", len(result.scores))
+                logger.debug("Первый элемент scores: %s", result.scores[0] if result.scores else "пусто")
+
+                # Подсчитываем количество nan для каждой метрики
+                for metric_name in _ALL_METRIC_NAMES:
+                    nan_count = 0
+                    valid_count = 0
+                    for score_dict in result.scores:
+                        if isinstance(score_dict, dict) and metric_name in score_dict:
+                            val = score_dict[metric_name]
+                            if val is not None:
+                                try:
+                                    val_float = float(val)
+                                    if math.isnan(val_float) or (isinstance(val, (float, np.number)) and np.isnan(val)):
+                                        nan_count += 1
+                                    else:
+                                        valid_count += 1
+                                except (ValueError, TypeError):
+                                    nan_count += 1
+                    if nan_count > 0 or valid_count > 0:
+                        logger.debug("  Метрика %s: %s валидных значений, %s nan значений",
+                                     metric_name, valid_count, nan_count)
+            elif hasattr(result.scores, 'keys'):
+                logger.debug("result.scores - словарь с ключами: %s", list(result.scores.keys())[:10])
+
+        # Проверяем прямые атрибуты метрик
+        for attr in _ALL_METRIC_NAMES:
+            if hasattr(result, attr):
+                value = getattr(result, attr)
+                logger.debug("result.%s = %s (тип: %s)", attr, value, type(value).__name__)
+            else:
+                logger.debug("result.%s - атрибут отсутствует", attr)
+
+    # Извлекаем средние значения метрик
+    metrics_dict = _extract_metrics(result)
 
     logger.info("Evaluation завершён. Метрики: %s", metrics_dict)
     return metrics_dict
@@ -814,26 +1222,24 @@ def _upload_feedback_to_langsmith(
     examples: list[Any],
     dataset_with_rag: Dataset,
 ) -> bool:
-    """Загружает результаты evaluation в LangSmith как feedback."""
+    """Загружает результаты evaluation в LangSmith как feedback.
+
+    Args:
+        examples: Примеры LangSmith, собранные _load_dataset_from_langsmith(examples_out=...)
+    """
     if not config.LANGSMITH_API_KEY:
         logger.info("LANGSMITH_API_KEY не установлен. Пропускаем загрузку feedback в LangSmith.")
         return False
 
     try:
-        from langsmith import Client
-
-        client = Client(api_key=config.LANGSMITH_API_KEY)
-
-        # Загружаем примеры из датасета для получения run_id
-        dataset_examples = list(client.list_examples(dataset_name=dataset_name))
-
-        if not dataset_examples:
+        # Примеры уже получены при загрузке датасета - повторно list_examples не вызываем
+        if not examples:
             logger.warning("Не найдено примеров в датасете '%s' для загрузки feedback", dataset_name)
             return False
 
         # Загружаем feedback для каждого примера
         feedback_count = 0
-        for idx, (example, rag_result) in enumerate(zip(dataset_examples, dataset_with_rag)):
+        for idx, (example, rag_result) in enumerate(zip(examples, dataset_with_rag)):
             try:
                 # Создаём feedback с метриками
                 # В LangSmith feedback можно добавлять к runs, но для простоты
@@ -846,9 +1252,6 @@ def _upload_feedback_to_langsmith(
         logger.info("Загружено %s feedback записей в LangSmith", feedback_count)
         return True
 
-    except ImportError:
-        logger.warning("langsmith не установлен. Пропускаем загрузку feedback в LangSmith.")
-        return False
     except Exception as exc:
         logger.exception("Ошибка при загрузке feedback в LangSmith: %s", exc)
         return False
@@ -874,66 +1277,43 @@ def evaluate_rag_pipeline_with_feedback(
     """
     logger.info("Начало evaluation RAG pipeline с датасетом '%s'", dataset_name)
 
-    # Загружаем датасет из LangSmith
-    dataset = _load_dataset_from_langsmith(dataset_name)
+    # Загружаем датасет из LangSmith, сохраняя примеры для загрузки feedback
+    langsmith_examples: list[Any] = []
+    dataset = _load_dataset_from_langsmith(dataset_name, examples_out=langsmith_examples)
     if dataset is None:
         raise ValueError(f"Не удалось загрузить датасет '{dataset_name}' из LangSmith")
 
     # Сохраняем количество примеров для возврата
     examples_count = len(dataset)
 
-    # Получаем retriever
-    if retriever is None:
-        manager = get_vector_store_manager()
-        retriever = manager.get_retriever()
-
     # Запускаем RAG на всех примерах
-    dataset_with_rag = _run_rag_on_dataset(dataset, retriever)
+    # Retriever по умолчанию создаётся внутри только при необходимости
+    dataset_with_rag = _run_rag_on_dataset(dataset, retriever, dataset_name)
 
     # Настраиваем RAGAS метрики
-    embeddings = _get_ragas_embeddings()
-    llm = _get_ragas_llm()
-
-    # Вычисляем метрики
-    # В RAGAS метрики - это классы, которые нужно инстанцировать с параметрами
-    # Некоторые метрики требуют только llm, другие - embeddings, третьи - оба
-    # В быстром режиме используем только основные метрики для ускорения
-    if config.EVALUATION_FAST_MODE:
-        logger.info("Используется быстрый режим evaluation (только основные метрики)")
-        metrics_list = [
-            Faithfulness(llm=llm),
-            AnswerRelevancy(llm=llm, embeddings=embeddings),
-            AnswerSimilarity(embeddings=embeddings),
-        ]
-    else:
-        metrics_list = [
-            Faithfulness(llm=llm),
-            AnswerRelevancy(llm=llm, embeddings=embeddings),
-            AnswerCorrectness(llm=llm, embeddings=embeddings),
-            AnswerSimilarity(embeddings=embeddings),
-            ContextRecall(llm=llm),
-            ContextPrecision(llm=llm),
-        ]
+    llm, embeddings = _get_ragas_llm_and_embeddings()
+    metrics_list = _build_metrics(llm, embeddings)
 
     logger.info("Вычисление RAGAS метрик...")
     
-    # Диагностическое логирование: проверяем формат датасета перед evaluation
-    logger.info("Формат датасета перед evaluation:")
-    logger.info("  Колонки: %s", dataset_with_rag.column_names)
-    logger.info("  Количество записей: %s", len(dataset_with_rag))
-    if len(dataset_with_rag) > 0:
-        sample = dataset_with_rag[0]
-        logger.info("  Пример первой записи:")
-        for key in dataset_with_rag.column_names:
-            value = sample.get(key)
-            if isinstance(value, list):
-                logger.info("    %s: список из %s элементов (первый элемент: %s...)", 
-                           key, len(value), str(value[0])[:100] if value else "пусто")
-            elif isinstance(value, str):
-                logger.info("    %s: строка длиной %s символов (%s...)", 
-                           key, len(value), value[:100] if value else "пусто")
-            else:
-                logger.info("    %s: %s (тип: %s)", key, type(value).__name__, type(value))
+    # Диагностическое логирование: проверяем формат датасета перед evaluation (только в DEBUG)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Формат датасета перед evaluation:")
+        logger.debug("  Колонки: %s", dataset_with_rag.column_names)
+        logger.debug("  Количество записей: %s", len(dataset_with_rag))
+        if len(dataset_with_rag) > 0:
+            sample = dataset_with_rag[0]
+            logger.debug("  Пример первой записи:")
+            for key in dataset_with_rag.column_names:
+                value = sample.get(key)
+                if isinstance(value, list):
+                    logger.debug("    %s: список из %s элементов (первый элемент: %s...)",
+                                 key, len(value), str(value[0])[:100] if value else "пусто")
+                elif isinstance(value, str):
+                    logger.debug("    %s: строка длиной %s символов (%s...)",
+                                 key, len(value), value[:100] if value else "пусто")
+                else:
+                    logger.debug("    %s: %s (тип: %s)", key, type(value).__name__, type(value))
     
     # Убеждаемся, что проект указан для создания экспериментов в LangSmith
     if config.LANGSMITH_PROJECT:
@@ -966,11 +1346,12 @@ def evaluate_rag_pipeline_with_feedback(
         # - LANGCHAIN_API_KEY или LANGSMITH_API_KEY (устанавливается в config.py)
         # - LANGCHAIN_PROJECT или LANGSMITH_PROJECT (устанавливается выше)
         # - experiment_name и run_config (указываем явно для лучшей видимости в UI)
-        result = evaluate(
-            dataset=dataset_with_rag,
-            metrics=metrics_list,
-            experiment_name=experiment_name,  # Явно указываем имя эксперимента
+        # При шардировании каждый шард получает experiment_name с суффиксом -shard{i}
+        result = _evaluate_metrics(
+            dataset_with_rag,
+            metrics_list,
             run_config=run_config,  # Привязываем к проекту для отображения в UI
+            experiment_name=experiment_name,  # Явно указываем имя эксперимента
         )
         logger.info("RAGAS evaluation завершён успешно")
         
@@ -988,179 +1369,19 @@ def evaluate_rag_pipeline_with_feedback(
         logger.exception("Ошибка при вычислении RAGAS метрик: %s", exc)
         raise
 
-    # Диагностическое логирование: проверяем формат результатов RAGAS
-    logger.info("Формат результатов RAGAS:")
-    logger.info("  Тип результата: %s", type(result).__name__)
-    logger.info("  Атрибуты результата: %s", [attr for attr in dir(result) if not attr.startswith('_')])
-    
-    # Пытаемся получить доступ к метрикам напрямую
-    # В быстром режиме вычисляем только основные метрики
-    if config.EVALUATION_FAST_MODE:
-        metric_names_to_extract = [
-            "faithfulness",
-            "answer_relevancy",
-            "answer_similarity",
-        ]
-    else:
-        metric_names_to_extract = [
-            "faithfulness",
-            "answer_relevancy",
-            "answer_correctness",
-            "answer_similarity",
-            "context_recall",
-            "context_precision",
-        ]
-    
-    logger.info("  Попытка доступа к метрикам:")
-    logger.info("  Доступ через result.scores: %s", hasattr(result, 'scores'))
-    if hasattr(result, 'scores'):
-        logger.info("  result.scores тип: %s", type(result.scores).__name__)
-        logger.info("  result.scores содержимое: %s", list(result.scores.keys()) if hasattr(result.scores, 'keys') else result.scores)
-    
-    for metric_name in metric_names_to_extract:
-        try:
-            value = getattr(result, metric_name, None)
-            logger.info("    %s: %s (тип: %s)", metric_name, value, type(value).__name__ if value is not None else "None")
-            # Также пробуем через индекс, если это возможно
-            if hasattr(result, '__getitem__'):
-                try:
-                    indexed_value = result[metric_name]
-                    logger.info("      Через индекс [%s]: %s", metric_name, indexed_value)
-                except (KeyError, TypeError):
-                    pass
-            # Пробуем через scores, если доступно
-            if hasattr(result, 'scores') and hasattr(result.scores, 'get'):
-                try:
-                    scores_value = result.scores.get(metric_name)
-                    logger.info("      Через scores.get(%s): %s", metric_name, scores_value)
-                except Exception:
-                    pass
-        except Exception as exc:
-            logger.warning("    %s: ошибка при доступе - %s", metric_name, exc)
+    # Диагностика формата результатов RAGAS: печать всего result.scores дорогая, поэтому только в DEBUG
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Формат результатов RAGAS:")
+        logger.debug("  Тип результата: %s", type(result).__name__)
+        logger.debug("  Атрибуты результата: %s", [attr for attr in dir(result) if not attr.startswith('_')])
+        scores = getattr(result, "scores", None)
+        logger.debug("  result.scores тип: %s, содержимое: %s", type(scores).__name__, scores)
+        accessor = _metric_accessor(result)
+        for metric_name in _metric_names():
+            value = accessor(metric_name)
+            logger.debug("    %s: %s (тип: %s)", metric_name, value, type(value).__name__)
 
-    # Извлекаем средние значения метрик
-    # RAGAS может возвращать метрики как списки или скалярные значения
-    def _extract_metric_value(metric_result):
-        """Извлекает числовое значение из результата метрики."""
-        import math
-        
-        if metric_result is None:
-            return 0.0
-        if isinstance(metric_result, (list, tuple)):
-            # Если список, берем среднее значение
-            if len(metric_result) == 0:
-                return 0.0
-            # Фильтруем None значения, строки, nan и inf
-            valid_values = [
-                v for v in metric_result 
-                if v is not None 
-                and isinstance(v, (int, float)) 
-                and not math.isnan(v)
-                and not math.isinf(v)
-            ]
-            if len(valid_values) == 0:
-                logger.warning("Все значения метрики невалидны (None, nan, inf) или пустой список: %s", metric_result)
-                return 0.0
-            # Вычисляем среднее безопасно
-            try:
-                mean_value = sum(valid_values) / len(valid_values)
-                # Преобразуем в float и проверяем на nan/inf
-                mean_value = float(mean_value)
-                if math.isnan(mean_value):
-                    logger.warning("Среднее значение метрики равно nan (из значений: %s)", valid_values)
-                    return 0.0
-                if math.isinf(mean_value):
-                    logger.warning("Среднее значение метрики равно inf (из значений: %s)", valid_values)
-                    return 0.0
-                return mean_value
-            except (ZeroDivisionError, TypeError, ValueError) as e:
-                logger.warning("Ошибка при вычислении среднего значения метрики: %s (значения: %s)", e, valid_values)
-                return 0.0
-        elif isinstance(metric_result, (int, float)):
-            # Проверяем на nan и inf
-            if math.isnan(metric_result):
-                logger.warning("Метрика равна nan: %s", metric_result)
-                return 0.0
-            if math.isinf(metric_result):
-                logger.warning("Метрика равна inf: %s", metric_result)
-                return 0.0
-            return float(metric_result)
-        elif isinstance(metric_result, str):
-            try:
-                value = float(metric_result)
-                if math.isnan(value) or math.isinf(value):
-                    logger.warning("Метрика (строка) равна nan или inf: %s", metric_result)
-                    return 0.0
-                return value
-            except ValueError:
-                logger.warning("Не удалось преобразовать метрику в число: %s", metric_result)
-                return 0.0
-        else:
-            logger.warning("Неожиданный тип результата метрики: %s (тип: %s)", metric_result, type(metric_result))
-            return 0.0
-
-    # RAGAS возвращает EvaluationResult объект, а не словарь
-    # Обращаемся к атрибутам напрямую или через getattr
-    # Используем тот же список метрик, что определен выше (metric_names_to_extract)
-    metrics_dict = {}
-    for metric_name in metric_names_to_extract:
-        # Пробуем разные способы доступа к метрике
-        raw_value = None
-        
-        # Сначала пробуем через scores (предпочтительный способ для RAGAS)
-        # RAGAS может возвращать scores как список словарей (по одному на пример)
-        if hasattr(result, 'scores'):
-            # Проверяем, является ли scores списком словарей
-            if isinstance(result.scores, list) and len(result.scores) > 0:
-                # Если это список, извлекаем значения метрики для всех примеров
-                try:
-                    metric_values = [score.get(metric_name) if isinstance(score, dict) else getattr(score, metric_name, None) for score in result.scores]
-                    # Фильтруем None и используем список значений
-                    metric_values = [v for v in metric_values if v is not None]
-                    if metric_values:
-                        raw_value = metric_values
-                except Exception:
-                    pass
-            elif hasattr(result.scores, 'get'):
-                try:
-                    raw_value = result.scores.get(metric_name)
-                except Exception:
-                    pass
-            elif hasattr(result.scores, '__getitem__'):
-                try:
-                    raw_value = result.scores[metric_name]
-                except (KeyError, TypeError):
-                    pass
-        
-        # Если не получилось через scores, пробуем через getattr
-        if raw_value is None:
-            try:
-                raw_value = getattr(result, metric_name, None)
-            except AttributeError:
-                pass
-        
-        # Если не получилось через getattr, пробуем через индекс
-        if raw_value is None and hasattr(result, '__getitem__'):
-            try:
-                raw_value = result[metric_name]
-            except (KeyError, TypeError):
-                pass
-        
-        logger.info("  Извлечение метрики %s: raw_value=%s (тип: %s)", 
-                   metric_name, raw_value, type(raw_value).__name__ if raw_value is not None else "None")
-        extracted_value = _extract_metric_value(raw_value)
-        metrics_dict[metric_name] = extracted_value
-        
-        if extracted_value == 0.0:
-            if raw_value is None:
-                logger.warning("Метрика %s не найдена в результате (raw_value=None)", metric_name)
-            else:
-                logger.warning(
-                    "Метрика %s извлечена как 0.0, но raw_value не None: %s (тип: %s)",
-                    metric_name,
-                    raw_value,
-                    type(raw_value).__name__
-                )
+    metrics_dict = _extract_metrics(result)
 
     logger.info("Evaluation завершён. Метрики: %s", metrics_dict)
 
@@ -1170,13 +1391,9 @@ def evaluate_rag_pipeline_with_feedback(
     # RAGAS создает runs, но они могут не быть связаны с датасетом.
     if config.LANGSMITH_API_KEY and config.LANGSMITH_PROJECT:
         try:
-            from langsmith import Client
-
-            client = Client(api_key=config.LANGSMITH_API_KEY)
-            
             # Получаем информацию о датасете
             try:
-                dataset_info = client.read_dataset(dataset_name=dataset_name)
+                dataset_info = _read_dataset_info(dataset_name)
                 logger.info("Dataset ID: %s", dataset_info.id)
             except Exception as ds_exc:
                 logger.warning("Не удалось получить информацию о датасете: %s", ds_exc)
@@ -1213,8 +1430,10 @@ def evaluate_rag_pipeline_with_feedback(
             
             # Загружаем feedback в LangSmith (если нужно)
             if upload_feedback:
-                dataset_examples = list(client.list_examples(dataset_name=dataset_name))
-                logger.info("Результаты evaluation готовы для загрузки в LangSmith как feedback")
+                logger.info(
+                    "Результаты evaluation готовы для загрузки в LangSmith как feedback (%s примеров)",
+                    len(langsmith_examples),
+                )
         except Exception as exc:
             logger.warning("Ошибка при проверке эксперимента в LangSmith: %s", exc)
 
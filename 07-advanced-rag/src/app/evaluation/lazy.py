@@ -0,0 +1,37 @@
+"""Отложенное создание тяжёлых объектов (retriever, RAG цепочка) для evaluation."""
+from __future__ import annotations
+
+from typing import Callable, Generic, TypeVar
+
+T = TypeVar("T")
+
+
+class Lazy(Generic[T]):
+    """Вызывает factory при первом обращении и запоминает результат.
+
+    Позволяет не загружать модель эмбеддингов и векторное хранилище,
+    если все ответы уже есть в checkpoint'е. Если factory завершилась ошибкой,
+    повторные вызовы пробрасывают ту же ошибку без повторной (дорогой) сборки.
+    """
+
+    def __init__(self, factory: Callable[[], T]):
+        self._factory = factory
+        self._value: T | None = None
+        self._built = False
+        self._error: BaseException | None = None
+
+    @property
+    def built(self) -> bool:
+        return self._built
+
+    def __call__(self) -> T:
+        if self._error is not None:
+            raise self._error
+        if not self._built:
+            try:
+                self._value = self._factory()
+            except Exception as exc:
+                self._error = exc
+                raise
+            self._built = True
+        return self._value
@@ -0,0 +1,138 @@
+"""Token bucket rate limiter для запросов к LLM во время evaluation."""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Mapping
+
+logger = logging.getLogger(__name__)
+
+# Пауза по умолчанию после 429, если провайдер не прислал retry-after
+DEFAULT_PENALTY_SECONDS = 10.0
+MAX_PENALTY_SECONDS = 240.0
+
+
+def _parse_float(value: str | None) -> float | None:
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """Token bucket по запросам и токенам, подстраивающийся под заголовки провайдера.
+
+    Бакет запросов пополняется со скоростью requests_per_minute / 60 в секунду,
+    бакет токенов - tokens_per_minute / 60 (если лимит токенов задан).
+    Заголовки x-ratelimit-remaining-* ограничивают текущий запас сверху,
+    retry-after и 429 ошибки блокируют выдачу на указанное время.
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float | None = None):
+        """Инициализирует rate limiter.
+
+        Args:
+            requests_per_minute: Допустимое количество запросов в минуту
+            tokens_per_minute: Допустимое количество токенов в минуту (None или 0 - без ограничения)
+        """
+        if requests_per_minute <= 0:
+            raise ValueError("requests_per_minute должен быть больше 0")
+
+        self._request_capacity = float(requests_per_minute)
+        self._request_rate = requests_per_minute / 60.0
+        # Стартуем с одним запросом в запасе, чтобы не отправлять всю минутную квоту разом
+        self._requests = 1.0
+
+        self._token_capacity = float(tokens_per_minute) if tokens_per_minute else None
+        self._token_rate = tokens_per_minute / 60.0 if tokens_per_minute else None
+        self._tokens = self._token_capacity
+
+        self._updated_at = time.monotonic()
+        self._blocked_until = 0.0
+        self._penalty = DEFAULT_PENALTY_SECONDS
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated_at
+        self._updated_at = now
+        if elapsed <= 0:
+            return
+        self._requests = min(self._request_capacity, self._requests + elapsed * self._request_rate)
+        if self._token_capacity is not None:
+            self._tokens = min(self._token_capacity, self._tokens + elapsed * self._token_rate)
+
+    def _wait_time(self, now: float, estimated_tokens: int) -> float:
+        """Возвращает время ожидания до возможности выполнить запрос (0 - можно сразу)."""
+        if now < self._blocked_until:
+            return self._blocked_until - now
+
+        wait = 0.0
+        if self._requests < 1.0:
+            wait = (1.0 - self._requests) / self._request_rate
+        if self._token_capacity is not None:
+            # Запрос больше всего бакета ждёт полного бакета, а не бесконечно
+            needed = min(float(estimated_tokens), self._token_capacity)
+            if self._tokens < needed:
+                wait = max(wait, (needed - self._tokens) / self._token_rate)
+        return wait
+
+    async def acquire(self, estimated_tokens: int = 0) -> None:
+        """Ожидает, пока в бакете не появится квота на запрос с estimated_tokens токенами."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._wait_time(now, estimated_tokens)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+
+            self._requests -= 1.0
+            if self._token_capacity is not None:
+                self._tokens -= min(float(estimated_tokens), self._token_capacity)
+
+    def update_from_headers(self, headers: Mapping[str, str] | None) -> None:
+        """Корректирует запас бакетов по заголовкам ответа провайдера."""
+        if not headers:
+            return
+
+        self._refill(time.monotonic())
+
+        remaining_requests = _parse_float(headers.get("x-ratelimit-remaining-requests"))
+        if remaining_requests is not None:
+            self._requests = min(self._requests, remaining_requests)
+
+        remaining_tokens = _parse_float(headers.get("x-ratelimit-remaining-tokens"))
+        if remaining_tokens is not None and self._token_capacity is not None:
+            self._tokens = min(self._tokens, remaining_tokens)
+
+        retry_after = _parse_float(headers.get("retry-after"))
+        if retry_after is not None and retry_after > 0:
+            self._block(retry_after)
+        elif remaining_requests is not None and remaining_requests > 0:
+            # Провайдер снова отвечает без ограничений - сбрасываем экспоненциальную паузу
+            self._penalty = DEFAULT_PENALTY_SECONDS
+
+    def penalize(self, retry_after: float | None = None) -> float:
+        """Блокирует выдачу квоты после 429 ошибки.
+
+        Args:
+            retry_after: Пауза из заголовка retry-after (если None - экспоненциальная пауза)
+
+        Returns:
+            Длительность паузы в секундах
+        """
+        if retry_after is None or retry_after <= 0:
+            retry_after = self._penalty
+            self._penalty = min(self._penalty * 2, MAX_PENALTY_SECONDS)
+        self._block(retry_after)
+        # После 429 квота провайдера исчерпана - не расходуем накопленный локальный запас
+        self._requests = 0.0
+        logger.warning("Rate limit провайдера: выдача запросов приостановлена на %.1f сек", retry_after)
+        return retry_after
+
+    def _block(self, seconds: float) -> None:
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
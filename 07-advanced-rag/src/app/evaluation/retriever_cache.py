@@ -0,0 +1,165 @@
+"""Персистентный кэш результатов retrieval для повторных прогонов evaluation."""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from datasets import Dataset
+from src.app import config
+from src.app.indexing.loader import data_fingerprint
+
+logger = logging.getLogger(__name__)
+
+
+def _hash(*parts: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def retriever_config_hash(retriever: BaseRetriever | None) -> str:
+    """Возвращает хэш конфигурации retrieval и индексируемых данных, от которых зависят найденные документы.
+
+    Args:
+        retriever: Retriever или None для retriever'а по умолчанию
+            (VectorStoreManager.get_retriever()), который в этом случае не создаётся
+    """
+    if retriever is None:
+        # Описание совпадает с VectorStoreManager.get_retriever() без аргументов
+        retriever_type = "VectorStoreRetriever"
+        search_kwargs = {"k": config.SEMANTIC_K if config.RAG_MODE != "semantic" else config.RETRIEVER_K}
+    else:
+        retriever_type = type(retriever).__name__
+        search_kwargs = getattr(retriever, "search_kwargs", None)
+    return _hash(
+        retriever_type,
+        json.dumps(search_kwargs, sort_keys=True, default=str),
+        config.RAG_MODE,
+        str((config.SEMANTIC_K, config.BM25_K, config.HYBRID_K, config.RERANKER_K)),
+        config.VECTOR_BACKEND,
+        config.FAISS_QUANTIZATION if config.VECTOR_BACKEND == "faiss" else "",
+        config.EMBEDDINGS_PROVIDER,
+        config.EMBEDDINGS_MODEL,
+        str(config.ONNX_QUANTIZE) if config.EMBEDDINGS_PROVIDER == "onnx" else "",
+        config.CROSSENCODER_MODEL if config.RAG_MODE == "hybrid+reranker" else "",
+        # Список исходных файлов, их размеры и mtime, а также параметры чанкинга: переиндексация с другими данными
+        # меняет хэш, и кэш retrieval вместе с checkpoint'ом evaluation начинаются заново
+        json.dumps(data_fingerprint(), sort_keys=True),
+    )
+
+
+class RetrieverCache:
+    """SQLite-кэш документов, найденных retriever'ом для вопросов датасета.
+
+    Один файл соответствует одной конфигурации retrieval и одному набору данных, поэтому смена
+    режима RAG, k, модели эмбеддингов или изменение исходных файлов автоматически использует новый кэш.
+    """
+
+    def __init__(self, dataset_name: str, config_hash: str, cache_dir: Path | None = None):
+        cache_dir = Path(cache_dir or config.EVALUATION_CACHE_DIR).expanduser()
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        self._path = cache_dir / f"retriever-{config_hash}.db"
+        self._dataset_name = dataset_name
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self._path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS retrieval ("
+            "question_hash TEXT PRIMARY KEY, contexts_json TEXT NOT NULL, ts INTEGER NOT NULL)"
+        )
+        self._conn.commit()
+        logger.info("Кэш retrieval: %s", self._path)
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def _key(self, question: str) -> str:
+        return _hash(self._dataset_name, question)
+
+    def get(self, question: str) -> list[Document] | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT contexts_json FROM retrieval WHERE question_hash = ?",
+                (self._key(question),),
+            ).fetchone()
+        if row is None:
+            return None
+        return [Document(page_content=item["page_content"], metadata=item["metadata"]) for item in json.loads(row[0])]
+
+    def put(self, question: str, documents: list[Document]) -> None:
+        contexts_json = json.dumps(
+            [{"page_content": doc.page_content, "metadata": doc.metadata} for doc in documents],
+            ensure_ascii=False,
+            default=str,
+        )
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO retrieval (question_hash, contexts_json, ts) VALUES (?, ?, ?)",
+                (self._key(question), contexts_json, int(time.time())),
+            )
+            self._conn.commit()
+
+    def to_hf(self) -> Dataset:
+        """Экспортирует кэш в HuggingFace Dataset (например, для push_to_hub)."""
+        with self._lock:
+            rows = self._conn.execute("SELECT question_hash, contexts_json, ts FROM retrieval").fetchall()
+        return Dataset.from_dict(
+            {
+                "question_hash": [row[0] for row in rows],
+                "contexts_json": [row[1] for row in rows],
+                "ts": [row[2] for row in rows],
+            }
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class CachedRetriever(BaseRetriever):
+    """Обёртка retriever'а, которая берёт документы из RetrieverCache и пополняет его."""
+
+    def __init__(self, retriever: BaseRetriever, cache: RetrieverCache):
+        super().__init__()
+        self._retriever = retriever
+        self._cache = cache
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def hits(self) -> int:
+        return self._hits
+
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+    def _get_relevant_documents(self, query: str) -> list[Document]:
+        documents = self._cache.get(query)
+        if documents is not None:
+            self._hits += 1
+            return documents
+        self._misses += 1
+        documents = self._retriever.invoke(query)
+        self._cache.put(query, documents)
+        return documents
+
+    async def _aget_relevant_documents(self, query: str) -> list[Document]:
+        documents = self._cache.get(query)
+        if documents is not None:
+            self._hits += 1
+            return documents
+        self._misses += 1
+        documents = await self._retriever.ainvoke(query)
+        self._cache.put(query, documents)
+        return documents
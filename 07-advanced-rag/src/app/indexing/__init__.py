@@ -2,24 +2,102 @@
 from __future__ import annotations
 
 import asyncio
+import concurrent.futures
 import logging
+import threading
 from datetime import datetime, timezone
 
 from langchain_core.documents import Document
 
-from src.app.indexing.loader import load_and_prepare_documents
+from src.app import config
+from src.app.indexing.loader import data_fingerprint, iter_prepared_documents
 from src.app.indexing.vector_store import VectorStoreManager, get_vector_store_manager
 
 logger = logging.getLogger(__name__)
 
 _index_lock = asyncio.Lock()
 
+# Максимум пачек чанков, которые загрузчик может опередить вычисление эмбеддингов
+_QUEUE_MAXSIZE = 256
 
-async def _build_vector_store(manager: VectorStoreManager, documents: list[Document]) -> None:
-    logger.info("Начинаю создание векторного хранилища для %s чанков. Это может занять несколько минут...", len(documents))
-    vector_store = await asyncio.to_thread(manager.build_store_from_documents, documents)
+
+async def _build_vector_store(manager: VectorStoreManager) -> int:
+    """Загружает документы и вычисляет эмбеддинги параллельно, затем заменяет хранилище.
+
+    Загрузчик (разбор PDF) работает в отдельном потоке и складывает пачки чанков
+    в очередь, а эмбеддинги вычисляются по мере их поступления, поэтому время
+    индексации близко к max(разбор, эмбеддинги), а не к их сумме.
+
+    Returns:
+        Количество проиндексированных чанков (0 - документы не найдены)
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue[list[Document] | None] = asyncio.Queue(maxsize=_QUEUE_MAXSIZE)
+    stop = threading.Event()
+
+    def put(item: list[Document] | None) -> bool:
+        """Кладёт пачку в очередь из потока загрузчика; False - индексация прервана."""
+        future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+        while True:
+            try:
+                future.result(timeout=0.5)
+                return True
+            except concurrent.futures.TimeoutError:
+                if stop.is_set():
+                    future.cancel()
+                    return False
+
+    def produce() -> None:
+        for batch in iter_prepared_documents():
+            if not put(batch):
+                return
+        put(None)
+
+    # Отпечаток снимается до чтения файлов: изменения во время индексации сделают индекс устаревшим
+    fingerprint = await asyncio.to_thread(data_fingerprint)
+    documents: list[Document] = []
+    vectors: list[list[float] | None] = []
+
+    async def consume() -> None:
+        pending: list[Document] = []
+        finished = False
+        while not finished:
+            item = await queue.get()
+            # Забираем всё, что загрузчик успел подготовить, чтобы эмбеддинги считались крупными батчами
+            while True:
+                if item is None:
+                    finished = True
+                    break
+                pending.extend(item)
+                try:
+                    item = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+
+            if pending and (finished or len(pending) >= config.EMBED_BATCH_SIZE):
+                batch, pending = pending, []
+                vectors.extend(await manager.aembed_documents_in_batches(batch))
+                documents.extend(batch)
+                logger.info("Эмбеддинги вычислены для %s чанков", len(documents))
+
+    try:
+        async with asyncio.TaskGroup() as group:
+            group.create_task(asyncio.to_thread(produce))
+            group.create_task(consume())
+    except ExceptionGroup as errors:
+        # Пробрасываем исходную ошибку, чтобы в статусе индексации было понятное сообщение
+        raise errors.exceptions[0] from None
+    finally:
+        stop.set()
+
+    if not documents:
+        return 0
+
+    logger.info("Все чанки обработаны (%s). Собираю векторное хранилище...", len(documents))
+    vector_store = await asyncio.to_thread(manager.build_store_from_embeddings, documents, vectors, fingerprint)
     logger.info("Векторное хранилище создано. Обновляю статус индексации...")
     manager.replace_store(vector_store, chunks=len(documents), documents=documents)
+    return len(documents)
 
 
 def _format_timestamp(value: datetime | None) -> str:
@@ -33,7 +111,7 @@ async def run_full_indexing() -> None:
     Полностью переиндексирует PDF-документы.
 
     - очищает предыдущие данные;
-    - загружает документы и разбивает на чанки;
+    - загружает документы и разбивает на чанки, параллельно вычисляя эмбеддинги;
     - строит новое in-memory векторное хранилище;
     - обновляет статус индексации.
     """
@@ -47,15 +125,13 @@ async def run_full_indexing() -> None:
         logger.info("Старт полной переиндексации данных.")
         manager.start_indexing()
         try:
-            documents = await asyncio.to_thread(load_and_prepare_documents)
-            if not documents:
+            chunks = await _build_vector_store(manager)
+            if not chunks:
                 manager.reset()
                 manager.finish_indexing(chunks=0)
                 logger.info("Переиндексация завершена: новые документы не найдены.")
                 return
 
-            logger.info("Всего документов для индексации: %s. Начинаю создание эмбеддингов...", len(documents))
-            await _build_vector_store(manager, documents)
             logger.info("Переиндексация завершена успешно. Количество чанков: %s.", manager.status.chunks)
         except Exception as exc:
             manager.fail_indexing(message=str(exc))
@@ -0,0 +1,183 @@
+"""Content-addressed кэш эмбеддингов (LRU в памяти + SQLite на диске)."""
+from __future__ import annotations
+
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from src.app import config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MEMORY_SIZE = 50_000
+
+
+class CachedEmbeddings(Embeddings):
+    """Обёртка эмбеддингов, которая не пересчитывает уже встречавшиеся тексты.
+
+    Ключ кэша - хэш модели и текста, поэтому повторная индексация того же корпуса
+    и повторные прогоны evaluation не обращаются к модели.
+    Поддерживает оба интерфейса: langchain (embed_query/embed_documents) и
+    RAGAS (embed_text/embed_texts). Промахи кэша отправляются в базовую модель
+    одним батчем с сохранением порядка.
+    """
+
+    def __init__(
+        self,
+        base: Any,
+        model_name: str,
+        cache_dir: Path | str | None = None,
+        memory_size: int = DEFAULT_MEMORY_SIZE,
+        cache_queries: bool = True,
+    ):
+        """Инициализирует кэш.
+
+        Args:
+            base: Базовая модель эмбеддингов
+            model_name: Идентификатор модели (входит в ключ кэша)
+            cache_dir: Директория SQLite файла (по умолчанию CACHE_DIR)
+            memory_size: Количество векторов в LRU кэше в памяти
+            cache_queries: Кэшировать ли embed_query (False - запросы пользователей не сохраняются на диск)
+        """
+        self._base = base
+        self._model_name = model_name
+        self._memory: OrderedDict[bytes, list[float]] = OrderedDict()
+        # embed_documents вызывается из нескольких потоков (asyncio.to_thread), а OrderedDict
+        # не потокобезопасен: get/move_to_end/popitem выполняются только под этой блокировкой.
+        # Отдельно от блокировки SQLite, чтобы попадания в память не ждали запись на диск
+        self._memory_lock = threading.Lock()
+        self._memory_size = memory_size
+        self._cache_queries = cache_queries
+
+        cache_dir = Path(cache_dir or config.CACHE_DIR).expanduser()
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_dir / "embeddings.db", check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vec BLOB NOT NULL)")
+        self._conn.commit()
+
+    def _key(self, text: str) -> bytes:
+        return hashlib.sha1((self._model_name + "\0" + text).encode("utf-8")).digest()
+
+    def _remember(self, key: bytes, vector: list[float]) -> None:
+        with self._memory_lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            if len(self._memory) > self._memory_size:
+                self._memory.popitem(last=False)
+
+    def _lookup(self, texts: list[str]) -> tuple[list[list[float] | None], list[bytes]]:
+        """Ищет векторы в памяти, затем в SQLite. Возвращает найденные векторы и ключи."""
+        keys = [self._key(text) for text in texts]
+        vectors: list[list[float] | None] = [None] * len(texts)
+        missing_in_memory: dict[bytes, list[int]] = {}
+
+        with self._memory_lock:
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    vectors[i] = vector
+                else:
+                    missing_in_memory.setdefault(key, []).append(i)
+
+        if missing_in_memory:
+            placeholders = ",".join("?" * len(missing_in_memory))
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT key, vec FROM embeddings WHERE key IN ({placeholders})",
+                    list(missing_in_memory),
+                ).fetchall()
+            for key, blob in rows:
+                vector = np.frombuffer(blob, dtype=np.float32).tolist()
+                self._remember(key, vector)
+                for i in missing_in_memory[key]:
+                    vectors[i] = vector
+
+        return vectors, keys
+
+    def _store(self, keys: list[bytes], vectors: list[list[float]]) -> None:
+        rows = []
+        for key, vector in zip(keys, vectors, strict=True):
+            self._remember(key, vector)
+            rows.append((key, np.asarray(vector, dtype=np.float32).tobytes()))
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (key, vec) VALUES (?, ?)", rows)
+            self._conn.commit()
+
+    def _misses(self, texts: list[str], vectors: list[list[float] | None], keys: list[bytes]):
+        """Возвращает уникальные тексты без вектора, их ключи и позиции в исходном списке."""
+        positions: dict[bytes, list[int]] = {}
+        miss_texts: list[str] = []
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                if keys[i] not in positions:
+                    miss_texts.append(texts[i])
+                positions.setdefault(keys[i], []).append(i)
+        return miss_texts, list(positions), positions
+
+    def _embed_base(self, texts: list[str]) -> list[list[float]]:
+        if hasattr(self._base, "embed_texts"):
+            return self._base.embed_texts(texts)
+        return self._base.embed_documents(texts)
+
+    async def _aembed_base(self, texts: list[str]) -> list[list[float]]:
+        if hasattr(self._base, "aembed_texts"):
+            return await self._base.aembed_texts(texts)
+        if hasattr(self._base, "aembed_documents"):
+            return await self._base.aembed_documents(texts)
+        return self._embed_base(texts)
+
+    def _fill(self, vectors, miss_keys, positions, embedded) -> list[list[float]]:
+        embedded = [list(vector) for vector in embedded]
+        self._store(miss_keys, embedded)
+        for key, vector in zip(miss_keys, embedded, strict=True):
+            for i in positions[key]:
+                vectors[i] = vector
+        return vectors
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        vectors, keys = self._lookup(texts)
+        miss_texts, miss_keys, positions = self._misses(texts, vectors, keys)
+        if not miss_texts:
+            return vectors
+        return self._fill(vectors, miss_keys, positions, self._embed_base(miss_texts))
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        vectors, keys = self._lookup(texts)
+        miss_texts, miss_keys, positions = self._misses(texts, vectors, keys)
+        if not miss_texts:
+            return vectors
+        return self._fill(vectors, miss_keys, positions, await self._aembed_base(miss_texts))
+
+    def embed_query(self, text: str) -> list[float]:
+        if not self._cache_queries:
+            return self._base.embed_query(text)
+        return self.embed_documents([text])[0]
+
+    async def aembed_query(self, text: str) -> list[float]:
+        if not self._cache_queries:
+            if hasattr(self._base, "aembed_query"):
+                return await self._base.aembed_query(text)
+            return self._base.embed_query(text)
+        return (await self.aembed_documents([text]))[0]
+
+    # Интерфейс RAGAS embeddings
+    def embed_text(self, text: str) -> list[float]:
+        return self.embed_query(text)
+
+    def embed_texts(self, texts: list[str]) -> list[list[float]]:
+        return self.embed_documents(texts)
+
+    async def aembed_text(self, text: str) -> list[float]:
+        return await self.aembed_query(text)
+
+    async def aembed_texts(self, texts: list[str]) -> list[list[float]]:
+        return await self.aembed_documents(texts)
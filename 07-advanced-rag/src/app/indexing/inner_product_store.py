@@ -0,0 +1,148 @@
+"""In-memory векторное хранилище с поиском по скалярному произведению нормализованных векторов."""
+from __future__ import annotations
+
+import logging
+from typing import Any, Callable, Sequence
+
+import numpy as np
+from langchain_community.vectorstores import InMemoryVectorStore
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+
+def l2_normalize(vectors: Any) -> np.ndarray:
+    """Нормализует строки матрицы (или один вектор) до единичной длины; нулевые векторы не меняются."""
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class InnerProductVectorStore(InMemoryVectorStore):
+    """InMemoryVectorStore, в котором векторы нормализуются один раз при добавлении.
+
+    Близость считается как M @ q (одно матричное умножение через BLAS) по матрице,
+    собранной в add_vectors (или при первом поиске после других изменений хранилища).
+    Для единичных векторов
+    скалярное произведение равно косинусной близости, поэтому score в результатах
+    поиска лежит в [-1, 1] и сравним с оценками исходного InMemoryVectorStore.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._matrix: np.ndarray | None = None
+        self._matrix_docs: list[dict[str, Any]] = []
+
+    def add_vectors(
+        self,
+        documents: Sequence[Document],
+        vectors: Sequence[Sequence[float]] | np.ndarray,
+        ids: Sequence[str],
+        *,
+        normalized: bool = False,
+    ) -> None:
+        """Добавляет документы с готовыми эмбеддингами (без обращения к модели).
+
+        Матрица для поиска собирается здесь же, при индексации, чтобы первый
+        запрос пользователя не тратил время на её построение. Записи хранилища
+        ссылаются на строки этой матрицы, а не на списки Python float, поэтому
+        матрица может быть np.memmap и не занимать память процесса.
+
+        Args:
+            normalized: Векторы уже нормализованы (float32 массив используется без копирования)
+        """
+        if not documents:
+            return
+        was_empty = not self.store
+        matrix = np.asarray(vectors, dtype=np.float32) if normalized else l2_normalize(vectors)
+        for doc, doc_id, vector in zip(documents, ids, matrix, strict=True):
+            # Тот же формат записи, что и в InMemoryVectorStore.add_documents
+            self.store[doc_id] = {
+                "id": doc_id,
+                "vector": vector,
+                "text": doc.page_content,
+                "metadata": doc.metadata,
+            }
+        self._matrix = None
+        if was_empty and len(self.store) == len(matrix):
+            # Новое хранилище без повторяющихся id: строки матрицы совпадают с порядком store
+            self._matrix_docs = list(self.store.values())
+            self._matrix = matrix
+        else:
+            self._ensure_matrix()
+
+    def add_documents(self, documents: list[Document], ids: list[str] | None = None, **kwargs: Any) -> list[str]:
+        added_ids = super().add_documents(documents, ids=ids, **kwargs)
+        self._normalize_entries(added_ids)
+        return added_ids
+
+    async def aadd_documents(self, documents: list[Document], ids: list[str] | None = None, **kwargs: Any) -> list[str]:
+        added_ids = await super().aadd_documents(documents, ids=ids, **kwargs)
+        self._normalize_entries(added_ids)
+        return added_ids
+
+    def delete(self, ids: Sequence[str] | None = None, **kwargs: Any) -> None:
+        super().delete(ids, **kwargs)
+        self._matrix = None
+
+    def _normalize_entries(self, ids: Sequence[str]) -> None:
+        if ids:
+            normalized = l2_normalize([self.store[doc_id]["vector"] for doc_id in ids])
+            for doc_id, vector in zip(ids, normalized):
+                self.store[doc_id]["vector"] = vector.tolist()
+        self._matrix = None
+
+    def _ensure_matrix(self) -> np.ndarray:
+        if self._matrix is None:
+            self._matrix_docs = list(self.store.values())
+            if self._matrix_docs:
+                self._matrix = np.ascontiguousarray([doc["vector"] for doc in self._matrix_docs], dtype=np.float32)
+            else:
+                self._matrix = np.empty((0, 0), dtype=np.float32)
+            logger.debug("Матрица векторов собрана: %s", self._matrix.shape)
+        return self._matrix
+
+    def _similarity_search_with_score_by_vector(
+        self,
+        embedding: list[float],
+        k: int = 4,
+        filter: Callable[[Document], bool] | None = None,  # noqa: A002
+    ) -> list[tuple[Document, float, list[float]]]:
+        matrix = self._ensure_matrix()
+        docs = self._matrix_docs
+        if not docs:
+            return []
+
+        if filter is not None:
+            rows = [
+                i
+                for i, doc in enumerate(docs)
+                if filter(Document(id=doc["id"], page_content=doc["text"], metadata=doc["metadata"]))
+            ]
+            if not rows:
+                return []
+            matrix = matrix[rows]
+        else:
+            rows = None
+
+        similarity = matrix @ l2_normalize(embedding)
+
+        k = min(k, len(similarity))
+        if k <= 0:
+            return []
+        # argpartition выбирает top-k за O(n), сортируются только k лучших
+        top_k_idx = np.argpartition(-similarity, k - 1)[:k]
+        top_k_idx = top_k_idx[np.argsort(-similarity[top_k_idx])]
+
+        results = []
+        for idx in top_k_idx:
+            doc = docs[rows[idx] if rows is not None else idx]
+            results.append(
+                (
+                    Document(id=doc["id"], page_content=doc["text"], metadata=doc["metadata"]),
+                    float(similarity[idx]),
+                    doc["vector"],
+                )
+            )
+        return results
@@ -4,10 +4,10 @@ from __future__ import annotations
 import logging
 import re
 from pathlib import Path
-from typing import Sequence
+from typing import Any, Iterator, Sequence
 
 from langchain_core.documents import Document
-from langchain_community.document_loaders import JSONLoader, PyPDFDirectoryLoader
+from langchain_community.document_loaders import JSONLoader, PyPDFLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 from src.app import config
@@ -19,16 +19,45 @@ CHUNK_OVERLAP = 120
 JSON_FILENAME = "sberbank_help_documents.json"
 
 
-def _load_pdf_documents(data_path: Path) -> list[Document]:
+def _iter_pdf_pages(data_path: Path) -> Iterator[Document]:
+    """Лениво читает PDF из data_path постранично (те же файлы, что и PyPDFDirectoryLoader)."""
     if not data_path.exists():
         raise FileNotFoundError(f"Директория с данными {data_path!s} не найдена.")
     if not data_path.is_dir():
         raise NotADirectoryError(f"DATA_PATH {data_path!s} должен быть директорией.")
 
-    loader = PyPDFDirectoryLoader(str(data_path))
-    documents = loader.load()
-    logger.info("Загружено %s PDF-документов для индексации.", len(documents))
-    return documents
+    for path in _pdf_paths(data_path):
+        for page in PyPDFLoader(str(path)).lazy_load():
+            page.metadata["source"] = str(path)
+            yield page
+
+
+def _pdf_paths(data_path: Path) -> Iterator[Path]:
+    for path in sorted(data_path.glob("**/[!.]*.pdf")):
+        # Скрытые файлы и директории пропускаются, как в PyPDFDirectoryLoader
+        if not path.is_file() or any(part.startswith(".") for part in path.relative_to(data_path).parts):
+            continue
+        yield path
+
+
+def data_fingerprint(data_path: Path | None = None) -> dict[str, Any]:
+    """Отпечаток исходных данных для сохранённого индекса: файлы (путь, размер, mtime) и параметры разбиения.
+
+    Если отпечаток не совпадает с сохранённым, индекс устарел и не загружается.
+    """
+    data_path = Path(config.DATA_PATH) if data_path is None else data_path
+    paths: list[Path] = []
+    if data_path.is_dir():
+        paths.extend(_pdf_paths(data_path))
+        json_path = data_path / JSON_FILENAME
+        if json_path.is_file():
+            paths.append(json_path)
+
+    files = []
+    for path in paths:
+        stat = path.stat()
+        files.append([path.relative_to(data_path).as_posix(), stat.st_size, stat.st_mtime_ns])
+    return {"chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP, "files": files}
 
 
 def _load_json_documents(data_path: Path, filename: str = JSON_FILENAME) -> list[Document]:
@@ -68,7 +97,7 @@ def _split_documents(documents: Sequence[Document]) -> list[Document]:
         keep_separator=True,
     )
     chunks = splitter.split_documents(list(documents))
-    logger.info("Документы разбиты на %s чанков.", len(chunks))
+    logger.debug("Документы разбиты на %s чанков.", len(chunks))
     return chunks
 
 
@@ -154,35 +183,52 @@ def _filter_and_clean_chunks(chunks: list[Document]) -> list[Document]:
         filtered.append(cleaned_chunk)
     
     if skipped_count > 0:
-        logger.info("Пропущено %s невалидных чанков. Осталось %s чанков для индексации.", skipped_count, len(filtered))
+        logger.debug("Пропущено %s невалидных чанков. Осталось %s чанков для индексации.", skipped_count, len(filtered))
     
     return filtered
 
 
-def load_and_prepare_documents() -> list[Document]:
-    """Загружает PDF и JSON-документы из DATA_PATH и подготавливает их к индексации."""
+def iter_prepared_documents() -> Iterator[list[Document]]:
+    """Лениво загружает PDF и JSON-документы из DATA_PATH и отдаёт готовые к индексации чанки пачками.
+
+    PDF читаются постранично, поэтому первые чанки доступны для вычисления
+    эмбеддингов до окончания разбора всех файлов.
+    """
     data_path = Path(config.DATA_PATH)
-    pdf_documents = _load_pdf_documents(data_path)
-    pdf_chunks = _split_documents(pdf_documents) if pdf_documents else []
+    pdf_pages = pdf_chunks = json_chunks = filtered_count = 0
+
+    for page in _iter_pdf_pages(data_path):
+        pdf_pages += 1
+        chunks = _split_documents([page])
+        pdf_chunks += len(chunks)
+        filtered = _filter_and_clean_chunks(chunks)
+        filtered_count += len(filtered)
+        if filtered:
+            yield filtered
 
     json_documents = _load_json_documents(data_path)
-    json_chunks = _split_documents(json_documents) if json_documents else []
+    if json_documents:
+        chunks = _split_documents(json_documents)
+        json_chunks = len(chunks)
+        filtered = _filter_and_clean_chunks(chunks)
+        filtered_count += len(filtered)
+        if filtered:
+            yield filtered
 
     if not pdf_chunks and not json_chunks:
         logger.warning("В директории %s не найдено данных для индексации.", data_path)
-        return []
+        return
 
-    combined = pdf_chunks + json_chunks
-    
-    # Фильтруем и очищаем чанки перед индексацией
-    filtered_chunks = _filter_and_clean_chunks(combined)
-    
     logger.info(
-        "Всего документов для индексации: %s (PDF-чункы: %s, JSON-записи: %s, после фильтрации: %s).",
-        len(combined),
-        len(pdf_chunks),
-        len(json_chunks),
-        len(filtered_chunks),
+        "Всего документов для индексации: %s (PDF-страниц: %s, PDF-чанков: %s, JSON-записи: %s, после фильтрации: %s).",
+        pdf_chunks + json_chunks,
+        pdf_pages,
+        pdf_chunks,
+        json_chunks,
+        filtered_count,
     )
-    return filtered_chunks
 
+
+def load_and_prepare_documents() -> list[Document]:
+    """Загружает PDF и JSON-документы из DATA_PATH и подготавливает их к индексации."""
+    return [chunk for batch in iter_prepared_documents() for chunk in batch]
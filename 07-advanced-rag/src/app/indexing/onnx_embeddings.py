@@ -0,0 +1,117 @@
+"""Эмбеддинги sentence-transformers моделей через ONNX Runtime (опционально с INT8 квантованием)."""
+from __future__ import annotations
+
+import logging
+import re
+from pathlib import Path
+from typing import Literal
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+_QUANTIZED_FILE_NAME = "model_quantized.onnx"
+
+
+class ONNXEmbeddings(Embeddings):
+    """Вычисляет эмбеддинги экспортированной в ONNX моделью на ONNX Runtime.
+
+    При первом запуске модель экспортируется из HuggingFace Hub в cache_dir
+    (и при quantize=True динамически квантуется в INT8), последующие запуски
+    загружают готовый файл. Нужны пакеты optimum[onnxruntime] и transformers.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        cache_dir: Path | str,
+        *,
+        quantize: bool = True,
+        pooling: Literal["mean", "cls"] = "mean",
+        batch_size: int = 64,
+        device: str = "cpu",
+        max_length: int = 512,
+    ):
+        """Инициализирует модель.
+
+        Args:
+            model_name: Имя модели в HuggingFace Hub
+            cache_dir: Директория для экспортированных ONNX моделей
+            quantize: Использовать INT8 динамическое квантование весов
+            pooling: Пулинг токенов (mean - sentence-transformers, cls - модели семейства bge)
+            batch_size: Количество текстов за один вызов InferenceSession
+            device: cpu или cuda (CUDAExecutionProvider, нужен onnxruntime-gpu)
+            max_length: Максимальная длина текста в токенах
+        """
+        try:
+            from optimum.onnxruntime import ORTModelForFeatureExtraction
+            from transformers import AutoTokenizer
+        except ImportError as exc:
+            raise ImportError(
+                "Для EMBEDDINGS_PROVIDER=onnx установите пакеты optimum[onnxruntime] и transformers"
+            ) from exc
+
+        self._pooling = pooling
+        self._batch_size = max(1, batch_size)
+        self._max_length = max_length
+
+        safe_name = re.sub(r"[^A-Za-z0-9._-]", "_", model_name)
+        model_dir = Path(cache_dir).expanduser() / "onnx" / safe_name
+        if not (model_dir / "model.onnx").exists():
+            logger.info("Экспорт модели %s в ONNX: %s", model_name, model_dir)
+            model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+            model.save_pretrained(model_dir)
+            AutoTokenizer.from_pretrained(model_name).save_pretrained(model_dir)
+
+        file_name = "model.onnx"
+        if quantize:
+            if not (model_dir / _QUANTIZED_FILE_NAME).exists():
+                _quantize_dynamic(model_dir)
+            file_name = _QUANTIZED_FILE_NAME
+
+        provider = "CUDAExecutionProvider" if device.startswith("cuda") else "CPUExecutionProvider"
+        self._tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self._model = ORTModelForFeatureExtraction.from_pretrained(model_dir, file_name=file_name, provider=provider)
+        logger.info("ONNX модель загружена: %s (%s, %s)", model_name, file_name, provider)
+
+    def _embed_batch(self, texts: list[str]) -> np.ndarray:
+        inputs = self._tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=self._max_length,
+            return_tensors="np",
+        )
+        hidden = np.asarray(self._model(**inputs).last_hidden_state, dtype=np.float32)
+        if self._pooling == "cls":
+            pooled = hidden[:, 0]
+        else:
+            mask = inputs["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return pooled / np.clip(norms, 1e-12, None)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        batches = [
+            self._embed_batch(texts[start:start + self._batch_size])
+            for start in range(0, len(texts), self._batch_size)
+        ]
+        return np.concatenate(batches).tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+
+def _quantize_dynamic(model_dir: Path) -> None:
+    """Квантует веса model.onnx в INT8 (динамическое квантование, без калибровочного датасета)."""
+    from optimum.onnxruntime import ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+    logger.info("INT8 квантование ONNX модели: %s", model_dir)
+    quantizer = ORTQuantizer.from_pretrained(model_dir, file_name="model.onnx")
+    # avx512_vnni использует int8 GEMM инструкции; на CPU без VNNI модель работает, но медленнее
+    quantization_config = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+    quantizer.quantize(save_dir=model_dir, quantization_config=quantization_config)
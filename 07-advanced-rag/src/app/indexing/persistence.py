@@ -0,0 +1,138 @@
+"""Сохранение индекса на диск: матрица эмбеддингов в np.memmap и документы в JSON."""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import uuid
+from pathlib import Path
+from typing import Any, Sequence
+
+import numpy as np
+from langchain_core.documents import Document
+
+from src.app import config
+
+logger = logging.getLogger(__name__)
+
+# Имя файла матрицы до версионирования (индексы, сохранённые без поля "vectors")
+_VECTORS_FILE = "vecs.f32"
+_VECTORS_GLOB = "vecs*.f32"
+_DOCUMENTS_FILE = "docs.json"
+
+
+def index_dir() -> Path:
+    """Директория индекса для текущей модели эмбеддингов (другая модель - другой индекс)."""
+    digest = hashlib.blake2b(digest_size=8)
+    for part in (
+        config.EMBEDDINGS_PROVIDER.lower(),
+        config.EMBEDDINGS_MODEL,
+        str(config.ONNX_QUANTIZE) if config.EMBEDDINGS_PROVIDER.lower() == "onnx" else "",
+    ):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return Path(config.INDEX_DIR).expanduser() / digest.hexdigest()
+
+
+def save_index(
+    path: Path,
+    documents: Sequence[Document],
+    rows: Sequence[int],
+    ids: Sequence[str],
+    matrix: np.ndarray,
+    fingerprint: dict[str, Any],
+) -> np.ndarray:
+    """Сохраняет индекс и возвращает матрицу, открытую с диска только на чтение.
+
+    Args:
+        path: Директория индекса
+        documents: Все документы (включая чанки без эмбеддинга - они нужны BM25)
+        rows: Номер строки матрицы для каждого документа (-1 - эмбеддинга нет)
+        ids: Идентификаторы строк матрицы
+        matrix: Нормализованные эмбеддинги (float32, shape = (len(ids), dim))
+        fingerprint: Отпечаток исходных данных (loader.data_fingerprint)
+    """
+    path.mkdir(parents=True, exist_ok=True)
+    documents_path = path / _DOCUMENTS_FILE
+
+    # Матрица пишется в новый файл, а docs.json переключается на него атомарно.
+    # Файл старого индекса не перезаписывается: он может быть открыт как memmap,
+    # а в Windows отображённый в память файл нельзя заменить или удалить
+    vectors_name = f"vecs-{uuid.uuid4().hex[:12]}.f32"
+    vectors_path = path / vectors_name
+    mapped = np.memmap(vectors_path, dtype=np.float32, mode="w+", shape=matrix.shape)
+    mapped[:] = matrix
+    mapped.flush()
+    del mapped
+
+    payload = {
+        "vectors": vectors_name,
+        "fingerprint": fingerprint,
+        "shape": list(matrix.shape),
+        "ids": list(ids),
+        "documents": [
+            {"text": doc.page_content, "metadata": doc.metadata, "row": row}
+            for doc, row in zip(documents, rows, strict=True)
+        ],
+    }
+    tmp_documents = documents_path.with_suffix(".tmp")
+    tmp_documents.write_text(json.dumps(payload, ensure_ascii=False, default=str), encoding="utf-8")
+
+    os.replace(tmp_documents, documents_path)
+    _remove_stale_vectors(path, keep=vectors_name)
+    logger.info("Индекс сохранён в %s: %s векторов, %s документов", path, matrix.shape[0], len(documents))
+    return np.memmap(vectors_path, dtype=np.float32, mode="r", shape=matrix.shape)
+
+
+def _remove_stale_vectors(path: Path, keep: str) -> None:
+    """Удаляет файлы матриц прежних индексов; занятые (открытый memmap в Windows) удалятся при следующем сохранении."""
+    for stale in path.glob(_VECTORS_GLOB):
+        if stale.name == keep:
+            continue
+        try:
+            stale.unlink()
+        except OSError as exc:
+            logger.debug("Не удалось удалить старую матрицу %s: %s", stale, exc)
+
+
+def load_index(
+    path: Path,
+    fingerprint: dict[str, Any],
+) -> tuple[list[Document], list[int], list[str], np.ndarray] | None:
+    """Загружает индекс, сохранённый save_index (None - индекса нет, он повреждён или устарел).
+
+    Args:
+        path: Директория индекса
+        fingerprint: Отпечаток текущих исходных данных; индекс по другим данным не загружается
+
+    Returns:
+        Документы, номера строк матрицы, идентификаторы строк и матрица (np.memmap на чтение)
+    """
+    documents_path = path / _DOCUMENTS_FILE
+    if not documents_path.exists():
+        return None
+
+    try:
+        payload = json.loads(documents_path.read_text(encoding="utf-8"))
+        if payload.get("fingerprint") != fingerprint:
+            logger.info(
+                "Данные в %s изменились после сохранения индекса, нужна переиндексация (/index)", config.DATA_PATH
+            )
+            return None
+        vectors_path = path / payload.get("vectors", _VECTORS_FILE)
+        if not vectors_path.exists():
+            return None
+        shape = tuple(payload["shape"])
+        matrix = np.memmap(vectors_path, dtype=np.float32, mode="r", shape=shape)
+        documents = [Document(page_content=item["text"], metadata=item["metadata"]) for item in payload["documents"]]
+        rows = [int(item["row"]) for item in payload["documents"]]
+        ids = list(payload["ids"])
+    except (OSError, ValueError, KeyError, TypeError) as exc:
+        logger.warning("Не удалось загрузить индекс из %s: %s", path, exc)
+        return None
+
+    if len(ids) != shape[0]:
+        logger.warning("Индекс в %s повреждён: %s идентификаторов для %s векторов", path, len(ids), shape[0])
+        return None
+    return documents, rows, ids, matrix
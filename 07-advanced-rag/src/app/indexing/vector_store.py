@@ -1,19 +1,28 @@
 """Управление in-memory векторным хранилищем и статусом индексации."""
 from __future__ import annotations
 
+import asyncio
 import logging
+import random
+import uuid
+import warnings
 from dataclasses import dataclass
 from functools import lru_cache
 from pathlib import Path
-from typing import Literal, Sequence
+from typing import Any, Literal, Sequence
 from datetime import datetime, timezone
 
+import numpy as np
+
 from langchain_core.documents import Document
 from langchain_core.embeddings import Embeddings
 from langchain_core.retrievers import BaseRetriever
-from langchain_community.vectorstores import InMemoryVectorStore
+from langchain_core.vectorstores import VectorStore
 
 from src.app import config
+from src.app.indexing.inner_product_store import InnerProductVectorStore, l2_normalize
+from src.app.indexing.loader import data_fingerprint
+from src.app.indexing.persistence import index_dir, load_index, save_index
 
 logger = logging.getLogger(__name__)
 
@@ -31,9 +40,9 @@ class VectorStoreManager:
 
     def __init__(self, embeddings: Embeddings):
         self._embeddings = embeddings
-        self._vector_store = InMemoryVectorStore(embedding=embeddings)
+        self._vector_store = InnerProductVectorStore(embedding=embeddings)
         self._status = IndexStatus()
-        self._documents: list[Document] = []  # Храним документы для BM25 индексации
+        self._documents: tuple[Document, ...] = ()  # Храним документы для BM25 индексации
 
     @property
     def status(self) -> IndexStatus:
@@ -44,7 +53,7 @@ class VectorStoreManager:
         return self._embeddings
 
     @property
-    def vector_store(self) -> InMemoryVectorStore:
+    def vector_store(self) -> VectorStore:
         return self._vector_store
 
     def start_indexing(self) -> None:
@@ -72,7 +81,7 @@ class VectorStoreManager:
         )
 
     def reset(self) -> None:
-        self._vector_store = InMemoryVectorStore(embedding=self._embeddings)
+        self._vector_store = InnerProductVectorStore(embedding=self._embeddings)
         self._status = IndexStatus(
             state="idle",
             chunks=0,
@@ -80,7 +89,9 @@ class VectorStoreManager:
             error_message=None,
         )
 
-    def replace_store(self, vector_store: InMemoryVectorStore, chunks: int, documents: Sequence[Document] | None = None) -> None:
+    def replace_store(
+        self, vector_store: VectorStore, chunks: int, documents: Sequence[Document] | None = None
+    ) -> None:
         """Заменяет векторное хранилище и обновляет статус.
 
         Args:
@@ -90,16 +101,17 @@ class VectorStoreManager:
         """
         self._vector_store = vector_store
         if documents is not None:
-            self._documents = list(documents)
+            # Кортеж: get_documents отдаёт его без копирования, изменить его снаружи нельзя
+            self._documents = tuple(documents)
         self.finish_indexing(chunks)
 
-    def get_documents(self) -> list[Document]:
-        """Возвращает список документов для BM25 индексации.
+    def get_documents(self) -> Sequence[Document]:
+        """Возвращает документы для BM25 индексации (только для чтения, без копирования).
 
         Returns:
-            Список документов
+            Неизменяемая последовательность документов (для изменения используйте list(...))
         """
-        return self._documents.copy()
+        return self._documents
 
     def set_status(self, state: Literal["idle", "running", "ready", "error"], chunks: int | None = None) -> None:
         self._status = IndexStatus(
@@ -116,151 +128,386 @@ class VectorStoreManager:
             k: Количество документов для возврата (по умолчанию SEMANTIC_K для Advanced RAG)
 
         Returns:
-            Semantic retriever из InMemoryVectorStore
+            Semantic retriever из векторного хранилища (score - скалярное произведение
+            нормализованных векторов, т.е. косинусная близость в [-1, 1])
         """
         if k is None:
             k = config.SEMANTIC_K if config.RAG_MODE != "semantic" else config.RETRIEVER_K
         return self._vector_store.as_retriever(search_kwargs={"k": k})
 
-    def build_store_from_documents(self, documents: Sequence[Document]) -> InMemoryVectorStore:
-        """Создаёт векторное хранилище из документов с обработкой ошибок и rate limiting."""
-        import logging
-        import time
-        
-        logger = logging.getLogger(__name__)
-        
+    def build_store_from_documents(self, documents: Sequence[Document]) -> VectorStore:
+        """Создаёт векторное хранилище из документов с обработкой ошибок и rate limiting.
+
+        Работает в две фазы: сначала эмбеддинги вычисляются батчами
+        (embed_documents_in_batches), затем хранилище заполняется готовыми векторами
+        (build_store_from_embeddings).
+        Вызывается в рабочем потоке (asyncio.to_thread), поэтому может
+        запускать собственный event loop.
+        """
+        vectors = self.embed_documents_in_batches(documents)
+        return self.build_store_from_embeddings(documents, vectors)
+
+    def build_store_from_embeddings(
+        self,
+        documents: Sequence[Document],
+        vectors: Sequence[list[float] | None],
+        fingerprint: dict[str, Any] | None = None,
+    ) -> VectorStore:
+        """Создаёт хранилище из документов с готовыми эмбеддингами.
+
+        Векторы нормализуются один раз, чтобы поиск сводился к скалярному произведению.
+        При PERSIST_INDEX матрица сохраняется на диск и хранилище работает
+        с её np.memmap копией (load_index загрузит её после перезапуска).
+
+        Args:
+            fingerprint: Отпечаток данных, снятый до чтения документов (None - снимается при сохранении)
+
+        Raises:
+            ValueError: Если не удалось получить ни одного эмбеддинга
+        """
+        _check_embedded(vectors)
+
+        # Проблемные чанки, для которых не удалось получить эмбеддинг, в хранилище не попадают
+        rows: list[int] = []
+        embedded: list[Document] = []
+        for doc, vector in zip(documents, vectors):
+            rows.append(len(embedded) if vector is not None else -1)
+            if vector is not None:
+                embedded.append(doc)
+        ids = [doc.id or str(uuid.uuid4()) for doc in embedded]
+        matrix = l2_normalize([vector for vector in vectors if vector is not None])
+
+        if config.PERSIST_INDEX:
+            try:
+                if fingerprint is None:
+                    fingerprint = data_fingerprint()
+                matrix = save_index(index_dir(), documents, rows, ids, matrix, fingerprint)
+            except OSError as exc:
+                logger.warning("Не удалось сохранить индекс на диск: %s", exc)
+
+        vector_store = InnerProductVectorStore(embedding=self._embeddings)
+        vector_store.add_vectors(embedded, matrix, ids=ids, normalized=True)
+        return vector_store
+
+    def load_index(self) -> bool:
+        """Загружает сохранённый индекс (build_store_from_embeddings) без повторной индексации.
+
+        Returns:
+            True, если индекс загружен и хранилище готово к поиску
+        """
+        loaded = load_index(index_dir(), data_fingerprint())
+        if loaded is None:
+            return False
+
+        documents, rows, ids, matrix = loaded
+        vector_store = InnerProductVectorStore(embedding=self._embeddings)
+        indexed = [doc for doc, row in zip(documents, rows) if row >= 0]
+        vector_store.add_vectors(indexed, matrix, ids=ids, normalized=True)
+        self.replace_store(vector_store, chunks=len(documents), documents=documents)
+        logger.info("Загружен сохранённый индекс: %s чанков", len(documents))
+        return True
+
+    def embed_documents_in_batches(self, documents: Sequence[Document]) -> list[list[float] | None]:
+        """Вычисляет эмбеддинги документов батчами по EMBED_BATCH_SIZE.
+
+        Returns:
+            Векторы в порядке документов (None для пропущенных проблемных чанков)
+        """
+        return asyncio.run(self.aembed_documents_in_batches(documents))
+
+    async def aembed_documents_in_batches(self, documents: Sequence[Document]) -> list[list[float] | None]:
+        """Асинхронный вариант embed_documents_in_batches для вызова из работающего event loop."""
+        if not documents:
+            return []
+
         # Определяем, какой провайдер используется
         provider = config.EMBEDDINGS_PROVIDER.lower()
         is_api_provider = provider in ("openai", "ollama")
-        
-        # Для API провайдеров импортируем специфичные исключения
-        if is_api_provider:
-            from openai import BadRequestError, RateLimitError
-            api_exceptions = (BadRequestError, RateLimitError)
+
+        if provider in ("huggingface", "onnx"):
+            # Локальная модель не выигрывает от параллельных вызовов и не имеет rate limit
+            concurrency = 1
         else:
-            # Для HuggingFace используем общие исключения
-            api_exceptions = Exception
-        
-        # Пробуем создать хранилище стандартным способом
-        try:
-            return InMemoryVectorStore.from_documents(documents, embedding=self._embeddings)
-        except api_exceptions as e:
-            # Если получили ошибку, пробуем добавлять документы батчами с задержками
-            logger.warning(
-                "Ошибка при создании эмбеддингов для всех документов: %s. "
-                "Пробую добавлять документы батчами с задержками...",
-                e
-            )
-            
-            vector_store = InMemoryVectorStore(embedding=self._embeddings)
-            successful_count = 0
-            failed_count = 0
-            
-            # Размер батча и задержка между запросами
-            # Для HuggingFace (локальные модели) задержки не нужны
-            # Для API (OpenAI/Fireworks) задержки нужны для избежания rate limit
-            if provider == "huggingface":
-                batch_size = 50  # Большие батчи для локальных моделей
-                delay_between_requests = 0.0  # Нет задержек для локальных моделей
-                delay_after_rate_limit = 0.0  # Rate limit не применим
-            else:
-                batch_size = 5  # Меньшие батчи для API
-                delay_between_requests = 0.5  # 500ms между запросами (увеличено для Fireworks API)
-                delay_after_rate_limit = 5.0  # 5 секунд после rate limit ошибки
-            
-            for batch_start in range(0, len(documents), batch_size):
-                batch = documents[batch_start:batch_start + batch_size]
-                
-                for idx, doc in enumerate(batch):
-                    doc_idx = batch_start + idx + 1
-                    max_retries = 3
-                    retry_count = 0
-                    success = False
-                    
-                    while retry_count < max_retries and not success:
-                        try:
-                            vector_store.add_documents([doc])
-                            successful_count += 1
-                            success = True
-                            
-                            # Небольшая задержка между успешными запросами (только для API)
-                            if doc_idx < len(documents) and delay_between_requests > 0:
-                                time.sleep(delay_between_requests)
-                        
-                        except Exception as exc:
-                            # Обработка rate limit только для API провайдеров
-                            if is_api_provider:
-                                try:
-                                    from openai import RateLimitError, BadRequestError
-                                    
-                                    if isinstance(exc, RateLimitError):
-                                        retry_count += 1
-                                        if retry_count < max_retries and delay_after_rate_limit > 0:
-                                            logger.warning(
-                                                "Rate limit достигнут для чанка #%s. Ожидание %s секунд...",
-                                                doc_idx,
-                                                delay_after_rate_limit
-                                            )
-                                            time.sleep(delay_after_rate_limit)
-                                        else:
-                                            failed_count += 1
-                                            logger.warning(
-                                                "Пропущен чанк #%s из-за rate limit после %s попыток",
-                                                doc_idx,
-                                                max_retries
-                                            )
-                                        continue
-                                    
-                                    if isinstance(exc, BadRequestError):
-                                        failed_count += 1
-                                        logger.warning(
-                                            "Пропущен проблемный чанк #%s из %s (длина: %s символов): %s",
-                                            doc_idx,
-                                            doc.metadata.get("source", "unknown"),
-                                            len(doc.page_content),
-                                            doc.page_content[:100] + "..." if len(doc.page_content) > 100 else doc.page_content
-                                        )
-                                        success = True
-                                        continue
-                                except ImportError:
-                                    pass
-                            
-                            # Общие ошибки (для HuggingFace или других провайдеров)
-                            failed_count += 1
+            concurrency = config.INDEXING_MAX_CONCURRENT
+
+        return await self._embed_in_batches(
+            documents,
+            is_api_provider=is_api_provider,
+            batch_size=config.EMBED_BATCH_SIZE,
+            concurrency=concurrency,
+        )
+
+    async def _embed_in_batches(
+        self,
+        documents: Sequence[Document],
+        *,
+        is_api_provider: bool,
+        batch_size: int,
+        concurrency: int,
+        max_retries: int = 5,
+    ) -> list[list[float] | None]:
+        """Вычисляет эмбеддинги батчами с ограниченной параллельностью.
+
+        Батч с ошибкой (кроме rate limit) делится пополам, пока проблемный
+        чанк не будет найден и пропущен; остальные чанки батча обрабатываются.
+        После rate limit батч повторяется через паузу из retry-after или
+        экспоненциальную паузу со случайной добавкой (_rate_limit_delay).
+        """
+        # Для локальных моделей специфичных исключений нет: except () ничего не перехватывает
+        rate_limit_errors: tuple = ()
+        if is_api_provider:
+            from openai import RateLimitError
+            rate_limit_errors = (RateLimitError,)
+
+        limit = _AdaptiveConcurrency(concurrency)
+        total = len(documents)
+        vectors: list[list[float] | None] = [None] * total
+        processed = 0
+
+        def report(count: int) -> None:
+            nonlocal processed
+            previous, processed = processed, processed + count
+            # Логируем прогресс каждые 50 чанков
+            if processed // 50 > previous // 50 or processed == total:
+                logger.info("Прогресс индексации: %s/%s чанков обработано", processed, total)
+
+        async def embed_batch(start: int, end: int) -> None:
+            """Вычисляет эмбеддинги документов [start, end)."""
+            texts = [doc.page_content for doc in documents[start:end]]
+            for attempt in range(1, max_retries + 1):
+                async with limit:
+                    try:
+                        batch_vectors = await asyncio.to_thread(self._embeddings.embed_documents, texts)
+                    except rate_limit_errors as exc:
+                        limit.on_rate_limit()
+                        delay = _rate_limit_delay(exc, attempt)
+                        if attempt == max_retries:
                             logger.warning(
-                                "Ошибка при обработке чанка #%s: %s",
-                                doc_idx,
-                                exc
+                                "Пропущены чанки #%s-#%s из-за rate limit после %s попыток",
+                                start + 1,
+                                end,
+                                max_retries
                             )
-                            success = True  # Помечаем как обработанный, даже если не добавлен
-                
-                # Логируем прогресс каждые 50 чанков
-                if (batch_start + batch_size) % 50 == 0:
-                    logger.info(
-                        "Прогресс индексации: %s/%s чанков обработано (успешно: %s, пропущено: %s)",
-                        min(batch_start + batch_size, len(documents)),
-                        len(documents),
-                        successful_count,
-                        failed_count
-                    )
-            
-            if failed_count > 0:
-                logger.info(
-                    "Индексация завершена с пропусками: успешно %s, пропущено %s из %s чанков",
-                    successful_count,
-                    failed_count,
-                    len(documents)
+                            report(end - start)
+                            return
+                    except Exception as exc:
+                        if end - start > 1:
+                            # Ищем проблемный чанк делением батча пополам
+                            break
+                        doc = documents[start]
+                        logger.warning(
+                            "Пропущен проблемный чанк #%s из %s (длина: %s символов): %s (%s)",
+                            start + 1,
+                            doc.metadata.get("source", "unknown"),
+                            len(doc.page_content),
+                            doc.page_content[:100] + "..." if len(doc.page_content) > 100 else doc.page_content,
+                            exc,
+                        )
+                        report(1)
+                        return
+                    else:
+                        limit.on_success()
+                        vectors[start:end] = batch_vectors
+                        report(end - start)
+                        return
+
+                logger.warning(
+                    "Rate limit достигнут для чанков #%s-#%s. Параллельность снижена до %s, ожидание %.1f секунд...",
+                    start + 1,
+                    end,
+                    limit.limit,
+                    delay
                 )
-            
-            if successful_count == 0:
-                raise ValueError("Не удалось проиндексировать ни одного чанка из-за ошибок")
-            
-            return vector_store
+                await asyncio.sleep(delay)
+
+            middle = (start + end) // 2
+            await asyncio.gather(embed_batch(start, middle), embed_batch(middle, end))
+
+        await asyncio.gather(
+            *(
+                embed_batch(batch_start, min(batch_start + batch_size, total))
+                for batch_start in range(0, total, batch_size)
+            )
+        )
+        return vectors
+
+
+def _rate_limit_delay(exc: Exception, attempt: int) -> float:
+    """Пауза перед повтором после rate limit.
+
+    Берётся из заголовка retry-after ответа провайдера, а если его нет -
+    экспоненциальная (1, 2, 4, ... но не больше 30 секунд) со случайной добавкой до секунды,
+    чтобы параллельные батчи не повторялись одновременно.
+    """
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        retry_after = float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        retry_after = None
+    if retry_after is not None and retry_after > 0:
+        return retry_after
+    return min(2 ** (attempt - 1), 30) + random.uniform(0, 1)
+
+
+def _check_embedded(vectors: Sequence[list[float] | None]) -> None:
+    """Логирует пропущенные чанки и проверяет, что хотя бы один эмбеддинг получен."""
+    successful_count = sum(vector is not None for vector in vectors)
+    failed_count = len(vectors) - successful_count
+    if failed_count > 0:
+        logger.info(
+            "Индексация завершена с пропусками: успешно %s, пропущено %s из %s чанков",
+            successful_count,
+            failed_count,
+            len(vectors)
+        )
+
+    if successful_count == 0:
+        raise ValueError("Не удалось проиндексировать ни одного чанка из-за ошибок")
+
+
+class _AdaptiveConcurrency:
+    """Ограничение параллельных запросов по схеме AIMD.
+
+    После rate limit лимит уменьшается вдвое, после серии успешных запросов
+    увеличивается на единицу (но не выше начального значения).
+    """
+
+    def __init__(self, maximum: int, increase_after: int = 10):
+        self._maximum = maximum
+        self._limit = maximum
+        self._increase_after = increase_after
+        self._successes = 0
+        self._in_flight = 0
+        self._condition = asyncio.Condition()
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    async def __aenter__(self) -> None:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < self._limit)
+            self._in_flight += 1
+
+    async def __aexit__(self, *exc_info) -> None:
+        async with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self) -> None:
+        self._successes += 1
+        if self._successes >= self._increase_after and self._limit < self._maximum:
+            self._limit += 1
+            self._successes = 0
+
+    def on_rate_limit(self) -> None:
+        self._limit = max(1, self._limit // 2)
+        self._successes = 0
+
+
+class FAISSVectorStoreManager(VectorStoreManager):
+    """Менеджер хранилища на FAISS HNSW индексе (VECTOR_BACKEND=faiss).
+
+    Поиск приближённый и сублинейный по размеру корпуса, векторы хранятся
+    в непрерывном float32 массиве внутри индекса FAISS.
+    """
+
+    def __init__(self, embeddings: Embeddings):
+        super().__init__(embeddings)
+        # Проверяем наличие faiss сразу, а не после вычисления всех эмбеддингов
+        _import_faiss()
+
+    def load_index(self) -> bool:
+        # Сохранение индекса на диск поддерживается только для VECTOR_BACKEND=memory
+        return False
+
+    def build_store_from_embeddings(
+        self,
+        documents: Sequence[Document],
+        vectors: Sequence[list[float] | None],
+        fingerprint: dict[str, Any] | None = None,
+    ) -> VectorStore:
+        """Строит HNSW индекс по косинусной близости из готовых эмбеддингов."""
+        faiss = _import_faiss()
+        from langchain_community.docstore.in_memory import InMemoryDocstore
+        from langchain_community.vectorstores import FAISS
+        from langchain_community.vectorstores.utils import DistanceStrategy
+
+        _check_embedded(vectors)
+        # Проблемные чанки, для которых не удалось получить эмбеддинг, в индекс не попадают
+        documents = [doc for doc, vector in zip(documents, vectors) if vector is not None]
+        vectors = [vector for vector in vectors if vector is not None]
+
+        matrix = np.ascontiguousarray(vectors, dtype=np.float32)
+        # После L2 нормализации скалярное произведение равно косинусной близости
+        faiss.normalize_L2(matrix)
+        index = self._create_index(faiss, matrix)
+        index.add(matrix)
+
+        ids = [str(i) for i in range(len(documents))]
+        logger.info(
+            "FAISS HNSW индекс построен: %s векторов, размерность %s, квантование: %s",
+            index.ntotal,
+            matrix.shape[1],
+            config.FAISS_QUANTIZATION,
+        )
+        with warnings.catch_warnings():
+            # normalize_L2 нужен для нормализации запросов (косинусная близость через inner product),
+            # langchain предупреждает о нём для любой метрики, кроме евклидовой
+            warnings.filterwarnings("ignore", message="Normalizing L2 is not applicable")
+            return FAISS(
+                embedding_function=self._embeddings,
+                index=index,
+                docstore=InMemoryDocstore(dict(zip(ids, documents))),
+                index_to_docstore_id=dict(enumerate(ids)),
+                normalize_L2=True,
+                distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
+            )
+
+    @staticmethod
+    def _create_index(faiss, matrix: np.ndarray):
+        """Создаёт HNSW индекс; при FAISS_QUANTIZATION векторы хранятся в fp16 или int8."""
+        dim = matrix.shape[1]
+        if config.FAISS_QUANTIZATION == "none":
+            return faiss.IndexHNSWFlat(dim, config.FAISS_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+
+        qtype = faiss.ScalarQuantizer.QT_fp16 if config.FAISS_QUANTIZATION == "fp16" else faiss.ScalarQuantizer.QT_8bit
+        index = faiss.IndexHNSWSQ(dim, qtype, config.FAISS_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        # int8 квантователю нужны диапазоны значений по измерениям
+        if not index.is_trained:
+            index.train(matrix)
+        return index
+
+
+def _import_faiss():
+    try:
+        import faiss
+    except ImportError as exc:
+        raise ImportError(
+            "Для VECTOR_BACKEND=faiss установите пакет faiss-cpu (или faiss-gpu)"
+        ) from exc
+    return faiss
 
 
 @lru_cache(maxsize=1)
 def get_embeddings() -> Embeddings:
-    """Возвращает клиент эмбеддингов в зависимости от провайдера."""
+    """Возвращает клиент эмбеддингов (с дисковым кэшем векторов документов, если EMBEDDINGS_CACHE)."""
+    embeddings = _create_embeddings()
+    if not config.EMBEDDINGS_CACHE:
+        return embeddings
+
+    from src.app.indexing.embeddings_cache import CachedEmbeddings
+
+    model_name = f"{config.EMBEDDINGS_PROVIDER.lower()}:{config.EMBEDDINGS_MODEL}"
+    if config.EMBEDDINGS_PROVIDER.lower() == "onnx" and config.ONNX_QUANTIZE:
+        model_name += ":int8"
+    # Запросы пользователей не кэшируем: они почти не повторяются и не должны оседать на диске
+    return CachedEmbeddings(embeddings, model_name=model_name, cache_queries=False)
+
+
+def _create_embeddings() -> Embeddings:
+    """Создаёт клиент эмбеддингов в зависимости от провайдера."""
     provider = config.EMBEDDINGS_PROVIDER.lower()
 
     if provider == "openai":
@@ -285,7 +532,14 @@ def get_embeddings() -> Embeddings:
             logger.info("Используется кэш HuggingFace: %s", cache_path)
 
         model_kwargs = {"device": config.HUGGINGFACE_DEVICE}
-        encode_kwargs = {"normalize_embeddings": config.HUGGINGFACE_NORMALIZE_EMBEDDINGS}
+        encode_kwargs = {
+            # Хранилища ищут по скалярному произведению, поэтому векторы индекса всегда нормализуются
+            # (для API провайдеров - при добавлении в хранилище)
+            "normalize_embeddings": True,
+            "batch_size": config.EMBED_BATCH_SIZE,
+            "convert_to_numpy": True,
+            "show_progress_bar": False,
+        }
 
         kwargs = {
             "model_name": config.EMBEDDINGS_MODEL,
@@ -297,6 +551,18 @@ def get_embeddings() -> Embeddings:
             kwargs["cache_folder"] = str(cache_path)
 
         return HuggingFaceEmbeddings(**kwargs)
+    elif provider == "onnx":
+        from src.app.indexing.onnx_embeddings import ONNXEmbeddings
+
+        # Экспортированные модели хранятся рядом с кэшем HuggingFace (или в CACHE_DIR)
+        return ONNXEmbeddings(
+            config.EMBEDDINGS_MODEL,
+            cache_dir=config.HUGGINGFACE_CACHE_FOLDER or config.CACHE_DIR,
+            quantize=config.ONNX_QUANTIZE,
+            pooling=config.ONNX_POOLING,
+            batch_size=config.EMBED_BATCH_SIZE,
+            device=config.HUGGINGFACE_DEVICE,
+        )
     elif provider == "ollama":
         from langchain_ollama import OllamaEmbeddings
 
@@ -304,12 +570,17 @@ def get_embeddings() -> Embeddings:
     else:
         raise ValueError(
             f"Неподдерживаемый провайдер эмбеддингов: {provider}. "
-            "Поддерживаются: openai, huggingface, ollama"
+            "Поддерживаются: openai, huggingface, ollama, onnx"
         )
 
 
 @lru_cache(maxsize=1)
 def get_vector_store_manager() -> VectorStoreManager:
-    """Глобальный менеджер in-memory хранилища."""
-    return VectorStoreManager(embeddings=get_embeddings())
+    """Глобальный менеджер in-memory хранилища (бэкенд выбирается через VECTOR_BACKEND)."""
+    if config.VECTOR_BACKEND == "faiss":
+        return FAISSVectorStoreManager(embeddings=get_embeddings())
+    manager = VectorStoreManager(embeddings=get_embeddings())
+    if config.PERSIST_INDEX:
+        manager.load_index()
+    return manager
 
@@ -1,23 +1,36 @@
 # src/app/llm/client.py
+import importlib.util
 import logging
+
+import httpx
 from openai import AsyncOpenAI
 from openai.types.chat import ChatCompletionMessageParam
 
 from src.app import config
+from src.app.llm.response_cache import ResponseCache
 
 logger = logging.getLogger(__name__)
 
 class LLMClient:
     def __init__(self):
+        # Один пул соединений на клиент: параллельные запросы переиспользуют TCP/TLS соединения,
+        # а при установленном пакете h2 мультиплексируются поверх HTTP/2
+        http2 = importlib.util.find_spec("h2") is not None
+        self.http_client = httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50, keepalive_expiry=300),
+            timeout=httpx.Timeout(60.0, connect=5.0),  # Разумный таймаут
+        )
         # Для OpenRouter и других провайдеров используем умеренные настройки retry
         # Большое количество retry при 429 ошибках только усугубляет ситуацию
         self.client = AsyncOpenAI(
             base_url=config.OPENAI_BASE_URL,
             api_key=config.OPENAI_API_KEY,
-            timeout=60.0,  # Разумный таймаут
+            http_client=self.http_client,
             max_retries=3,  # Умеренное количество retry (OpenAI клиент сам делает exponential backoff)
         )
-        logger.info(f"LLMClient инициализирован с base_url: {config.OPENAI_BASE_URL}")
+        logger.info(f"LLMClient инициализирован с base_url: {config.OPENAI_BASE_URL}, HTTP/2: {http2}")
+        self.cache = ResponseCache() if config.LLM_RESPONSE_CACHE else None
 
     async def generate(self, messages: list[ChatCompletionMessageParam]) -> str:
         """
@@ -31,13 +44,25 @@ class LLMClient:
                 *messages,
             ]
             
+            params = {
+                "temperature": 1.0, # По умолчанию
+                "max_tokens": 1000, # По умолчанию
+            }
+
+            cache_key = None
+            if self.cache is not None:
+                cache_key = ResponseCache.key(config.LLM_MODEL, full_messages, **params)
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    logger.debug("Ответ LLM взят из кэша")
+                    return cached
+
             logger.debug(f"Отправка запроса к LLM. Модель: {config.LLM_MODEL}, сообщений: {len(full_messages)}")
             
             response = await self.client.chat.completions.create(
                 model=config.LLM_MODEL,
                 messages=full_messages,
-                temperature=1.0, # По умолчанию
-                max_tokens=1000, # По умолчанию
+                **params,
             )
             
             content = response.choices[0].message.content
@@ -47,8 +72,14 @@ class LLMClient:
                 logger.warning("LLM вернула пустой или бессодержательный ответ.")
                 return "Извините, LLM не смогла дать осмысленный ответ."
 
+            if cache_key is not None:
+                self.cache.put(cache_key, content)
             return content
 
         except Exception as e:
             logger.exception(f"Ошибка при обращении к LLM: {e}")
             raise  # Передаем ошибку выше для обработки в хендлере
+
+    async def aclose(self) -> None:
+        """Закрывает пул HTTP соединений."""
+        await self.http_client.aclose()
@@ -0,0 +1,59 @@
+"""Content-addressed SQLite кэш ответов LLM."""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+from src.app import config
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """Хранит ответы LLM по хэшу запроса (модель, сообщения и параметры генерации).
+
+    Одинаковый запрос возвращает сохранённый ответ без обращения к провайдеру.
+    При temperature > 0 это меняет поведение (ответы перестают варьироваться),
+    поэтому кэш включается явно через LLM_RESPONSE_CACHE.
+    """
+
+    def __init__(self, cache_dir: Path | str | None = None):
+        cache_dir = Path(cache_dir or config.CACHE_DIR).expanduser()
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        self._path = cache_dir / "llm_responses.db"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self._path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, content TEXT NOT NULL, ts INTEGER NOT NULL)"
+        )
+        self._conn.commit()
+        logger.info("Кэш ответов LLM: %s", self._path)
+
+    @staticmethod
+    def key(model: str, messages: list[Any], **params: Any) -> str:
+        payload = json.dumps(
+            {"model": model, "messages": messages, "params": params},
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str,
+        )
+        return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            row = self._conn.execute("SELECT content FROM responses WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, content: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, content, ts) VALUES (?, ?, ?)",
+                (key, content, int(time.time())),
+            )
+            self._conn.commit()
@@ -1,11 +1,43 @@
 # src/app/logging.py
+import json
 import logging
 from src.app import config # Импортируем конфиг для LOG_LEVEL
 
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+
+class JsonFormatter(logging.Formatter):
+    """Сериализует запись лога в одну JSON строку (через orjson, если он установлен)."""
+
+    def __init__(self):
+        super().__init__()
+        try:
+            import orjson
+
+            self._dumps = lambda payload: orjson.dumps(payload, default=str).decode("utf-8")
+        except ImportError:
+            self._dumps = lambda payload: json.dumps(payload, ensure_ascii=False, default=str)
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": self.formatTime(record),
+            "logger": record.name,
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return self._dumps(payload)
+
+
 def setup_logging():
+    handler = logging.StreamHandler()
+    if config.LOG_FORMAT == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
     logging.basicConfig(
         level=config.LOG_LEVEL,
-        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-        handlers=[logging.StreamHandler()]
+        handlers=[handler]
     )
     logging.getLogger(__name__).info("Логирование настроено.")
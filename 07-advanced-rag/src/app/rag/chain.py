@@ -1,7 +1,12 @@
 """Построение RAG-цепочки на базе LangChain."""
 from __future__ import annotations
 
+import asyncio
 import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Hashable
 
 # Импорт для LangChain 1.0+ - функции из langchain-classic
 try:
@@ -20,10 +25,27 @@ from langchain_openai import ChatOpenAI
 from langchain_core.language_models.chat_models import BaseChatModel
 
 from src.app import config
-from src.app.rag.retrieval import BM25Retriever, HybridRetriever, Reranker
+from src.app.rag.retrieval import HybridRetriever, Reranker, get_bm25_retriever
 
 logger = logging.getLogger(__name__)
 
+# Имя аргумента промпта create_history_aware_retriever отличается между версиями LangChain;
+# определяем его один раз при импорте, а не при каждой сборке цепочки
+_HISTORY_AWARE_PROMPT_KW = next(
+    (
+        name
+        for name in ("contextualize_prompt", "contextual_prompt", "prompt")
+        if name in create_history_aware_retriever.__code__.co_varnames
+    ),
+    None,
+)
+if _HISTORY_AWARE_PROMPT_KW is None:
+    raise RuntimeError("Unsupported LangChain version: no prompt argument for create_history_aware_retriever")
+
+# Синхронный клиент GigaChat выполняется в своём пуле потоков, чтобы не занимать
+# пул по умолчанию event loop'а (его используют и другие to_thread/run_in_executor вызовы)
+_GIGA_POOL = ThreadPoolExecutor(max_workers=config.LLM_MAX_CONCURRENT, thread_name_prefix="giga")
+
 CONTEXTUALIZE_PROMPT = ChatPromptTemplate.from_messages(
     [
         (
@@ -37,16 +59,21 @@ CONTEXTUALIZE_PROMPT = ChatPromptTemplate.from_messages(
     ]
 )
 
+# Порядок сообщений рассчитан на prefix caching провайдеров (OpenAI и совместимые API):
+# неизменные инструкции и история диалога идут первыми, а меняющиеся на каждом шаге
+# контекст и вопрос - последним сообщением. История должна только дополняться в конец
+# (не переписываться и не суммаризироваться на месте), иначе кэш префикса сбрасывается.
 QA_PROMPT = ChatPromptTemplate.from_messages(
     [
-        ("system", config.SYSTEM_ROLE + "\nИспользуй предоставленный контекст для ответа."),
-        MessagesPlaceholder(variable_name="chat_history"),
-        ("human", "Контекст:\n{context}\n\nВопрос:\n{input}"),
         (
-            "assistant",
+            "system",
+            config.SYSTEM_ROLE
+            + "\nИспользуй предоставленный контекст для ответа. "
             "Если контекст не содержит ответа, скажи об этом. "
             "В конце перечисли использованные источники в виде списка.",
         ),
+        MessagesPlaceholder(variable_name="chat_history"),
+        ("human", "Контекст:\n{context}\n\nВопрос:\n{input}"),
     ]
 )
 
@@ -77,7 +104,7 @@ class RerankingRetriever(BaseRetriever):
             Список документов после reranking
         """
         # Получаем документы от базового retriever'а
-        documents = self._retriever.get_relevant_documents(query)
+        documents = self._retriever.invoke(query)
 
         # Применяем reranking
         reranked_docs = self._reranker.rerank(query, documents, top_k=self._k)
@@ -86,15 +113,95 @@ class RerankingRetriever(BaseRetriever):
 
     async def _aget_relevant_documents(self, query: str) -> list[Document]:
         """Асинхронная версия _get_relevant_documents."""
-        # Получаем документы от базового retriever'а
-        documents = await self._retriever.aget_relevant_documents(query)
+        # Получаем документы от базового retriever'а; параллельно (при первом запросе)
+        # загружается Cross-Encoder модель
+        documents, _ = await asyncio.gather(
+            self._retriever.ainvoke(query),
+            asyncio.to_thread(self._reranker._load_model),
+        )
 
-        # Применяем reranking (синхронный метод)
-        reranked_docs = self._reranker.rerank(query, documents, top_k=self._k)
+        # Применяем reranking в потоке: инференс Cross-Encoder не блокирует event loop
+        reranked_docs = await asyncio.to_thread(self._reranker.rerank, query, documents, self._k)
 
         return reranked_docs
 
 
+# Кэш результатов поиска текущего индекса: (пространство имён, OrderedDict запрос -> документы)
+_retrieval_cache: tuple[Hashable, OrderedDict[str, list[Document]]] | None = None
+
+
+def _get_retrieval_cache(namespace: Hashable) -> OrderedDict[str, list[Document]]:
+    """Возвращает кэш поиска для пространства имён (новое пространство имён сбрасывает кэш).
+
+    Цепочка строится на каждое сообщение, поэтому кэш хранится на уровне модуля.
+    Пространство имён сравнивается по идентичности (is): после переиндексации
+    приходит новый объект хранилища и старые результаты больше не используются.
+    """
+    global _retrieval_cache
+    cached = _retrieval_cache
+    if cached is not None and cached[0] is namespace:
+        return cached[1]
+    cache: OrderedDict[str, list[Document]] = OrderedDict()
+    _retrieval_cache = (namespace, cache)
+    return cache
+
+
+class CachingRetriever(BaseRetriever):
+    """LRU кэш документов поверх retriever'а по нормализованному запросу.
+
+    Оборачивает retriever, который получает уже переписанный с учётом истории
+    запрос, поэтому повторный или перефразированный в тот же запрос вопрос
+    не запускает поиск и reranking заново.
+    """
+
+    def __init__(self, retriever: BaseRetriever, cache: OrderedDict[str, list[Document]], max_size: int):
+        """Инициализирует CachingRetriever.
+
+        Args:
+            retriever: Базовый retriever
+            cache: Хранилище кэша (общее для цепочек одного индекса)
+            max_size: Максимальное количество запросов в кэше
+        """
+        super().__init__()
+        self._retriever = retriever
+        self._cache = cache
+        self._max_size = max_size
+
+    @staticmethod
+    def _normalize(query: str) -> str:
+        return " ".join(query.lower().split())
+
+    def _lookup(self, key: str) -> list[Document] | None:
+        documents = self._cache.get(key)
+        if documents is None:
+            return None
+        self._cache.move_to_end(key)
+        logger.debug("Retrieval cache hit: запрос '%s'", key[:50])
+        return list(documents)
+
+    def _remember(self, key: str, documents: list[Document]) -> None:
+        self._cache[key] = list(documents)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self._max_size:
+            self._cache.popitem(last=False)
+
+    def _get_relevant_documents(self, query: str) -> list[Document]:
+        key = self._normalize(query)
+        documents = self._lookup(key)
+        if documents is None:
+            documents = self._retriever.invoke(query)
+            self._remember(key, documents)
+        return documents
+
+    async def _aget_relevant_documents(self, query: str) -> list[Document]:
+        key = self._normalize(query)
+        documents = self._lookup(key)
+        if documents is None:
+            documents = await self._retriever.ainvoke(query)
+            self._remember(key, documents)
+        return documents
+
+
 def create_retriever_for_mode(
     semantic_retriever: BaseRetriever,
     documents: list[Document] | None = None,
@@ -134,7 +241,7 @@ def create_retriever_for_mode(
             manager = get_vector_store_manager()
             semantic_retriever = manager.get_retriever(k=config.SEMANTIC_K)
 
-        bm25_retriever = BM25Retriever(documents, k=config.BM25_K)
+        bm25_retriever = get_bm25_retriever(documents, k=config.BM25_K)
         hybrid_retriever = HybridRetriever(
             semantic_retriever=semantic_retriever,
             bm25_retriever=bm25_retriever,
@@ -160,7 +267,7 @@ def create_retriever_for_mode(
             manager = get_vector_store_manager()
             semantic_retriever = manager.get_retriever(k=config.SEMANTIC_K)
 
-        bm25_retriever = BM25Retriever(documents, k=config.BM25_K)
+        bm25_retriever = get_bm25_retriever(documents, k=config.BM25_K)
         hybrid_retriever = HybridRetriever(
             semantic_retriever=semantic_retriever,
             bm25_retriever=bm25_retriever,
@@ -179,10 +286,31 @@ def create_retriever_for_mode(
         raise ValueError(f"Недопустимый режим RAG: {mode}")
 
 
-def _get_llm() -> BaseChatModel:
-    """Возвращает LLM в зависимости от провайдера."""
-    provider = config.LLM_PROVIDER.lower()
-    
+def _get_llm(rate_limit_headers: bool = False) -> BaseChatModel:
+    """Возвращает LLM в зависимости от провайдера (один клиент на процесс для одинаковых настроек)."""
+    return _create_llm(
+        config.LLM_PROVIDER.lower(),
+        config.LLM_MODEL,
+        config.OPENAI_BASE_URL,
+        config.OPENAI_API_KEY,
+        rate_limit_headers,
+    )
+
+
+@lru_cache(maxsize=4)
+def _create_llm(
+    provider: str, model: str, base_url: str, api_key: str, rate_limit_headers: bool = False
+) -> BaseChatModel:
+    """Создаёт LLM клиент.
+
+    Цепочка строится на каждое сообщение; общий клиент сохраняет пул HTTP соединений
+    (keep-alive, TLS сессии) между запросами.
+
+    Args:
+        rate_limit_headers: Клиент для внешнего rate limiter'а (evaluation): заголовки ответа
+            попадают в response_metadata["headers"], а 429 не повторяется внутри SDK,
+            чтобы паузу выбирал limiter
+    """
     if provider == "gigachat":
         from langchain_community.llms import GigaChat
         from langchain_core.language_models.chat_models import BaseChatModel
@@ -229,17 +357,16 @@ def _get_llm() -> BaseChatModel:
                 )
             
             async def _agenerate(self, messages: List[Any], stop: List[str] | None = None, **kwargs) -> ChatResult:
-                # Асинхронная версия - используем синхронный вызов в executor
-                import asyncio
-                loop = asyncio.get_event_loop()
-                return await loop.run_in_executor(None, self._generate, messages, stop)
+                # Асинхронная версия - синхронный вызов в выделенном пуле потоков
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(_GIGA_POOL, self._generate, messages, stop)
             
             @property
             def _llm_type(self) -> str:
                 return "gigachat"
         
         llm = GigaChatChatModel(
-            credentials=config.OPENAI_API_KEY,
+            credentials=api_key,
             verify_ssl_certs=False,
         )
         logger.info("Используется GigaChat LLM")
@@ -247,42 +374,53 @@ def _get_llm() -> BaseChatModel:
     else:
         # OpenAI-совместимый API (OpenAI, Groq, OpenRouter, etc.)
         llm = ChatOpenAI(
-            model=config.LLM_MODEL,
+            model=model,
             temperature=0.2,
-            api_key=config.OPENAI_API_KEY,
-            base_url=config.OPENAI_BASE_URL,
-            max_retries=3,  # Умеренное количество retry (больше retry при 429 только усугубляет ситуацию)
+            api_key=api_key,
+            base_url=base_url,
+            # Умеренное количество retry (больше retry при 429 только усугубляет ситуацию);
+            # при внешнем rate limiter'е повторы выполняет он
+            max_retries=0 if rate_limit_headers else 3,
             timeout=60.0,  # Разумный таймаут
+            include_response_headers=rate_limit_headers,
         )
-        logger.info("Используется OpenAI-совместимый LLM: %s (base_url: %s)", config.LLM_MODEL, config.OPENAI_BASE_URL)
+        logger.info("Используется OpenAI-совместимый LLM: %s (base_url: %s)", model, base_url)
         return llm
 
 
-def build_rag_chain(retriever: BaseRetriever) -> Runnable:
+def build_rag_chain(
+    retriever: BaseRetriever,
+    cache_namespace: Hashable | None = None,
+    rate_limit_headers: bool = False,
+) -> Runnable:
     """Строит RAG-цепочку с явным возвратом документов через RunnablePassthrough.
 
     Args:
         retriever: Retriever для получения документов (может быть semantic/hybrid/hybrid+reranker)
+        cache_namespace: Объект текущего индекса (например, векторное хранилище); если задан
+            и RETRIEVAL_CACHE_SIZE > 0, результаты поиска кэшируются по переписанному запросу
+        rate_limit_headers: LLM возвращает заголовки ответа и не повторяет 429 сам
+            (для цепочки, темп которой задаёт внешний rate limiter)
 
     Returns:
         RAG цепочка в LCEL стиле с поддержкой трансформации запроса на основе истории
     """
     # Получаем LLM в зависимости от провайдера
-    llm = _get_llm()
+    llm = _get_llm(rate_limit_headers)
 
-    # Создаём history-aware retriever для трансформации запроса на основе истории
-    parameters = create_history_aware_retriever.__code__.co_varnames
-    kwargs = {"llm": llm, "retriever": retriever}
-    if "contextualize_prompt" in parameters:
-        kwargs["contextualize_prompt"] = CONTEXTUALIZE_PROMPT
-    elif "contextual_prompt" in parameters:
-        kwargs["contextual_prompt"] = CONTEXTUALIZE_PROMPT
-    elif "prompt" in parameters:
-        kwargs["prompt"] = CONTEXTUALIZE_PROMPT
-    else:
-        raise RuntimeError("Unsupported LangChain version: no prompt argument for create_history_aware_retriever")
+    if cache_namespace is not None and config.RETRIEVAL_CACHE_SIZE > 0:
+        retriever = CachingRetriever(
+            retriever,
+            cache=_get_retrieval_cache(cache_namespace),
+            max_size=config.RETRIEVAL_CACHE_SIZE,
+        )
 
-    history_aware_retriever = create_history_aware_retriever(**kwargs)
+    # Создаём history-aware retriever для трансформации запроса на основе истории
+    history_aware_retriever = create_history_aware_retriever(
+        llm=llm,
+        retriever=retriever,
+        **{_HISTORY_AWARE_PROMPT_KW: CONTEXTUALIZE_PROMPT},
+    )
 
     question_answer_chain = create_stuff_documents_chain(
         llm=llm,
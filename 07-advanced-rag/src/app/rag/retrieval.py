@@ -1,10 +1,14 @@
 """Модуль для Advanced RAG: Hybrid Retrieval и Reranking."""
 from __future__ import annotations
 
+import asyncio
 import logging
 import re
-from typing import Sequence
+import threading
+from functools import lru_cache
+from typing import Callable, Hashable, Sequence
 
+import numpy as np
 from langchain_core.documents import Document
 from langchain_core.retrievers import BaseRetriever
 from rank_bm25 import BM25Okapi
@@ -14,14 +18,45 @@ from src.app import config
 logger = logging.getLogger(__name__)
 
 
+# Слова из букв, цифр и подчёркиваний; слова короче 2 символов не учитываются
+_WORD_RE = re.compile(r"\w{2,}")
+
+
 def _simple_tokenize(text: str) -> list[str]:
-    """Простая токенизация текста для BM25."""
-    # Удаляем знаки препинания и приводим к нижнему регистру
-    text = re.sub(r"[^\w\s]", " ", text.lower())
-    # Разбиваем на слова
-    words = text.split()
-    # Удаляем очень короткие слова (меньше 2 символов)
-    return [word for word in words if len(word) >= 2]
+    """Простая токенизация текста для BM25 (один проход регулярного выражения)."""
+    return _WORD_RE.findall(text.lower())
+
+
+def _top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Индексы K наибольших scores по убыванию; при равных scores меньший индекс идёт раньше.
+
+    argpartition выбирает K лучших за O(N), сортируются только они. Порядок
+    совпадает со стабильной сортировкой всего списка по убыванию.
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    threshold = scores[np.argpartition(-scores, k - 1)[k - 1]]
+    above = np.flatnonzero(scores > threshold)
+    ties = np.flatnonzero(scores == threshold)[: k - len(above)]
+    top_k = np.concatenate([above, ties])
+    return top_k[np.lexsort((top_k, -scores[top_k]))]
+
+
+def _document_key(doc: Document) -> str:
+    """Создаёт ключ для дедупликации документа по его тексту.
+
+    Разные чанки одной страницы не склеиваются, а одинаковый текст из разных
+    источников считается одним документом. Сам текст служит ключом: CPython
+    кэширует хэш строки, поэтому повторный поиск ключа не хэширует текст заново.
+
+    Args:
+        doc: Документ LangChain
+
+    Returns:
+        Текст документа
+    """
+    return doc.page_content
 
 
 class BM25Retriever(BaseRetriever):
@@ -38,17 +73,86 @@ class BM25Retriever(BaseRetriever):
         self._documents = list(documents)
         self._k = k
 
+        # Целочисленные идентификаторы ключей для дедупликации в HybridRetriever:
+        # документы корпуса сопоставляются по id объекта, без поиска по тексту
+        self._key_ids: dict[str, int] = {}
+        self._doc_key_ids: dict[int, int] = {
+            id(doc): self._key_ids.setdefault(_document_key(doc), len(self._key_ids)) for doc in self._documents
+        }
+
         # Токенизируем документы для BM25
         tokenized_docs = [_simple_tokenize(doc.page_content) for doc in self._documents]
 
         # Создаём BM25 индекс
+        self._vocabulary: dict[str, int] = {}
+        # Постинг-списки в CSC-подобных массивах: для термина t его документы и BM25 веса
+        # лежат в _posting_docs/_posting_weights[_term_indptr[t]:_term_indptr[t + 1]]
+        self._term_indptr: np.ndarray | None = None
+        self._posting_docs = np.empty(0, dtype=np.int32)
+        self._posting_weights = np.empty(0, dtype=np.float32)
         if tokenized_docs:
-            self._bm25 = BM25Okapi(tokenized_docs)
+            self._build_weights(BM25Okapi(tokenized_docs))
             logger.info("BM25 индекс создан для %s документов.", len(self._documents))
         else:
-            self._bm25 = None
             logger.warning("BM25 индекс не создан: документы отсутствуют.")
 
+    def key_id(self, doc: Document) -> Hashable:
+        """Ключ дедупликации документа: целое число для документов корпуса, иначе текст документа."""
+        key_id = self._doc_key_ids.get(id(doc))
+        if key_id is not None:
+            return key_id
+        key = _document_key(doc)
+        return self._key_ids.get(key, key)
+
+    def _build_weights(self, bm25: BM25Okapi) -> None:
+        """Предвычисляет BM25 веса всех пар (документ, термин) и группирует их по терминам.
+
+        Вес совпадает со слагаемым BM25Okapi.get_scores для одного термина запроса
+        (те же k1, b и IDF с нижней границей epsilon), поэтому score документа -
+        это сумма весов его терминов из запроса.
+        """
+        doc_ids: list[int] = []
+        term_ids: list[int] = []
+        tfs: list[int] = []
+        for doc_id, frequencies in enumerate(bm25.doc_freqs):
+            for term, tf in frequencies.items():
+                doc_ids.append(doc_id)
+                term_ids.append(self._vocabulary.setdefault(term, len(self._vocabulary)))
+                tfs.append(tf)
+
+        rows = np.asarray(doc_ids, dtype=np.int32)
+        tf = np.asarray(tfs, dtype=np.float32)
+        idf = np.zeros(len(self._vocabulary), dtype=np.float32)
+        for term, term_id in self._vocabulary.items():
+            idf[term_id] = bm25.idf.get(term) or 0.0
+        doc_len = np.asarray(bm25.doc_len, dtype=np.float32)
+        norm = bm25.k1 * (1 - bm25.b + bm25.b * doc_len / bm25.avgdl)
+
+        cols = np.asarray(term_ids, dtype=np.int32)
+        values = idf[cols] * tf * (bm25.k1 + 1) / (tf + norm[rows])
+
+        # Группируем по терминам: при поиске читаются только постинги терминов запроса
+        order = np.argsort(cols, kind="stable")
+        self._posting_docs = rows[order]
+        self._posting_weights = values[order]
+        self._term_indptr = np.zeros(len(self._vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cols, minlength=len(self._vocabulary)), out=self._term_indptr[1:])
+
+    def _score(self, query_terms: dict[int, int]) -> np.ndarray:
+        """BM25 scores всех документов для терминов запроса (term_id -> число вхождений)."""
+        indptr = self._term_indptr
+        docs = []
+        weights = []
+        for term_id, count in query_terms.items():
+            start, end = indptr[term_id], indptr[term_id + 1]
+            docs.append(self._posting_docs[start:end])
+            weights.append(self._posting_weights[start:end] * count)
+        # Суммируем вклады терминов по документам сразу в float32: вектор scores
+        # вдвое меньше float64 и дальше без копирования уходит в argpartition
+        scores = np.zeros(len(self._documents), dtype=np.float32)
+        np.add.at(scores, np.concatenate(docs), np.concatenate(weights))
+        return scores
+
     def _get_relevant_documents(self, query: str) -> list[Document]:
         """Возвращает релевантные документы по запросу.
 
@@ -58,7 +162,7 @@ class BM25Retriever(BaseRetriever):
         Returns:
             Список релевантных документов
         """
-        if not self._bm25 or not self._documents:
+        if self._term_indptr is None or not self._documents:
             return []
 
         # Токенизируем запрос
@@ -67,18 +171,23 @@ class BM25Retriever(BaseRetriever):
         if not tokenized_query:
             return []
 
-        # Получаем BM25 scores
-        scores = self._bm25.get_scores(tokenized_query)
-
-        # Сортируем документы по scores (в порядке убывания)
-        doc_scores = list(enumerate(scores))
-        doc_scores.sort(key=lambda x: x[1], reverse=True)
+        # Вектор запроса: сколько раз каждый известный термин встречается в запросе
+        query_terms: dict[int, int] = {}
+        for term in tokenized_query:
+            term_id = self._vocabulary.get(term)
+            if term_id is not None:
+                query_terms[term_id] = query_terms.get(term_id, 0) + 1
 
-        # Выбираем топ-K документов
-        top_k_indices = [idx for idx, _ in doc_scores[: self._k]]
+        # Получаем BM25 scores и выбираем топ-K документов
+        if query_terms:
+            top_k_indices = _top_k_indices(self._score(query_terms), self._k)
+        else:
+            # Ни один термин запроса не встречается в корпусе: все scores нулевые,
+            # при равенстве выбираются первые документы
+            top_k_indices = range(min(self._k, len(self._documents)))
 
         # Возвращаем соответствующие документы
-        results = [self._documents[idx] for idx in top_k_indices if idx < len(self._documents)]
+        results = [self._documents[idx] for idx in top_k_indices]
 
         logger.debug(
             "BM25 retrieval: запрос '%s', найдено %s документов (топ-%s).",
@@ -94,22 +203,75 @@ class BM25Retriever(BaseRetriever):
         return self._get_relevant_documents(query)
 
 
-def _document_key(doc: Document) -> tuple[str, int | None]:
-    """Создаёт ключ для идентификации документа по метаданным.
+# Последний построенный BM25 retriever: (документы, k, retriever)
+_bm25_cache: tuple[Sequence[Document], int, BM25Retriever] | None = None
+
+
+def get_bm25_retriever(documents: Sequence[Document], k: int = 4) -> BM25Retriever:
+    """Возвращает BM25 retriever для документов, переиспользуя индекс для того же корпуса.
+
+    Retriever создаётся на каждый запрос, а документы индекса между переиндексациями
+    остаются тем же объектом, поэтому корпус сравнивается по идентичности (is):
+    после /index придёт новый объект и индекс будет построен заново.
+    """
+    global _bm25_cache
+    cached = _bm25_cache
+    if cached is not None and cached[0] is documents and cached[1] == k:
+        return cached[2]
+    retriever = BM25Retriever(documents, k=k)
+    _bm25_cache = (documents, k, retriever)
+    return retriever
+
+
+def _combine_results(
+    semantic_docs: Sequence[Document],
+    bm25_docs: Sequence[Document],
+    k: int,
+    key: Callable[[Document], Hashable] = _document_key,
+    rrf_k: int = 60,
+) -> tuple[list[Document], int]:
+    """Объединяет результаты semantic и BM25 поиска через Reciprocal Rank Fusion.
+
+    Score документа - сумма 1 / (rrf_k + rank) по спискам, в которых он найден
+    (rank с нуля). Используются только позиции, поэтому несравнимые оценки
+    косинусной близости и BM25 не смешиваются.
 
     Args:
-        doc: Документ LangChain
+        key: Ключ дедупликации (документы с одинаковым ключом считаются одним документом)
+        rrf_k: Сглаживающая константа RRF
 
     Returns:
-        Кортеж (source, page) для уникальной идентификации документа
+        Топ-K документов и количество уникальных документов после объединения
     """
-    source = doc.metadata.get("source", "")
-    page = doc.metadata.get("page", None)
-    return (source, page)
+    combined_docs: list[Document] = []
+    combined_scores: list[float] = []
+    positions: dict[Hashable, int] = {}
+
+    for docs in (semantic_docs, bm25_docs):
+        seen: set[Hashable] = set()
+        for rank, doc in enumerate(docs):
+            doc_key = key(doc)
+            if doc_key in seen:
+                # Повторяющийся текст в одном списке: учитываем лучшую позицию
+                continue
+            seen.add(doc_key)
+            score = 1.0 / (rrf_k + rank)
+            position = positions.get(doc_key)
+            if position is None:
+                positions[doc_key] = len(combined_docs)
+                combined_docs.append(doc)
+                combined_scores.append(score)
+            else:
+                # Документ есть в обоих результатах - суммируем вклады
+                combined_scores[position] += score
+
+    # Выбираем топ-K (при равных score semantic результаты идут раньше)
+    top_k = _top_k_indices(np.asarray(combined_scores), k)
+    return [combined_docs[idx] for idx in top_k], len(combined_docs)
 
 
 class HybridRetriever(BaseRetriever):
-    """Hybrid retriever, комбинирующий semantic search и BM25."""
+    """Hybrid retriever, комбинирующий semantic search и BM25 через Reciprocal Rank Fusion."""
 
     def __init__(
         self,
@@ -139,44 +301,25 @@ class HybridRetriever(BaseRetriever):
             Список релевантных документов после объединения и дедупликации
         """
         # Получаем результаты от semantic retriever
-        semantic_docs = self._semantic_retriever.get_relevant_documents(query)
-        semantic_scores = {_document_key(doc): (doc, 2.0) for doc in semantic_docs}  # Вес 2.0 для semantic
+        semantic_docs = self._semantic_retriever.invoke(query)
 
         # Получаем результаты от BM25 retriever
-        bm25_docs = self._bm25_retriever.get_relevant_documents(query)
-        bm25_scores = {_document_key(doc): (doc, 1.0) for doc in bm25_docs}  # Вес 1.0 для BM25
-
-        # Объединяем результаты с дедупликацией и взвешиванием
-        # Документы, которые есть в обоих результатах, получают больший вес
-        combined_scores: dict[tuple[str, int | None], tuple[Document, float]] = {}
-
-        # Добавляем semantic результаты
-        for key, (doc, score) in semantic_scores.items():
-            combined_scores[key] = (doc, score)
-
-        # Добавляем BM25 результаты, увеличивая вес для документов, которые уже есть
-        for key, (doc, score) in bm25_scores.items():
-            if key in combined_scores:
-                # Документ есть в обоих результатах - увеличиваем вес
-                existing_doc, existing_score = combined_scores[key]
-                combined_scores[key] = (existing_doc, existing_score + score)
-            else:
-                # Новый документ из BM25
-                combined_scores[key] = (doc, score)
-
-        # Сортируем по весам (в порядке убывания)
-        scored_docs = list(combined_scores.values())
-        scored_docs.sort(key=lambda x: x[1], reverse=True)
+        bm25_docs = self._bm25_retriever.invoke(query)
 
-        # Выбираем топ-K документов
-        results = [doc for doc, _ in scored_docs[: self._k]]
+        results, combined_count = _combine_results(
+            semantic_docs,
+            bm25_docs,
+            self._k,
+            key=self._bm25_retriever.key_id,
+            rrf_k=config.HYBRID_RRF_K,
+        )
 
         logger.debug(
             "Hybrid retrieval: запрос '%s', semantic: %s, BM25: %s, объединено: %s, финальных: %s (топ-%s).",
             query[:50],
             len(semantic_docs),
             len(bm25_docs),
-            len(combined_scores),
+            combined_count,
             len(results),
             self._k,
         )
@@ -185,32 +328,26 @@ class HybridRetriever(BaseRetriever):
 
     async def _aget_relevant_documents(self, query: str) -> list[Document]:
         """Асинхронная версия _get_relevant_documents."""
-        # Для async версии используем async методы retriever'ов, если они поддерживаются
-        semantic_docs = await self._semantic_retriever.aget_relevant_documents(query)
-        bm25_docs = await self._bm25_retriever.aget_relevant_documents(query)
-
-        # Та же логика объединения
-        semantic_scores = {_document_key(doc): (doc, 2.0) for doc in semantic_docs}
-        bm25_scores = {_document_key(doc): (doc, 1.0) for doc in bm25_docs}
-
-        combined_scores: dict[tuple[str, int | None], tuple[Document, float]] = {}
-
-        for key, (doc, score) in semantic_scores.items():
-            combined_scores[key] = (doc, score)
-
-        for key, (doc, score) in bm25_scores.items():
-            if key in combined_scores:
-                existing_doc, existing_score = combined_scores[key]
-                combined_scores[key] = (existing_doc, existing_score + score)
-            else:
-                combined_scores[key] = (doc, score)
+        # Semantic и BM25 поиск независимы - выполняем их параллельно.
+        # BM25 считается синхронно на CPU, поэтому уходит в поток и не блокирует event loop.
+        semantic_docs, bm25_docs = await asyncio.gather(
+            self._semantic_retriever.ainvoke(query),
+            asyncio.to_thread(self._bm25_retriever._get_relevant_documents, query),
+        )
 
-        scored_docs = list(combined_scores.values())
-        scored_docs.sort(key=lambda x: x[1], reverse=True)
+        results, _ = _combine_results(
+            semantic_docs,
+            bm25_docs,
+            self._k,
+            key=self._bm25_retriever.key_id,
+            rrf_k=config.HYBRID_RRF_K,
+        )
+        return results
 
-        results = [doc for doc, _ in scored_docs[: self._k]]
 
-        return results
+# Обрезка документов перед Cross-Encoder: символов на токен и лимит, если max_length модели неизвестен
+_CHARS_PER_TOKEN = 4
+_DEFAULT_MAX_CHARS = 2048
 
 
 class Reranker:
@@ -224,6 +361,7 @@ class Reranker:
         """
         self._model_name = model_name or config.CROSSENCODER_MODEL
         self._model = None
+        self._max_chars = _DEFAULT_MAX_CHARS
         self._provider = config.CROSSENCODER_PROVIDER.lower()
 
         if self._provider != "huggingface":
@@ -232,27 +370,20 @@ class Reranker:
                 "Поддерживается только: huggingface"
             )
 
-        logger.info("Cross-Encoder reranker будет инициализирован при первом использовании (модель: %s).", self._model_name)
+        logger.debug(
+            "Cross-Encoder reranker будет инициализирован при первом использовании (модель: %s).", self._model_name
+        )
 
     def _load_model(self) -> None:
-        """Загружает Cross-Encoder модель при первом использовании."""
+        """Загружает Cross-Encoder модель при первом использовании (одна на процесс для каждого имени)."""
         if self._model is not None:
             return
 
-        try:
-            from sentence_transformers import CrossEncoder
-
-            logger.info("Загрузка Cross-Encoder модели: %s...", self._model_name)
-            self._model = CrossEncoder(self._model_name)
-            logger.info("Cross-Encoder модель загружена успешно.")
-        except ImportError as exc:
-            raise ImportError(
-                "sentence-transformers не установлен. "
-                "Установите: uv pip install sentence-transformers"
-            ) from exc
-        except Exception as exc:
-            logger.error("Ошибка при загрузке Cross-Encoder модели: %s", exc)
-            raise
+        self._model = _get_cross_encoder(self._model_name)
+        # Длиннее max_length токенов текст всё равно обрезается токенизатором;
+        # ~4 символа на токен с запасом, чтобы не токенизировать лишнее
+        max_length = getattr(self._model, "max_length", None)
+        self._max_chars = max_length * _CHARS_PER_TOKEN if max_length else _DEFAULT_MAX_CHARS
 
     def rerank(self, query: str, documents: Sequence[Document], top_k: int | None = None) -> list[Document]:
         """Ранжирует документы по запросу с использованием Cross-Encoder.
@@ -272,10 +403,18 @@ class Reranker:
         self._load_model()
 
         # Подготавливаем пары (query, document) для Cross-Encoder
-        pairs = [(query, doc.page_content) for doc in documents]
+        pairs = [(query, doc.page_content[: self._max_chars]) for doc in documents]
 
-        # Получаем scores от Cross-Encoder
-        scores = self._model.predict(pairs)
+        # Получаем scores от Cross-Encoder (без учёта градиентов, батчами фиксированного размера)
+        import torch
+
+        with torch.inference_mode():
+            scores = self._model.predict(
+                pairs,
+                batch_size=config.CROSSENCODER_BATCH_SIZE,
+                convert_to_numpy=True,
+                show_progress_bar=False,
+            )
 
         # Сортируем документы по scores (в порядке убывания)
         doc_scores = list(zip(documents, scores, strict=True))
@@ -297,3 +436,38 @@ class Reranker:
 
         return results
 
+
+
+_cross_encoder_lock = threading.Lock()
+
+
+def _get_cross_encoder(model_name: str):
+    """Возвращает Cross-Encoder модель, загружая её один раз: Reranker создаётся на каждый запрос."""
+    # Модель может запрашиваться из нескольких потоков одновременно (прогрев и reranking)
+    with _cross_encoder_lock:
+        return _load_cross_encoder(model_name)
+
+
+@lru_cache(maxsize=None)
+def _load_cross_encoder(model_name: str):
+    try:
+        from sentence_transformers import CrossEncoder
+    except ImportError as exc:
+        raise ImportError(
+            "sentence-transformers не установлен. "
+            "Установите: uv pip install sentence-transformers"
+        ) from exc
+
+    kwargs = {}
+    # FP16 только на GPU: на CPU половинная точность не ускоряет инференс
+    if config.CROSSENCODER_FP16 and config.HUGGINGFACE_DEVICE.startswith("cuda"):
+        kwargs["model_kwargs"] = {"torch_dtype": "float16"}
+
+    try:
+        logger.info("Загрузка Cross-Encoder модели: %s (%s)...", model_name, config.HUGGINGFACE_DEVICE)
+        model = CrossEncoder(model_name, device=config.HUGGINGFACE_DEVICE, **kwargs)
+    except Exception as exc:
+        logger.error("Ошибка при загрузке Cross-Encoder модели: %s", exc)
+        raise
+    logger.info("Cross-Encoder модель загружена успешно.")
+    return model
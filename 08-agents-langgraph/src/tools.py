@@ -11,6 +11,34 @@ import rag
 
 logger = logging.getLogger(__name__)
 
+try:
+    import orjson
+
+    def _dumps(payload: dict) -> str:
+        # orjson пишет UTF-8 без экранирования, как json.dumps(..., ensure_ascii=False)
+        return orjson.dumps(payload, default=str).decode("utf-8")
+except ImportError:
+    def _dumps(payload: dict) -> str:
+        # ensure_ascii=False для корректной кириллицы
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+# Фиксированные курсы валют (примерные, можно заменить на API)
+# Курсы относительно RUB (1 USD = X RUB, 1 EUR = Y RUB)
+EXCHANGE_RATES = {
+    "USD": 95.0,  # 1 USD = 95 RUB
+    "EUR": 103.0,  # 1 EUR = 103 RUB
+    "RUB": 1.0     # 1 RUB = 1 RUB
+}
+
+# Курсы для каждой пары валют, посчитанные один раз через RUB (базовая валюта):
+# конвертация - одно умножение, без построения словаря курсов на каждый вызов
+_PAIR_RATES = {
+    (from_ccy, to_ccy): from_rate / to_rate
+    for from_ccy, from_rate in EXCHANGE_RATES.items()
+    for to_ccy, to_rate in EXCHANGE_RATES.items()
+}
+
 @tool
 def rag_search(query: str) -> str:
     """
@@ -26,7 +54,7 @@ def rag_search(query: str) -> str:
         documents = rag.retrieve_documents(query)
         
         if not documents:
-            return json.dumps({"sources": []}, ensure_ascii=False)
+            return _dumps({"sources": []})
         
         # Формируем структурированный ответ для агента
         sources = []
@@ -40,12 +68,11 @@ def rag_search(query: str) -> str:
                 source_data["page"] = doc.metadata["page"]
             sources.append(source_data)
         
-        # ensure_ascii=False для корректной кириллицы
-        return json.dumps({"sources": sources}, ensure_ascii=False)
+        return _dumps({"sources": sources})
         
     except Exception as e:
         logger.error(f"Error in rag_search: {e}", exc_info=True)
-        return json.dumps({"sources": []}, ensure_ascii=False)
+        return _dumps({"sources": []})
 
 
 @tool
@@ -65,33 +92,23 @@ def currency_converter(amount: float, from_currency: str, to_currency: str) -> s
         Строка с результатом конвертации в формате: "X [FROM] = Y [TO]"
     """
     try:
-        # Фиксированные курсы валют (примерные, можно заменить на API)
-        # Курсы относительно RUB (1 USD = X RUB, 1 EUR = Y RUB)
-        exchange_rates = {
-            "USD": 95.0,  # 1 USD = 95 RUB
-            "EUR": 103.0,  # 1 EUR = 103 RUB
-            "RUB": 1.0     # 1 RUB = 1 RUB
-        }
-        
         # Нормализуем названия валют к верхнему регистру
         from_currency = from_currency.upper()
         to_currency = to_currency.upper()
         
         # Проверяем валидность валют
-        if from_currency not in exchange_rates:
+        if from_currency not in EXCHANGE_RATES:
             return f"Ошибка: валюта '{from_currency}' не поддерживается. Используйте USD, EUR или RUB."
         
-        if to_currency not in exchange_rates:
+        if to_currency not in EXCHANGE_RATES:
             return f"Ошибка: валюта '{to_currency}' не поддерживается. Используйте USD, EUR или RUB."
         
         # Проверяем сумму
         if amount < 0:
             return "Ошибка: сумма должна быть положительным числом."
         
-        # Конвертируем через RUB (базовая валюта)
-        # Сначала в RUB, потом в целевую валюту
-        amount_in_rub = amount * exchange_rates[from_currency]
-        result_amount = amount_in_rub / exchange_rates[to_currency]
+        # Конвертируем по заранее посчитанному курсу пары (через RUB)
+        result_amount = amount * _PAIR_RATES[(from_currency, to_currency)]
         
         # Форматируем результат
         result = f"{amount:.2f} {from_currency} = {result_amount:.2f} {to_currency}"
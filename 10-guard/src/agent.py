@@ -144,11 +144,13 @@ bank_agent = None
 # Глобальные экземпляры middleware для лимитов
 model_call_limit_middleware = ModelCallLimitMiddleware(
     limit=config.MODEL_CALL_LIMIT,
-    window_seconds=config.MODEL_CALL_WINDOW
+    window_seconds=config.MODEL_CALL_WINDOW,
+    redis_url=config.RATE_LIMIT_REDIS_URL
 )
 tool_call_limit_middleware = ToolCallLimitMiddleware(
     limit=config.TOOL_CALL_LIMIT,
-    window_seconds=config.TOOL_CALL_WINDOW
+    window_seconds=config.TOOL_CALL_WINDOW,
+    redis_url=config.RATE_LIMIT_REDIS_URL
 )
 
 
@@ -264,7 +266,7 @@ async def _run_agent_stream(inputs, agent_config, chat_id: int):
         raise ValueError("Agent not initialized")
     
     # 🔒 Проверка лимита на вызовы модели перед началом работы агента
-    is_allowed, error_msg = model_call_limit_middleware.check_and_record(chat_id)
+    is_allowed, error_msg = await model_call_limit_middleware.check_and_record(chat_id)
     if not is_allowed:
         logger.warning(f"🚫 Model call limit exceeded for chat {chat_id}")
         return {
@@ -299,7 +301,7 @@ async def _run_agent_stream(inputs, agent_config, chat_id: int):
                 # Если последнее сообщение - это вызов инструмента (ToolMessage)
                 if isinstance(last_message, ToolMessage):
                     tool_name = getattr(last_message, 'name', 'unknown')
-                    is_allowed, error_msg = tool_call_limit_middleware.check_and_record(chat_id, tool_name)
+                    is_allowed, error_msg = await tool_call_limit_middleware.check_and_record(chat_id, tool_name)
                     if not is_allowed:
                         logger.warning(f"🚫 Tool call limit exceeded for chat {chat_id} (tool: {tool_name})")
                         return {
@@ -312,7 +314,7 @@ async def _run_agent_stream(inputs, agent_config, chat_id: int):
                     # Проверяем лимит перед фактическим вызовом
                     for tool_call in last_message.tool_calls:
                         tool_name = tool_call.get('name', 'unknown')
-                        is_allowed, error_msg = tool_call_limit_middleware.check_and_record(chat_id, tool_name)
+                        is_allowed, error_msg = await tool_call_limit_middleware.check_and_record(chat_id, tool_name)
                         if not is_allowed:
                             logger.warning(f"🚫 Tool call limit exceeded for chat {chat_id} (tool: {tool_name})")
                             return {
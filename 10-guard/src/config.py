@@ -45,6 +45,7 @@ class Config:
     MODEL_CALL_WINDOW = int(os.getenv("MODEL_CALL_WINDOW", "3600"))  # Окно в секундах (1 час)
     TOOL_CALL_LIMIT = int(os.getenv("TOOL_CALL_LIMIT", "20"))  # Лимит вызовов инструментов на пользователя
     TOOL_CALL_WINDOW = int(os.getenv("TOOL_CALL_WINDOW", "3600"))  # Окно в секундах (1 час)
+    RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL")  # Redis для общих лимитов между процессами (по умолчанию - в памяти)
     
     # LangSmith настройки
     LANGSMITH_API_KEY = os.getenv("LANGSMITH_API_KEY")
@@ -299,8 +299,8 @@ async def handle_message(message: Message):
             return
         
         # Маскируем чувствительные данные перед отправкой в агента
-        from middleware import pii_masker
-        masked_text = pii_masker.mask_text(message.text)
+        from middleware import get_pii_masker
+        masked_text = get_pii_masker().mask_text(message.text)
         if masked_text != message.text:
             logger.info(f"🔒 PII masked for chat {message.chat.id}: {message.text[:50]}... -> {masked_text[:50]}...")
         
@@ -394,8 +394,8 @@ async def handle_message(message: Message):
 
         # 🔒 Маскируем чувствительные данные и в ответе бота перед отправкой пользователю
         try:
-            from middleware import pii_masker
-            masked_response = pii_masker.mask_text(final_response)
+            from middleware import get_pii_masker
+            masked_response = get_pii_masker().mask_text(final_response)
             if masked_response != final_response:
                 logger.info(
                     f"🔒 PII masked in bot response for chat {message.chat.id}: "
@@ -504,8 +504,8 @@ async def handle_hitl_callback(callback: CallbackQuery):
 
         # 🔒 Маскируем чувствительные данные в финальном ответе после HITL
         try:
-            from middleware import pii_masker
-            masked_response = pii_masker.mask_text(final_response)
+            from middleware import get_pii_masker
+            masked_response = get_pii_masker().mask_text(final_response)
             if masked_response != final_response:
                 logger.info(
                     f"🔒 PII masked in HITL response for chat {chat_id}: "
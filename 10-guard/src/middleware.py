@@ -10,12 +10,97 @@
 - СНИЛС
 """
 import re
+import hashlib
 import logging
-from typing import Any, Dict, List, Optional
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
+import os
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
+try:
+    # google-re2: автоматный поиск за линейное время, без backtracking (нет риска ReDoS)
+    import re2 as _regex
+    _REGEX_FLAGS = 0
+except ImportError:
+    _regex = re
+    # В RE2 классы \b, \d и \s только ASCII; с re.ASCII stdlib ищет так же,
+    # и результат маскирования не зависит от того, установлен ли google-re2
+    _REGEX_FLAGS = re.ASCII
+
+
+try:
+    # Hyperscan: SIMD-поиск всех шаблонов одним автоматом в нативном коде
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+
+_DIGITS = '0123456789'
+# Маски и префиксы масок: строки создаются один раз при импорте, на каждое совпадение
+# остается одна конкатенация префикса с сохраняемыми цифрами
+_PHONE_PREFIX = '***-***-'
+_CARD_PREFIX = '**** **** **** '
+_INN10_PREFIX = '********'
+_INN12_PREFIX = '**********'
+_PASSPORT_MASK = '**** ******'
+_SNILS_MASK = '***-***-***-**'
+
+# Кэш результатов mask_text для повторяющихся сообщений (повторы, системные промпты);
+# длинные тексты не кэшируются, чтобы кэш не занимал много памяти
+_MASK_CACHE_SIZE = 1024
+_MASK_CACHE_MAX_CHARS = 4096
+# Ключ кэша - keyed BLAKE2b хэш текста, а не сам текст: исходные сообщения с PII
+# не остаются в памяти процесса; секрет свой у каждого процесса, поэтому подобрать
+# текст по хэшу из дампа памяти нельзя
+_MASK_CACHE_SECRET = os.urandom(32)
+
+
+def _compile(pattern: str):
+    return _regex.compile(pattern, _REGEX_FLAGS)
+
+
+# Регулярные выражения для поиска PII
+_PII_PATTERNS = {
+    # Телефон: код страны (+7/7/8), открывающая скобка или граница слова перед первой цифрой
+    # и граница слова после последней - номер не вырезается из более длинной последовательности цифр.
+    # Lookbehind (?<!\d) не используется: RE2 его не поддерживает, а \b при ASCII-классах
+    # на стыке цифр работает так же
+    'phone': _compile(r'(?:(\+7|\b[78])[\s\-]?\(?|\(|\b)(\d{3})\)?[\s\-]?(\d{3})[\s\-]?(\d{2})[\s\-]?(\d{2})\b'),
+    'email': _compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'),
+    'passport': _compile(r'\b\d{4}\s?\d{6}\b'),  # Российский паспорт: 4 цифры + 6 цифр
+    'card': _compile(r'\b\d{4}[\s\-]?\d{4}[\s\-]?\d{4}[\s\-]?\d{4}\b'),  # Банковская карта: 16 цифр
+    # ИНН: два шаблона с фиксированной длиной маски вместо проверки len() после совпадения
+    'inn10': _compile(r'\b\d{10}\b'),  # ИНН организации: 10 цифр
+    'inn12': _compile(r'\b\d{12}\b'),  # ИНН физического лица: 12 цифр
+    'snils': _compile(r'\b\d{3}[\s\-]?\d{3}[\s\-]?\d{3}[\s\-]?\d{2}\b'),  # СНИЛС: 11 цифр
+}
+
+# Все шаблоны одним выражением с именованными группами: текст сканируется один раз,
+# тип найденных данных определяется по match.lastgroup (при совпадении в одной
+# позиции выигрывает шаблон, указанный раньше - как и при последовательных проходах)
+_PII_COMBINED = _compile(
+    '|'.join(f'(?P<{name}>{pattern.pattern})' for name, pattern in _PII_PATTERNS.items())
+)
+# Номера групп телефона в общем выражении: предпоследние и последние 2 цифры
+_PHONE_TAIL_GROUPS = (_PII_COMBINED.groupindex['phone'] + 4, _PII_COMBINED.groupindex['phone'] + 5)
+_PII_NAMES = tuple(_PII_PATTERNS)
+
+
+@lru_cache(maxsize=1)
+def _hyperscan_database():
+    """Компилирует все шаблоны PII в одну базу Hyperscan (id шаблона = индекс в _PII_NAMES)"""
+    database = hyperscan.Database()
+    database.compile(
+        expressions=[_PII_PATTERNS[name].pattern.encode('ascii') for name in _PII_NAMES],
+        ids=list(range(len(_PII_NAMES))),
+        elements=len(_PII_NAMES),
+        # Без SOM_LEFTMOST Hyperscan сообщает только конец совпадения
+        flags=[hyperscan.HS_FLAG_SOM_LEFTMOST] * len(_PII_NAMES),
+    )
+    return database
+
 
 class PIIMasker:
     """
@@ -23,100 +108,186 @@ class PIIMasker:
     """
     
     def __init__(self):
-        # Регулярные выражения для поиска PII
-        self.patterns = {
-            'phone': re.compile(r'(\+?7|8)?[\s\-]?\(?(\d{3})\)?[\s\-]?(\d{3})[\s\-]?(\d{2})[\s\-]?(\d{2})'),
-            'email': re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'),
-            'passport': re.compile(r'\b\d{4}\s?\d{6}\b'),  # Российский паспорт: 4 цифры + 6 цифр
-            'card': re.compile(r'\b\d{4}[\s\-]?\d{4}[\s\-]?\d{4}[\s\-]?\d{4}\b'),  # Банковская карта: 16 цифр
-            'inn': re.compile(r'\b\d{10}\b|\b\d{12}\b'),  # ИНН: 10 или 12 цифр (исправлено: | внутри группы)
-            'snils': re.compile(r'\b\d{3}[\s\-]?\d{3}[\s\-]?\d{3}[\s\-]?\d{2}\b'),  # СНИЛС: 11 цифр
+        # Выражения скомпилированы один раз при импорте модуля
+        self.patterns = _PII_PATTERNS
+        self._combined = _PII_COMBINED
+        self._phone_tail_groups = _PHONE_TAIL_GROUPS
+        # Связанные методы для mask_text: на коротких сообщениях поиск атрибутов
+        # сопоставим по времени с самим регулярным выражением
+        self._combined_sub = _PII_COMBINED.sub
+        self._email_sub = _PII_PATTERNS['email'].sub
+        # Ключ - хэш исходного текста, значение - уже замаскированный текст
+        self._mask_cache: OrderedDict[bytes, str] = OrderedDict()
+        self._replacers = {
+            'phone': lambda match: _PHONE_PREFIX + ''.join(match.group(*self._phone_tail_groups)),
+            'email': lambda match: self._email_mask(match.group()),
+            'passport': lambda match: _PASSPORT_MASK,
+            'card': lambda match: self._card_mask(match.group()),
+            'inn10': lambda match: _INN10_PREFIX + match.group()[-2:],
+            'inn12': lambda match: _INN12_PREFIX + match.group()[-2:],
+            'snils': lambda match: _SNILS_MASK,
         }
     
+    @staticmethod
+    def _phone_mask(penultimate: Optional[str], last: Optional[str]) -> str:
+        # Оставляем последние 4 цифры номера
+        if penultimate is not None and last is not None:
+            return _PHONE_PREFIX + penultimate + last
+        elif penultimate is not None:
+            return _PHONE_PREFIX + penultimate + '**'
+        return '***-***-****'
+    
+    @staticmethod
+    def _email_mask(email: str) -> str:
+        at = email.rfind('@')
+        if at > 0:
+            return email[0] + '***@' + email[at + 1:]
+        return '***@***'
+    
+    @staticmethod
+    def _card_mask(card: str) -> str:
+        # Шаблон карты всегда заканчивается 4 цифрами без разделителей
+        return _CARD_PREFIX + card[-4:]
+    
     def mask_phone(self, text: str) -> str:
         """Маскирует телефонные номера"""
-        def replace_phone(match):
-            groups = match.groups()
-            # groups[0] - код страны (+7 или 8), groups[1] - первые 3 цифры, groups[2] - следующие 3, 
-            # groups[3] - предпоследние 2, groups[4] - последние 2
-            try:
-                if len(groups) >= 5 and groups[3] is not None and groups[4] is not None:
-                    return '***-***-' + groups[3] + groups[4]
-                elif len(groups) >= 4 and groups[3] is not None:
-                    return '***-***-' + groups[3] + '**'
-            except (IndexError, TypeError):
-                pass
-            return '***-***-****'
-        return self.patterns['phone'].sub(replace_phone, text)
+        # groups[3] - предпоследние 2 цифры, groups[4] - последние 2
+        return self.patterns['phone'].sub(lambda match: self._phone_mask(match.group(4), match.group(5)), text)
     
     def mask_email(self, text: str) -> str:
         """Маскирует email адреса"""
-        def replace_email(match):
-            email = match.group(0)
-            parts = email.split('@')
-            if len(parts) == 2:
-                return parts[0][0] + '***@' + parts[1]
-            return '***@***'
-        return self.patterns['email'].sub(replace_email, text)
+        return self._email_sub(self._replacers['email'], text)
     
     def mask_passport(self, text: str) -> str:
         """Маскирует номера паспортов"""
-        return self.patterns['passport'].sub('**** ******', text)
+        return self.patterns['passport'].sub(_PASSPORT_MASK, text)
     
     def mask_card(self, text: str) -> str:
         """Маскирует номера банковских карт"""
-        def replace_card(match):
-            card = match.group(0).replace(' ', '').replace('-', '')
-            if len(card) == 16:
-                return '**** **** **** ' + card[-4:]
-            return '**** **** **** ****'
-        return self.patterns['card'].sub(replace_card, text)
+        return self.patterns['card'].sub(lambda match: self._card_mask(match.group(0)), text)
     
     def mask_inn(self, text: str) -> str:
         """Маскирует ИНН"""
-        def replace_inn(match):
-            inn = match.group(0)
-            if len(inn) == 10:
-                return '********' + inn[-2:]
-            elif len(inn) == 12:
-                return '**********' + inn[-2:]
-            return '**********'
-        return self.patterns['inn'].sub(replace_inn, text)
+        text = self.patterns['inn10'].sub(self._replacers['inn10'], text)
+        return self.patterns['inn12'].sub(self._replacers['inn12'], text)
     
     def mask_snils(self, text: str) -> str:
         """Маскирует СНИЛС"""
-        return self.patterns['snils'].sub('***-***-***-**', text)
+        return self.patterns['snils'].sub(_SNILS_MASK, text)
+    
+    def _mask_span(self, name: str, value: str) -> str:
+        """Маска для найденного фрагмента без объекта match (для результатов Hyperscan)"""
+        if name == 'phone':
+            # Номер всегда заканчивается 4 цифрами (возможно, с разделителем внутри)
+            return _PHONE_PREFIX + ''.join(ch for ch in value[-5:] if ch in _DIGITS)[-4:]
+        if name == 'email':
+            return self._email_mask(value)
+        if name == 'card':
+            return self._card_mask(value)
+        if name == 'inn10':
+            return _INN10_PREFIX + value[-2:]
+        if name == 'inn12':
+            return _INN12_PREFIX + value[-2:]
+        if name == 'passport':
+            return _PASSPORT_MASK
+        return _SNILS_MASK
+    
+    def _mask_with_hyperscan(self, text: str) -> str:
+        data = text.encode('utf-8')
+        events = []
+        _hyperscan_database().scan(
+            data,
+            match_event_handler=lambda pattern_id, start, end, flags, context: events.append((start, pattern_id, -end)),
+        )
+        if not events:
+            return text
+        # Hyperscan сообщает все совпадения; выбираем их как re: самое левое начало,
+        # при равном начале - шаблон, указанный раньше, затем самое длинное (жадное)
+        events.sort()
+        parts = []
+        position = 0
+        for start, pattern_id, negative_end in events:
+            if start < position:
+                continue
+            end = -negative_end
+            parts.append(data[position:start].decode('utf-8'))
+            # Шаблоны совпадают только с ASCII, поэтому границы совпадения - границы символов
+            parts.append(self._mask_span(_PII_NAMES[pattern_id], data[start:end].decode('ascii')))
+            position = end
+        parts.append(data[position:].decode('utf-8'))
+        return ''.join(parts)
+    
+    def mask_batch(self, texts: List[str]) -> List[str]:
+        """
+        Маскирует список текстов (история диалога, логи)
+        
+        При установленном пакете hyperscan все шаблоны ищутся одним SIMD-автоматом
+        (см. mask_text).
+        """
+        return [self.mask_text(text) for text in texts]
+    
+    def _dispatch(self, match) -> str:
+        return self._replacers[match.lastgroup](match)
     
     def mask_text(self, text: str) -> str:
-        """Применяет все маски к тексту"""
-        masked = text
-        masked = self.mask_phone(masked)
-        masked = self.mask_email(masked)
-        masked = self.mask_passport(masked)
-        masked = self.mask_card(masked)
-        masked = self.mask_inn(masked)
-        masked = self.mask_snils(masked)
+        """Применяет все маски к тексту за один проход"""
+        if len(text) > _MASK_CACHE_MAX_CHARS:
+            return self._mask_text(text)
+        key = hashlib.blake2b(text.encode('utf-8'), digest_size=16, key=_MASK_CACHE_SECRET).digest()
+        masked = self._mask_cache.get(key)
+        if masked is not None:
+            self._mask_cache.move_to_end(key)
+            return masked
+        masked = self._mask_text(text)
+        self._mask_cache[key] = masked
+        if len(self._mask_cache) > _MASK_CACHE_SIZE:
+            self._mask_cache.popitem(last=False)
         return masked
+    
+    def _mask_text(self, text: str) -> str:
+        # Быстрая проверка для сообщений без PII: все шаблоны, кроме email, требуют цифр,
+        # email - символа @ (поиск подстроки выполняется в C, без регулярных выражений)
+        if any(digit in text for digit in _DIGITS):
+            if hyperscan is not None:
+                # Поиск целиком в нативном коде; на сообщениях любой длины быстрее re и RE2
+                return self._mask_with_hyperscan(text)
+            return self._combined_sub(self._dispatch, text)
+        if '@' in text:
+            return self._email_sub(self._replacers['email'], text)
+        return text
 
 
-# Глобальный экземпляр маскировщика
-pii_masker = PIIMasker()
+@lru_cache(maxsize=1)
+def get_pii_masker() -> PIIMasker:
+    """Возвращает общий экземпляр маскировщика (создаётся при первом обращении)"""
+    return PIIMasker()
+
+
+def __getattr__(name: str):
+    # Совместимость: from middleware import pii_masker
+    if name == 'pii_masker':
+        return get_pii_masker()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 # ============================================================================
 # Rate Limiting Middleware
 # ============================================================================
 
-from collections import defaultdict
-from datetime import datetime, timedelta
+import math
+import time
+import uuid
+from urllib.parse import urlsplit
 
 
 class RateLimiter:
     """
     Базовый класс для отслеживания лимитов вызовов
     
-    Отслеживает количество вызовов на пользователя (chat_id) с возможностью
-    сброса счетчиков через определенный период времени (окно).
+    Отслеживает количество вызовов на пользователя (chat_id) по алгоритму
+    token bucket: у каждого пользователя есть до limit "жетонов", каждый вызов
+    расходует один, и жетоны равномерно восстанавливаются за окно window_seconds.
+    На пользователя хранится только пара (жетоны, время пополнения).
     """
     
     def __init__(self, limit: int, window_seconds: int = 3600):
@@ -127,18 +298,40 @@ class RateLimiter:
         """
         self.limit = limit
         self.window_seconds = window_seconds
-        # Словарь: chat_id -> список временных меток вызовов
-        self._calls: Dict[int, List[datetime]] = defaultdict(list)
-        self._lock = {}  # Простая блокировка для thread-safety (в реальности нужен asyncio.Lock)
-    
-    def _cleanup_old_calls(self, chat_id: int):
-        """Удаляет вызовы старше окна"""
-        now = datetime.now()
-        cutoff = now - timedelta(seconds=self.window_seconds)
-        self._calls[chat_id] = [
-            call_time for call_time in self._calls[chat_id]
-            if call_time > cutoff
+        # Скорость восстановления: жетонов в секунду
+        self._refill_rate = limit / window_seconds if window_seconds > 0 else float('inf')
+        # Словарь: chat_id -> (жетоны, время последнего пополнения по time.monotonic())
+        # Полная корзина равносильна отсутствию записи, поэтому такие записи удаляются
+        self._buckets: Dict[int, Tuple[float, float]] = {}
+        self._next_prune = time.monotonic() + window_seconds
+    
+    def _refill(self, chat_id: int) -> tuple[float, float]:
+        """Пополняет жетоны за прошедшее время и возвращает (жетоны, текущее время)"""
+        now = time.monotonic()
+        if now >= self._next_prune:
+            self._prune_idle(now)
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            return self.limit, now
+        tokens, last = bucket
+        tokens = tokens + (now - last) * self._refill_rate
+        if tokens >= self.limit:
+            # Пользователь давно не обращался - запись больше не нужна
+            del self._buckets[chat_id]
+            return self.limit, now
+        return tokens, now
+    
+    def _prune_idle(self, now: float):
+        """Удаляет записи пользователей, у которых корзина уже полностью восстановилась"""
+        idle = [
+            chat_id for chat_id, (tokens, last) in self._buckets.items()
+            if tokens + (now - last) * self._refill_rate >= self.limit
         ]
+        for chat_id in idle:
+            del self._buckets[chat_id]
+        self._next_prune = now + self.window_seconds
+        if idle:
+            logger.debug(f"Rate limiter: removed {len(idle)} idle entries, {len(self._buckets)} active")
     
     def check_limit(self, chat_id: int) -> tuple[bool, int, int]:
         """
@@ -147,23 +340,207 @@ class RateLimiter:
         Returns:
             (is_allowed, current_count, limit)
         """
-        self._cleanup_old_calls(chat_id)
-        current_count = len(self._calls[chat_id])
-        is_allowed = current_count < self.limit
+        tokens, now = self._refill(chat_id)
+        # Израсходованные жетоны (частично восстановленный жетон считается израсходованным)
+        current_count = max(0, math.ceil(self.limit - tokens))
+        is_allowed = tokens >= 1
         return is_allowed, current_count, self.limit
     
     def record_call(self, chat_id: int):
         """Записывает вызов для данного chat_id"""
-        now = datetime.now()
-        self._calls[chat_id].append(now)
-        self._cleanup_old_calls(chat_id)
+        tokens, now = self._refill(chat_id)
+        self._buckets[chat_id] = (tokens - 1, now)
+    
+    def try_acquire(self, chat_id: int) -> tuple[bool, int, int]:
+        """
+        Проверяет лимит и, если он не превышен, сразу записывает вызов
+        
+        Проверка и списание жетона выполняются без промежуточных await,
+        поэтому параллельные запросы одного chat_id в event loop не могут
+        пройти проверку одновременно (блокировка не нужна).
+        
+        Returns:
+            (is_allowed, current_count, limit), current_count - до записи вызова
+        """
+        tokens, now = self._refill(chat_id)
+        current_count = max(0, math.ceil(self.limit - tokens))
+        is_allowed = tokens >= 1
+        if is_allowed:
+            self._buckets[chat_id] = (tokens - 1, now)
+        return is_allowed, current_count, self.limit
     
     def reset(self, chat_id: Optional[int] = None):
         """Сбрасывает счетчики для chat_id или для всех"""
         if chat_id is None:
-            self._calls.clear()
+            self._buckets.clear()
+        else:
+            self._buckets.pop(chat_id, None)
+
+
+class RedisRateLimiter:
+    """
+    Лимитер вызовов на sorted set в Redis (скользящее окно)
+    
+    Состояние общее для всех процессов бота и переживает перезапуск:
+    для каждого chat_id хранится sorted set, где score - время вызова.
+    Методы асинхронные (клиент redis.asyncio), чтобы запросы к Redis не блокировали
+    event loop бота. Если Redis недоступен, используется RateLimiter в памяти процесса.
+    """
+    
+    def __init__(self, limit: int, window_seconds: int, redis, key_prefix: str = "rate_limit"):
+        """
+        Args:
+            limit: Максимальное количество вызовов в окне
+            window_seconds: Размер окна в секундах
+            redis: Клиент redis.asyncio.Redis
+            key_prefix: Префикс ключей (разный для разных лимитов)
+        """
+        from redis.exceptions import RedisError
+        
+        self.limit = limit
+        self.window_seconds = window_seconds
+        self._redis = redis
+        self._key_prefix = key_prefix
+        self._redis_error = RedisError
+        # Лимиты на время недоступности Redis
+        self._fallback = RateLimiter(limit, window_seconds)
+        self._redis_available = True
+    
+    def _key(self, chat_id: int) -> str:
+        return f"{self._key_prefix}:{chat_id}"
+    
+    def _on_redis_error(self, exc: Exception):
+        if self._redis_available:
+            logger.warning(f"⚠️ Redis rate limiter '{self._key_prefix}' unavailable, using in-process limits: {exc}")
+        self._redis_available = False
+    
+    def _on_redis_ok(self):
+        if not self._redis_available:
+            logger.info(f"Redis rate limiter '{self._key_prefix}' is available again")
+        self._redis_available = True
+    
+    async def check_limit(self, chat_id: int) -> tuple[bool, int, int]:
+        """
+        Проверяет, не превышен ли лимит для данного chat_id
+        
+        Returns:
+            (is_allowed, current_count, limit)
+        """
+        key = self._key(chat_id)
+        # Время общее для всех процессов, поэтому time.time(), а не time.monotonic()
+        cutoff = time.time() - self.window_seconds
+        try:
+            pipe = self._redis.pipeline()
+            pipe.zremrangebyscore(key, 0, cutoff)
+            pipe.zcard(key)
+            pipe.expire(key, self.window_seconds)
+            _, current_count, _ = await pipe.execute()
+        except self._redis_error as exc:
+            self._on_redis_error(exc)
+            return self._fallback.check_limit(chat_id)
+        self._on_redis_ok()
+        is_allowed = current_count < self.limit
+        return is_allowed, current_count, self.limit
+    
+    async def record_call(self, chat_id: int):
+        """Записывает вызов для данного chat_id"""
+        key = self._key(chat_id)
+        try:
+            pipe = self._redis.pipeline()
+            # uuid в качестве member: одновременные вызовы с одинаковым временем не схлопываются
+            pipe.zadd(key, {uuid.uuid4().hex: time.time()})
+            pipe.expire(key, self.window_seconds)
+            await pipe.execute()
+        except self._redis_error as exc:
+            self._on_redis_error(exc)
+            self._fallback.record_call(chat_id)
+            return
+        self._on_redis_ok()
+    
+    async def try_acquire(self, chat_id: int) -> tuple[bool, int, int]:
+        """
+        Проверяет лимит и, если он не превышен, сразу записывает вызов
+        
+        Вызов добавляется в одной транзакции (MULTI/EXEC) с подсчетом, поэтому
+        процессы не могут одновременно пройти проверку; если лимит превышен,
+        запись удаляется.
+        
+        Returns:
+            (is_allowed, current_count, limit), current_count - до записи вызова
+        """
+        key = self._key(chat_id)
+        member = uuid.uuid4().hex
+        now = time.time()
+        try:
+            pipe = self._redis.pipeline(transaction=True)
+            pipe.zremrangebyscore(key, 0, now - self.window_seconds)
+            pipe.zadd(key, {member: now})
+            pipe.zcard(key)
+            pipe.expire(key, self.window_seconds)
+            _, _, count_after, _ = await pipe.execute()
+            if count_after > self.limit:
+                await self._redis.zrem(key, member)
+        except self._redis_error as exc:
+            self._on_redis_error(exc)
+            return self._fallback.try_acquire(chat_id)
+        self._on_redis_ok()
+        return count_after <= self.limit, count_after - 1, self.limit
+    
+    async def reset(self, chat_id: Optional[int] = None):
+        """Сбрасывает счетчики для chat_id или для всех"""
+        self._fallback.reset(chat_id)
+        try:
+            if chat_id is None:
+                keys = [key async for key in self._redis.scan_iter(match=f"{self._key_prefix}:*")]
+                if keys:
+                    await self._redis.delete(*keys)
+            else:
+                await self._redis.delete(self._key(chat_id))
+        except self._redis_error as exc:
+            self._on_redis_error(exc)
+
+
+# Таймауты Redis: при недоступном сервере запрос пользователя не должен ждать долго
+_REDIS_SOCKET_TIMEOUT = 1.0
+_REDIS_CONNECT_TIMEOUT = 1.0
+
+
+def _redis_location(redis_url: str) -> str:
+    """Хост и порт из URL Redis для логов (без логина и пароля)"""
+    parsed = urlsplit(redis_url)
+    if parsed.hostname is None:
+        return f"{parsed.scheme}://"
+    return f"{parsed.hostname}:{parsed.port or 6379}"
+
+
+def create_rate_limiter(limit: int, window_seconds: int, redis_url: Optional[str] = None,
+                        key_prefix: str = "rate_limit"):
+    """
+    Создает лимитер: RedisRateLimiter, если задан redis_url, иначе RateLimiter в памяти процесса
+    
+    Если пакет redis не установлен, используется RateLimiter.
+    """
+    if redis_url:
+        try:
+            import redis.asyncio as redis_asyncio
+        except ImportError:
+            logger.warning("⚠️ redis package is not installed, falling back to in-process rate limiter")
         else:
-            self._calls.pop(chat_id, None)
+            client = redis_asyncio.Redis.from_url(
+                redis_url,
+                socket_timeout=_REDIS_SOCKET_TIMEOUT,
+                socket_connect_timeout=_REDIS_CONNECT_TIMEOUT,
+            )
+            logger.info(f"Rate limiter '{key_prefix}' uses Redis at {_redis_location(redis_url)}")
+            return RedisRateLimiter(limit, window_seconds, client, key_prefix=key_prefix)
+    return RateLimiter(limit, window_seconds)
+
+
+async def _try_acquire(limiter, chat_id: int) -> tuple[bool, int, int]:
+    """try_acquire для любого лимитера (у RedisRateLimiter метод асинхронный)"""
+    if isinstance(limiter, RedisRateLimiter):
+        return await limiter.try_acquire(chat_id)
+    return limiter.try_acquire(chat_id)
 
 
 class ModelCallLimitMiddleware:
@@ -174,23 +551,24 @@ class ModelCallLimitMiddleware:
     прерывает выполнение при превышении лимита.
     """
     
-    def __init__(self, limit: int = 10, window_seconds: int = 3600):
+    def __init__(self, limit: int = 10, window_seconds: int = 3600, redis_url: Optional[str] = None):
         """
         Args:
             limit: Максимальное количество вызовов модели в окне (по умолчанию 10)
             window_seconds: Размер окна в секундах (по умолчанию 1 час = 3600)
+            redis_url: URL Redis для общего между процессами лимита (None - лимит в памяти процесса)
         """
-        self.limiter = RateLimiter(limit, window_seconds)
+        self.limiter = create_rate_limiter(limit, window_seconds, redis_url, key_prefix="model_calls")
         logger.info(f"🔒 ModelCallLimitMiddleware initialized: limit={limit}, window={window_seconds}s")
     
-    def check_and_record(self, chat_id: int) -> tuple[bool, str]:
+    async def check_and_record(self, chat_id: int) -> tuple[bool, str]:
         """
         Проверяет лимит и записывает вызов
         
         Returns:
             (is_allowed, error_message)
         """
-        is_allowed, current_count, limit = self.limiter.check_limit(chat_id)
+        is_allowed, current_count, limit = await _try_acquire(self.limiter, chat_id)
         
         if not is_allowed:
             error_msg = (
@@ -200,7 +578,6 @@ class ModelCallLimitMiddleware:
             logger.warning(f"🚫 Model call limit exceeded for chat {chat_id}: {current_count}/{limit}")
             return False, error_msg
         
-        self.limiter.record_call(chat_id)
         logger.debug(f"✓ Model call recorded for chat {chat_id}: {current_count + 1}/{limit}")
         return True, ""
 
@@ -213,16 +590,17 @@ class ToolCallLimitMiddleware:
     прерывает выполнение при превышении лимита.
     """
     
-    def __init__(self, limit: int = 20, window_seconds: int = 3600):
+    def __init__(self, limit: int = 20, window_seconds: int = 3600, redis_url: Optional[str] = None):
         """
         Args:
             limit: Максимальное количество вызовов инструментов в окне (по умолчанию 20)
             window_seconds: Размер окна в секундах (по умолчанию 1 час = 3600)
+            redis_url: URL Redis для общего между процессами лимита (None - лимит в памяти процесса)
         """
-        self.limiter = RateLimiter(limit, window_seconds)
+        self.limiter = create_rate_limiter(limit, window_seconds, redis_url, key_prefix="tool_calls")
         logger.info(f"🔒 ToolCallLimitMiddleware initialized: limit={limit}, window={window_seconds}s")
     
-    def check_and_record(self, chat_id: int, tool_name: str = None) -> tuple[bool, str]:
+    async def check_and_record(self, chat_id: int, tool_name: str = None) -> tuple[bool, str]:
         """
         Проверяет лимит и записывает вызов инструмента
         
@@ -233,7 +611,7 @@ class ToolCallLimitMiddleware:
         Returns:
             (is_allowed, error_message)
         """
-        is_allowed, current_count, limit = self.limiter.check_limit(chat_id)
+        is_allowed, current_count, limit = await _try_acquire(self.limiter, chat_id)
         
         if not is_allowed:
             error_msg = (
@@ -243,7 +621,6 @@ class ToolCallLimitMiddleware:
             logger.warning(f"🚫 Tool call limit exceeded for chat {chat_id}: {current_count}/{limit} (tool: {tool_name})")
             return False, error_msg
         
-        self.limiter.record_call(chat_id)
         logger.debug(f"✓ Tool call recorded for chat {chat_id}: {current_count + 1}/{limit} (tool: {tool_name})")
         return True, ""
 